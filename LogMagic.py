@@ -1,39 +1,251 @@
-import re
+import itertools
 from . import core
+from . import patterns
+from . import profiles
+from . import runlog
 from . import utils
 import os
 
+LIVE_SYNC_DELAY_MS = 300
+FOLLOW_LOG_INTERVAL_MS = 500
+MAX_OUTPUT_ITEMS = 1000
+
+# view id => (syntax, profile) so the profile is only resolved again when the syntax changes
+_view_profiles = {}
+
+def get_view_profile(view):
+    "Return the language profile for the view's syntax or None if there is no matching profile"
+    syntax = view.settings().get('syntax')
+    cached = _view_profiles.get(view.id())
+    if cached and cached[0] == syntax: return cached[1]
+    profile = profiles.resolve_profile(view.scope_name(0))
+    _view_profiles[view.id()] = (syntax, profile)
+    return profile
+
+def get_profile_at(view, point):
+    "Return the view's profile or, for code embedded in other syntaxes, the profile of the scope at point"
+    return get_view_profile(view) or profiles.resolve_profile(view.scope_name(point)) or profiles.default_profile()
+
+# view id => {region key: record} of log statements kept in sync with the line they log.
+# The regions are empty markers at the start of the source and the statement line so Sublime
+# keeps track of where they moved.
+_synced = {}
+_sync_keys = itertools.count()
+# view id => number of modifications, used to debounce syncing
+_modifications = {}
+
+def track_log_statement(view, source_region, statement_region, source, statement, take_inner, profile):
+    "Keep the log statement on statement_region in sync with the source line on source_region"
+    key = 'log_magic_sync_%d' % next(_sync_keys)
+    view.add_regions(key + '_source', [sublime.Region(source_region.a)], '', '', sublime.HIDDEN)
+    view.add_regions(key + '_log', [sublime.Region(statement_region.a)], '', '', sublime.HIDDEN)
+    _synced.setdefault(view.id(), {})[key] = {
+        'source': source,
+        'statement': statement,
+        'take_inner': take_inner,
+        'profile': profile
+    }
+
+def untrack_log_statement(view, key):
+    view.erase_regions(key + '_source')
+    view.erase_regions(key + '_log')
+    tracked = _synced.get(view.id(), {})
+    tracked.pop(key, None)
+    if not tracked: _synced.pop(view.id(), None)
+
+def sync_log_statements(view):
+    """
+    Regenerate the tracked log statements whose source line changed since the last sync.
+    Only changed source lines are parsed again and only statements that came out different are replaced.
+    """
+    tracked = _synced.get(view.id())
+    if not tracked: return
+    settings = utils.load_settings()
+    filename = os.path.basename(view.file_name() or '')
+    replacements = []
+    for (key, record) in list(tracked.items()):
+        source_points = view.get_regions(key + '_source')
+        log_points = view.get_regions(key + '_log')
+        if not source_points or not log_points:
+            untrack_log_statement(view, key)
+            continue
+        source_region = view.line(source_points[0].a)
+        source = view.substr(source_region)
+        if source == record['source'] or not source.strip(): continue
+        log_region = view.line(log_points[0].a)
+        log_line = view.substr(log_region)
+        if log_region == source_region or log_line.strip() != record['statement'] or utils.is_log_statement(source, record['profile']):
+            # Edited or deleted by hand, leave it alone from now on
+            untrack_log_statement(view, key)
+            continue
+        record['source'] = source
+        lineno = view.rowcol(log_region.a)[0] + 1
+        statement = core.create_log_statement_cached(source, filename, lineno, record['take_inner'], record['profile'], settings)
+        if statement == record['statement']: continue
+        indent = len(log_line) - len(log_line.lstrip())
+        replacements.append([log_region.a + indent, log_region.b, record['statement'], statement])
+        record['statement'] = statement
+    if replacements:
+        view.run_command('log_magic_live_sync', {'replacements': replacements})
+
+def schedule_sync(view):
+    "Sync the view's log statements once it hasn't been modified for LIVE_SYNC_DELAY_MS"
+    view_id = view.id()
+    count = _modifications[view_id] = _modifications.get(view_id, 0) + 1
+    def sync():
+        if _modifications.get(view_id) == count: sync_log_statements(view)
+    sublime.set_timeout_async(sync, LIVE_SYNC_DELAY_MS)
+
 def log_statement_command(view, edit, direction = 'down'):
     """
     Insert the log statement after or before the current line or cycles the log statement type
     if the cursor is on a log statement line.
     """
 
-    for (line_region, line) in utils.get_current_lines(view):
-        flowtype_enabled = 'source.js' in view.scope_name(line_region.a)
+    # Parse all cursor lines in one batch. Every inserted statement pushes the following
+    # cursors down by one line so account for that in lineno.
+    filename = os.path.basename(view.file_name())
+    settings = utils.load_settings()
+    jobs = []
+    line_profiles = []
+    for (i, (line_region, line)) in enumerate(utils.get_current_lines(view)):
+        profile = profiles.for_settings(get_profile_at(view, line_region.a), settings)
+        line_profiles.append(profile)
+        if utils.is_log_statement(line, profile): break
+        # Statements spanning several lines are parsed as one and logged after (or before) all of them
+        statement_region, statement = utils.expand_statement(view, line_region, profile)
+        line_nr, col_nr = view.rowcol(direction == 'down' and statement_region.b or statement_region.a)
+        lineno = line_nr + i + (direction == 'down' and 2 or 1)
+        jobs.append((statement, filename, lineno, direction == 'down', profile.flowtype, profile.name))
+    last_over_budget = core.over_budget and core.over_budget[-1]
+    statements = core.create_log_statements(jobs, settings = settings)
+    if core.over_budget and core.over_budget[-1] is not last_over_budget:
+        sublime.status_message("LogMagic: Line %d took longer than max_parse_ms to parse" % core.over_budget[-1]['lineno'])
 
-        if utils.is_log_statement(line):
-            return core.cycle_log_types(view, edit, line_region, line, direction)
+    inserted = []
+    for (i, (line_region, line)) in enumerate(utils.get_current_lines(view)):
+        if i >= len(statements):
+            return core.cycle_log_types(view, edit, line_region, line, direction, line_profiles[i])
+        line_region, line = utils.expand_statement(view, line_region, line_profiles[i])
+        statement_region = insert_log_statement(view, edit, line_region, direction, statements[i], line_profiles[i])
+        inserted.append(statement_region)
+        if settings['live_sync'] and view.rowcol(line_region.a)[0] == view.rowcol(line_region.b)[0]:
+            source_region = direction == 'down' and line_region or view.line(statement_region.b + 1)
+            track_log_statement(view, source_region, statement_region, line, statements[i], direction == 'down', line_profiles[i])
 
-        line_nr, col_nr = view.rowcol(line_region.a)
-        filename = os.path.basename(view.file_name())
-        lineno = line_nr + (direction == 'down' and 2 or 1)
+    # Move cursor(s) to end of log statement(s)
 
-        statement = core.create_log_statement(line, filename, lineno, direction == 'down', flowtype_enabled)
-        insert_log_statement(view, edit, line_region, direction, statement)
+    view.sel().clear()
+    for statement_region in inserted:
+        view.sel().add(sublime.Region(statement_region.b - 1))
 
-    # Move cursor(s) to end of log statement(s)
 
-    selections = list(view.sel())
+def log_assignments_command(view, edit):
+    """
+    Insert one log statement after every selection, logging everything assigned
+    in the selected lines. Each selection's lines are parsed as one batch.
+    """
+    filename = os.path.basename(view.file_name() or '')
+    settings = utils.load_settings()
+    inserted = []
+    shift = 0 # Statements inserted for earlier selections push the later ones down
+    for region in list(view.sel()):
+        region = sublime.Region(region.begin() + shift, region.end() + shift)
+        profile = profiles.for_settings(get_profile_at(view, region.a), settings)
+        line_regions = utils.get_selected_lines(view, region)
+        last_region, last_line = utils.expand_statement(view, line_regions[-1], profile)
+        lineno = view.rowcol(last_region.b)[0] + 2
+        lines = [view.substr(line_region) for line_region in line_regions[:-1]] + [last_line]
+        statement = core.create_assignments_log_statement(lines, filename, lineno, settings, profile)
+        if statement is None: continue
+        size = view.size()
+        inserted.append(insert_log_statement(view, edit, last_region, 'down', statement, profile))
+        shift += view.size() - size
+
+    if not inserted:
+        return sublime.status_message("LogMagic: Nothing is assigned in the selection")
     view.sel().clear()
-    for s in selections:
-        line = view.full_line(s.a)
-        line_to_select = direction == 'down' and view.full_line(line.b + 1) or view.full_line(line.a - 1)
-        view.sel().add(sublime.Region(line_to_select.b - 2))
+    for statement_region in inserted:
+        view.sel().add(sublime.Region(statement_region.b - 1))
 
+def cycle_variants_command(view, edit):
+    "Cycle the log statements on the cursor lines through their sampled and rate limited variants"
+    settings = utils.load_settings()
+    counters = utils.unused_counter_names(view.substr(sublime.Region(0, view.size())))
+    count = 0
+    lines = dict((line_region.a, (line_region, line)) for (line_region, line) in utils.get_current_lines(view))
+    for point in sorted(lines, reverse = True): # Each line once and back to front so the regions stay valid
+        line_region, line = lines[point]
+        profile = profiles.for_settings(get_profile_at(view, line_region.a), settings)
+        new_line = core.cycle_log_variant(line, next(counters), settings, profile)
+        if new_line is None: continue
+        view.replace(edit, line_region, new_line)
+        count += 1
+    if not count:
+        sublime.status_message("LogMagic: No log statements with variants on the cursor lines")
 
-def insert_log_statement(view, edit, line_region, direction, statement):
+def timing_probe_command(view, edit, kind = None):
+    """
+    Wrap every selection, or the function around every empty selection, in a timing probe.
+    kind picks the probe (see profiles.PROFILE_SPECS' timing_probes), by default console.time/timeEnd.
+    Function bodies are wrapped in try/finally so the end probe runs on every return (see core.wrap_in_timing_probe).
+    """
+    filename = os.path.basename(view.file_name() or '')
+    settings = utils.load_settings()
+    get_line = lambda row: view.substr(view.line(view.text_point(row, 0)))
+    get_indent = lambda line: line[ : len(line) - len(line.lstrip())]
+    last_row = view.rowcol(view.size())[0]
+    edits = [] # (start, end, text), inserts being empty
+    wrapped = set() # Rows opening functions already wrapped
+    count = 0
+    for region in view.sel():
+        profile = profiles.for_settings(get_profile_at(view, region.a), settings)
+        if kind and kind not in profile.timing_probes or not profile.probe_kinds:
+            sublime.status_message("LogMagic: No %s timing probes for %s" % (kind or '', profile.name))
+            continue
+
+        if region.empty():
+            found = utils.find_function(get_line, view.rowcol(region.a)[0], last_row, profile)
+            if not found or found[0] == found[1]:
+                sublime.status_message("LogMagic: No function around the cursor")
+                continue
+            first, last = found[0], found[1]
+            if first in wrapped: continue
+            start, end = core.create_timing_probe(
+                utils.find_statement(get_line, first, last_row, profile)[2], filename, first + 1, kind, settings, profile)
+            body = [get_line(row) for row in range(first + 1, last)]
+            lines = core.wrap_in_timing_probe(body, start, end, get_indent(get_line(first)), profile)
+            if lines is None:
+                sublime.status_message("LogMagic: Can't time whole functions in %s, select the code to time instead" % profile.name)
+                continue
+            wrapped.add(first)
+            edits.append((view.text_point(first + 1, 0), view.text_point(last, 0), '\n'.join(lines) + '\n'))
+        else:
+            lines = utils.get_selected_lines(view, region)
+            first_region, first_line = utils.expand_statement(view, lines[0], profile)
+            last_region = utils.expand_statement(view, lines[-1], profile)[0]
+            first_row = view.rowcol(first_region.a)[0]
+            point = max(last_region.b, first_region.b)
+            if (first_row and utils.is_braceless_header(get_line(first_row - 1), profile)
+                    or utils.is_braceless_header(get_line(view.rowcol(point)[0]), profile)):
+                sublime.status_message("LogMagic: Can't time a braceless if or loop body, add braces first")
+                continue
+            start, end = core.create_timing_probe(
+                first_line, filename, first_row + 1, kind, settings, profile)
+            indent = get_indent(view.substr(first_region))
+            edits.append((first_region.a, first_region.a, indent + start + '\n'))
+            edits.append((point, point, '\n' + indent + end))
+        count += 1
+
+    # Back to front so the points stay valid. Of the texts inserted at the same point the first one ends up first.
+    for (i, (a, b, text)) in sorted(enumerate(edits), key = lambda item: (item[1][0], item[0]), reverse = True):
+        view.replace(edit, sublime.Region(a, b), text)
+    if count: sublime.status_message("LogMagic: Added %d timing probes" % count)
+
+def insert_log_statement(view, edit, line_region, direction, statement, profile = None):
+    "Insert statement below or above line_region and return the region of the inserted line"
     import sublime
+    if profile is None: profile = profiles.default_profile()
     if direction == 'down':
         insert_point = line_region.b
         newline_tmpl = "\n%s"
@@ -55,7 +267,7 @@ def insert_log_statement(view, edit, line_region, direction, statement):
     def get_indent_of_line(region):
         "Return the indentation of the line marked by region"
         line = view.substr(region)
-        matches = re.findall(r'^(\s*)[^\s]', line)
+        matches = patterns.INDENT_RE.findall(line)
         return matches and len(matches) and matches[0] or ''
 
 
@@ -64,7 +276,7 @@ def insert_log_statement(view, edit, line_region, direction, statement):
     if direction == 'down': # Add extra indent if opening new block
         indentline_region = find_next_line_with_content(indentline_region)
         indent_line = view.substr(indentline_region).strip()
-        should_indent = [True for i in utils.INDENT_ENDINGS if indent_line.endswith(i)]
+        should_indent = indent_line.endswith(profile.indent_endings)
         indent_line.lstrip('{}[]() \t')
         if should_indent:
             indent_str += len(indent_str) and indent_str[0] == '\t' and '\t' or '  ' # Umm.. just assume 2 spaces if using spaces
@@ -73,25 +285,113 @@ def insert_log_statement(view, edit, line_region, direction, statement):
     statement = newline_tmpl % statement
 
     view.insert(edit, insert_point, statement)
+    return view.line(direction == 'down' and insert_point + 1 or insert_point)
 
 def remove_all_command(view, edit):
+    """
+    Remove all log statements, including commented out ones, with one search of the view's text.
+    Function bodies timed by a probe lose its try/finally too (see utils.find_log_removals).
+    """
+    profile = profiles.for_settings(get_profile_at(view, 0), utils.load_settings())
+    regions, count = utils.find_log_removals(view.substr(sublime.Region(0, view.size())), profile)
+    for (a, b) in reversed(regions): # Back to front so the offsets stay valid
+        view.erase(edit, sublime.Region(a, b))
 
-    def findLogs():
-        while True:
-            region = view.find(r'^\s*console\.', 0)
-            if region: yield region
-            else: break
+    if count:
+        sublime.status_message("LogMagic: Removed %d log statements" % count)
+    else:
+        sublime.status_message("LogMagic: No log statements found")
 
-    count = 0
-    for region in findLogs():
-        view.erase(edit, view.full_line(region))
-        count += 1
+def toggle_all_command(view, edit, action = None):
+    """
+    Comment out all log statements (action 'comment') or restore the commented out ones (action 'restore').
+    Without an action log statements are commented out if there are any and restored otherwise.
+    All lines are found with one search of the view's text and changed within the one edit, so it's one undo step.
+    """
+    profile = profiles.for_settings(get_profile_at(view, 0), utils.load_settings())
+    text = view.substr(sublime.Region(0, view.size()))
+    points = action != 'restore' and utils.find_log_comment_points(text, profile) or []
+    if points:
+        for point in reversed(points):
+            view.insert(edit, point, profile.log_comment)
+        sublime.status_message("LogMagic: Commented out %d log statements" % len(points))
+        return
 
-    if count > 0:
-        sublime.status_message("LogMagic: Removed %d log statements" % count)
+    markers = action != 'comment' and utils.find_log_comments(text, profile) or []
+    for (a, b) in reversed(markers):
+        view.erase(edit, sublime.Region(a, b))
+    if markers:
+        sublime.status_message("LogMagic: Restored %d log statements" % len(markers))
     else:
         sublime.status_message("LogMagic: No log statements found")
 
+# window id => (runlog.LogFile, runlog.SourceIndex) of the log file followed in that window
+_followed_logs = {}
+
+def follow_log(window, path):
+    """
+    Index the log file at path and keep indexing what gets appended to it while the window is open.
+    Its output is mapped to the log statements in the window's folders.
+    """
+    window_id = window.id()
+    followed = _followed_logs[window_id] = (runlog.LogFile(path), runlog.SourceIndex(window.folders(), utils.load_settings()))
+    def poll():
+        if _followed_logs.get(window_id) is not followed: return # Replaced by another log file
+        if window_id not in [w.id() for w in sublime.windows()]:
+            _followed_logs.pop(window_id, None)
+            return
+        entries = followed[0].update()
+        if entries: sublime.status_message("LogMagic: %d new output lines in %s" % (entries, os.path.basename(path)))
+        sublime.set_timeout_async(poll, FOLLOW_LOG_INTERVAL_MS)
+    sublime.set_timeout_async(poll, 0)
+
+def get_followed_log(window):
+    "Return the (runlog.LogFile, runlog.SourceIndex) followed in window or None"
+    followed = window and _followed_logs.get(window.id())
+    if not followed: sublime.status_message("LogMagic: Not following a log file, run LogMagic Follow log file first")
+    return followed
+
+def jump_to_output_command(window):
+    "List the latest output lines with labels and jump to the log statement that printed the chosen one"
+    followed = get_followed_log(window)
+    if not followed: return
+    log, sources = followed
+    lines = log.recent(MAX_OUTPUT_ITEMS)
+    if not lines:
+        sublime.status_message("LogMagic: No output with labels in %s yet" % log.path)
+        return
+
+    def on_done(index):
+        if index == -1: return
+        sources.update()
+        found = sources.locate(lines[index][1])
+        if not found:
+            sublime.status_message("LogMagic: No log statement found for that output line")
+            return
+        window.open_file('%s:%d' % found[0], sublime.ENCODED_POSITION)
+    window.show_quick_panel([line.strip() for (lineno, line) in lines], on_done)
+
+def show_output_command(view):
+    "List the output of the log statements on the cursor lines and open the log file at the chosen line"
+    window = view.window()
+    followed = get_followed_log(window)
+    if not followed: return
+    log = followed[0]
+    settings = utils.load_settings()
+    found = set()
+    for (line_region, line) in utils.get_current_lines(view):
+        profile = profiles.for_settings(get_profile_at(view, line_region.a), settings)
+        keys = profile.is_log_statement(line) and runlog.statement_keys(line, profile)
+        if keys: found.update(log.lines(keys[0])) # The location if it logs one, it's the most specific
+    if not found:
+        sublime.status_message("LogMagic: No output of the log statements on the cursor lines")
+        return
+
+    lines = sorted(found, reverse = True)[ : MAX_OUTPUT_ITEMS]
+    def on_done(index):
+        if index != -1: window.open_file('%s:%d' % (log.path, lines[index][0]), sublime.ENCODED_POSITION)
+    window.show_quick_panel(['%d: %s' % (lineno, line.strip()) for (lineno, line) in lines], on_done)
+
 import sublime, sublime_plugin
 
 class LogMagicDownCommand(sublime_plugin.TextCommand):
@@ -102,7 +402,55 @@ class LogMagicUpCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         log_statement_command(self.view, edit, 'up')
 
+class LogMagicLogAssignmentsCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        log_assignments_command(self.view, edit)
+
+class LogMagicCycleVariantCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        cycle_variants_command(self.view, edit)
+
+class LogMagicTimingProbeCommand(sublime_plugin.TextCommand):
+    def run(self, edit, kind = None):
+        timing_probe_command(self.view, edit, kind)
+
 class LogMagicRemoveAllCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         remove_all_command(self.view, edit)
 
+class LogMagicToggleAllCommand(sublime_plugin.TextCommand):
+    def run(self, edit, action = None):
+        toggle_all_command(self.view, edit, action)
+
+class LogMagicFollowLogCommand(sublime_plugin.WindowCommand):
+    def run(self, path = None):
+        if path: return follow_log(self.window, path)
+        followed = _followed_logs.get(self.window.id())
+        self.window.show_input_panel(
+            "Follow log file:", followed and followed[0].path or '',
+            lambda path: path and follow_log(self.window, os.path.expanduser(path)), None, None)
+
+class LogMagicJumpToOutputCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        jump_to_output_command(self.window)
+
+class LogMagicShowOutputCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        show_output_command(self.view)
+
+class LogMagicLiveSyncCommand(sublime_plugin.TextCommand):
+    "Replace synced log statements, skipping any that changed since the replacement was computed"
+    def run(self, edit, replacements):
+        for (a, b, old, new) in sorted(replacements, reverse = True):
+            region = sublime.Region(a, b)
+            if self.view.substr(region) == old:
+                self.view.replace(edit, region, new)
+
+class LogMagicViewListener(sublime_plugin.EventListener):
+    def on_modified_async(self, view):
+        if view.id() in _synced: schedule_sync(view)
+
+    def on_close(self, view):
+        _view_profiles.pop(view.id(), None)
+        _synced.pop(view.id(), None)
+        _modifications.pop(view.id(), None)
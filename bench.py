@@ -0,0 +1,208 @@
+"""
+Benchmark create_log_statement over a corpus of typical lines.
+
+    python -m LogMagic.bench [--rounds N] [--cold-re] [corpus files...]
+    python -m LogMagic.bench --memory [--max-peak BYTES] [--max-stage-peak STAGE=BYTES ...] [corpus files...]
+
+Corpus files are plain source files; every non-empty line is benchmarked (flowtype is
+enabled unless the file ends with .coffee). Without files the built-in CORPUS is used.
+--cold-re purges the `re` module's pattern cache before every call, like other plugins
+sharing Sublime's interpreter do.
+
+--memory traces allocations with tracemalloc instead of timing. For every stage (see STAGES) it
+reports the peak of memory allocated while the stage ran, i.e. the garbage it creates, per call
+and per line. The thresholds make it exit with 1 so CI can catch regressions.
+"""
+
+import re, sys, time
+from . import core
+from . import utils
+
+# (line, flowtype_enabled)
+CORPUS = [
+    ('var foo = 1', True),
+    ('var obj = getObj(1, 2)', True),
+    ('obj = getObj 1, 2', False),
+    ('var foo = fn(1, 2) + b', True),
+    ('var {a, b} = getObj(1, 2)', True),
+    ('var {a:c, b:d} = getObj(1, 2)', True),
+    ('var [a, b, ...rest] = getArr(1, 2)', True),
+    ('let {[a]: b} = getObj()', True),
+    ('var obj:{a:String, b:Number} = {a:"foo", b:1}', True),
+    ('return fn(1, 2) + b', True),
+    ('} else if(a) {', True),
+    ('if(fn(1, 2) + b)', True),
+    ('fn(a, {b:d, c:f})', True),
+    ('fn a, fn(b, c) ', False),
+    ('export default function fn(a, b) {', True),
+    ('fn = (a, b) ->', False),
+    ('fn: =>', False),
+    ('fn(a, b): any {', True),
+    ('function fn({a = 5, b = 10} = {}) {', True),
+    ('fn(a: Number, b: Number = 25) {', True),
+    ('fn({a: value1, b: value2} = {}) {', True),
+    ('fn({a, b = 25}:SomeType = {}) {', True),
+    ('fn(a, b).then(function(a) {', True),
+    ('fn(a, b).then(a => { 1 })', True),
+    ('success: ({a = 5, b = 10}) => {', True),
+    ('$ctrl.onUpdate({ $event: { dates: event.dates } });', True),
+    ('import {a, b as c} from "foo"', True),
+    ('for (let i = 0; i < items.length; i++) {', True),
+    ('const total = items.reduce((sum, item) => sum + item.price * item.count, 0)', True),
+    ('this.setState({loading: false, items: response.data.items, error: null})', True),
+]
+
+def load_corpus(paths):
+    "Return (line, flowtype_enabled) for all non-empty lines in the given files"
+    corpus = []
+    for path in paths:
+        flowtype_enabled = not path.endswith('.coffee')
+        with open(path, encoding = 'utf-8', errors = 'replace') as f:
+            corpus.extend((line.rstrip('\r\n'), flowtype_enabled) for line in f if line.strip())
+    return corpus
+
+def run_corpus(corpus, settings, cold_re = False):
+    "Parse every corpus line once in both directions"
+    for (i, (line, flowtype_enabled)) in enumerate(corpus):
+        for take_inner in (True, False):
+            if cold_re: re.purge()
+            core.create_log_statement(line, 'bench.js', i + 1, take_inner, flowtype_enabled, settings)
+
+def benchmark(corpus, rounds = 5, cold_re = False):
+    "Return the best time per create_log_statement call in microseconds"
+    settings = dict(utils.load_settings(), max_parse_ms = 0)
+    best = None
+    for round in range(rounds):
+        start = time.perf_counter()
+        run_corpus(corpus, settings, cold_re)
+        elapsed = time.perf_counter() - start
+        best = best is None and elapsed or min(best, elapsed)
+    return best / (len(corpus) * 2) * 1000000
+
+# (module, function name) of the parser stages traced by --memory, outermost first
+STAGES = [
+    (core, 'create_log_statement'),
+    (core, 'parse_line'),
+    (core, 'format_log_statement'),
+    (core, 'clean_line'),
+    (core, 'parse_params'),
+    (core, 'clean_param'),
+    (utils, 'remove_strings'),
+    (utils, 'find_strings'),
+    (utils, 'find_not_in_string'),
+    (utils, 'find_all_not_in_parens_or_strings'),
+]
+
+class AllocationProfiler(object):
+    """
+    Wraps the STAGES functions to record the peak of traced memory above what was allocated
+    when each call started. Nested stages reset the peak, so the peak they saw is handed back
+    to the enclosing stage.
+    """
+
+    def __init__(self):
+        self.peaks = {} # stage => list of peaks in bytes, one per call
+        self.hidden = [] # highest peak of each running stage that a nested stage reset
+
+    def wrap(self, name, function):
+        import tracemalloc
+        def traced(*args, **kwargs):
+            current, peak = tracemalloc.get_traced_memory()
+            if self.hidden: self.hidden[-1] = max(self.hidden[-1], peak)
+            self.hidden.append(0)
+            tracemalloc.reset_peak()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                peak = max(tracemalloc.get_traced_memory()[1], self.hidden.pop())
+                if self.hidden: self.hidden[-1] = max(self.hidden[-1], peak)
+                self.peaks.setdefault(name, []).append(peak - current)
+        return traced
+
+    def __enter__(self):
+        import tracemalloc
+        self.originals = [(module, name, getattr(module, name)) for (module, name) in STAGES]
+        for (module, name, function) in self.originals:
+            setattr(module, name, self.wrap(name, function))
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, *args):
+        import tracemalloc
+        tracemalloc.stop()
+        for (module, name, function) in self.originals:
+            setattr(module, name, function)
+
+def profile_allocations(corpus):
+    """
+    Return the create_log_statement peak of every corpus line (both directions summed up)
+    and the peaks of all calls per stage.
+    """
+    settings = dict(utils.load_settings(), max_parse_ms = 0)
+    run_corpus(corpus, settings) # Warm up regex and profile caches
+    line_peaks = []
+    stage_peaks = {}
+    with AllocationProfiler() as profiler:
+        for (i, (line, flowtype_enabled)) in enumerate(corpus):
+            profiler.peaks = {}
+            run_corpus([(line, flowtype_enabled)], settings)
+            line_peaks.append((sum(profiler.peaks['create_log_statement']), line))
+            for (stage, peaks) in profiler.peaks.items():
+                stage_peaks.setdefault(stage, []).extend(peaks)
+    return line_peaks, stage_peaks
+
+def report_allocations(corpus, max_peak = None, max_stage_peaks = None, output = sys.stdout):
+    "Print allocation peaks per stage and the worst lines. Returns the process exit code."
+    import tracemalloc
+    if not hasattr(tracemalloc, 'reset_peak'):
+        output.write('--memory needs Python 3.9 or later\n')
+        return 2
+    line_peaks, stage_peaks = profile_allocations(corpus)
+    output.write('%d lines, allocation peaks in bytes\n' % len(corpus))
+    output.write('%-36s %10s %10s %10s %10s\n' % ('stage', 'calls/line', 'per call', 'max call', 'per line'))
+    for (module, stage) in STAGES:
+        peaks = stage_peaks.get(stage, [])
+        if not peaks: continue
+        output.write('%-36s %10.1f %10d %10d %10d\n' % (
+            stage, len(peaks) / len(corpus), sum(peaks) / len(peaks), max(peaks), sum(peaks) / len(corpus)))
+    output.write('worst lines:\n')
+    for (peak, line) in sorted(line_peaks, reverse = True)[ : 5]:
+        output.write('%10d  %r\n' % (peak, line))
+
+    failed = []
+    if max_peak is not None:
+        failed.extend((peak, line, max_peak) for (peak, line) in line_peaks if peak > max_peak)
+    for (stage, limit) in (max_stage_peaks or {}).items():
+        peaks = stage_peaks.get(stage, [])
+        if peaks and max(peaks) > limit: failed.append((max(peaks), stage, limit))
+    for (peak, what, limit) in failed:
+        output.write('LogMagic: %r peaked at %d bytes (limit %d)\n' % (what, peak, limit))
+    return failed and 1 or 0
+
+def main(argv):
+    rounds = 5
+    cold_re = False
+    memory = False
+    max_peak = None
+    max_stage_peaks = {}
+    paths = []
+    args = list(argv[1:])
+    while args:
+        arg = args.pop(0)
+        if arg == '--rounds': rounds = int(args.pop(0))
+        elif arg == '--cold-re': cold_re = True
+        elif arg == '--memory': memory = True
+        elif arg == '--max-peak': max_peak = int(args.pop(0))
+        elif arg == '--max-stage-peak':
+            stage, limit = args.pop(0).split('=')
+            max_stage_peaks[stage] = int(limit)
+        else: paths.append(arg)
+
+    corpus = paths and load_corpus(paths) or CORPUS
+    if memory: return report_allocations(corpus, max_peak, max_stage_peaks)
+    print('%d lines, best of %d rounds%s: %.1fus per call' % (
+        len(corpus), rounds, cold_re and ' with a cold re cache' or '', benchmark(corpus, rounds, cold_re)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
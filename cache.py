@@ -0,0 +1,107 @@
+"""
+Persistent on-disk cache of parse results for the batch tools.
+
+Entries are keyed by a hash of the cleaned line and the parse options and live in an
+SQLite file. The cache is wiped automatically whenever the parser source changes and is
+trimmed to max_entries least recently used entries when closed.
+"""
+
+import hashlib, json, os
+from . import core
+from . import patterns
+from . import profiles
+from . import utils
+
+DEFAULT_MAX_ENTRIES = 200000
+
+def engine_version():
+    "Return a hash of the parser source. Any change to the parser invalidates the cache."
+    digest = hashlib.sha1()
+    for module in (core, patterns, profiles, utils):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def serialize(parsed):
+    identifier_str, log_value, params = parsed
+    return json.dumps([identifier_str, log_value, [[p.name, p.type, p.display_key] for p in params]])
+
+def deserialize(value):
+    identifier_str, log_value, params = json.loads(value)
+    return (identifier_str, log_value, [utils.Param(*p) for p in params])
+
+class ParseCache(object):
+    """
+    A size bounded LRU cache of core.parse_line results stored in SQLite.
+    Use it as a context manager (or call close()) so usage is recorded and the cache trimmed.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'parse.cache')
+    >>> with ParseCache(path) as cache:
+    ...     core.create_log_statements([('var foo = a + b', 'a.js', 1, True, True)], cache = cache)
+    ["console.log('foo:', foo, 'a:', a, 'b:', b)"]
+    >>> with ParseCache(path) as cache:
+    ...     cache.get('  var foo = a + b;', True, True)
+    ('foo', True, [Param('a', 'statement'), Param('b', 'statement')])
+    >>> with ParseCache(path, version = 'other') as cache:
+    ...     cache.get('var foo = a + b', True, True)
+    """
+
+    def __init__(self, path, max_entries = DEFAULT_MAX_ENTRIES, version = None):
+        import sqlite3
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+
+        version = version or engine_version()
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if not row or row[0] != version:
+            self.db.execute('DELETE FROM entries')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('clock', '0')")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'clock'").fetchone()
+        # One tick per run. Entries touched in this run are marked with it when closing.
+        self.clock = int(row and row[0] or 0) + 1
+        self.touched = set()
+        self.db.commit()
+
+    def key(self, input, take_inner, flowtype_enabled, profile = None):
+        if profile is None: profile = profiles.default_profile(flowtype_enabled)
+        cleaned = core.clean_line(input, profile)
+        return hashlib.sha1(json.dumps([cleaned, bool(take_inner), bool(flowtype_enabled), profile.name]).encode('utf-8')).hexdigest()
+
+    def get(self, input, take_inner, flowtype_enabled, profile = None):
+        "Return the cached parse_line result or None"
+        key = self.key(input, take_inner, flowtype_enabled, profile)
+        row = self.db.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if not row: return None
+        self.touched.add(key)
+        return deserialize(row[0])
+
+    def set(self, input, take_inner, flowtype_enabled, parsed, profile = None):
+        key = self.key(input, take_inner, flowtype_enabled, profile)
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (key, serialize(parsed), self.clock))
+
+    def close(self):
+        "Record which entries were used, evict the least recently used ones and close the file"
+        self.db.executemany('UPDATE entries SET used = ? WHERE key = ?', ((self.clock, key) for key in self.touched))
+        count = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used LIMIT ?)',
+                (count - self.max_entries,))
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('clock', ?)", (str(self.clock),))
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def default_path():
+    "Return the default cache file location"
+    return os.path.join(os.path.expanduser('~'), '.cache', 'logmagic', 'parse.sqlite')
@@ -0,0 +1,443 @@
+"""
+Headless log statement checker, e.g. for pre-commit hooks.
+
+    python -m LogMagic.check [--settings FILE] [--remove] src/a.js src/b.coffee ...
+    git diff --cached -U0 | python -m LogMagic.check [--settings FILE] [--remove] --diff -
+    python -m LogMagic.check [--settings FILE] --watch [--interval SECONDS] src/ ...
+
+Prints `path:lineno: line` for every log statement found and exits with 1 if there were any.
+What counts as a log statement depends on the language profile picked by file extension and,
+with --settings, on the log_template and log_guard of a LogMagic.sublime-settings file.
+With --diff only lines added by the unified diff are inspected. With --remove they are deleted.
+With --watch the given files and directories are polled and totals printed whenever a file changes.
+"""
+
+import hashlib, mmap, os, re, shutil, sys, tempfile, time
+from . import profiles
+from . import utils
+
+HUNK_RE = re.compile(r'^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+WATCH_INTERVAL = 0.5
+IGNORED_DIRS = frozenset(['.git', '.hg', '.svn', 'node_modules'])
+# Files at least this big are memory-mapped and scanned as bytes instead of being read as text
+MMAP_THRESHOLD = 1 << 20
+COPY_CHUNK = 1 << 20
+
+def find_log_lines(lines, profile = None):
+    """
+    Return (lineno, line) for all log statements in an iterable of lines. lineno is 1-based.
+
+    >>> find_log_lines(['a = 1', '  console.log(a)', 'b = 2'])
+    [(2, '  console.log(a)')]
+    """
+    return [(i + 1, line) for (i, line) in enumerate(lines) if utils.is_log_statement(line, profile)]
+
+def parse_unified_diff(diff):
+    """
+    Return a dict mapping paths to the (lineno, line) of the lines a unified diff adds,
+    lineno being the line number in the new file.
+
+    >>> diff = '''diff --git a/foo.js b/foo.js
+    ... --- a/foo.js
+    ... +++ b/foo.js
+    ... @@ -1,2 +1,3 @@
+    ...  var a = 1
+    ... -var b = 2
+    ... +var b = 3
+    ... +console.log('b', b)
+    ... @@ -10 +11,0 @@
+    ... -gone()
+    ... '''
+    >>> parse_unified_diff(diff)
+    {'foo.js': [(2, 'var b = 3'), (3, "console.log('b', b)")]}
+
+    Within a hunk only its line counts tell content from headers, e.g. SQL comments:
+
+    >>> parse_unified_diff('''--- a/q.sql
+    ... +++ b/q.sql
+    ... @@ -1 +1 @@
+    ... --- old
+    ... +++ new
+    ... @@ -5 +5 @@
+    ... -a
+    ... +b
+    ... ''')
+    {'q.sql': [(1, '++ new'), (5, 'b')]}
+    """
+    added = {}
+    path = None
+    lineno = 0
+    old_left = new_left = 0 # Lines of the current hunk still to come
+    for line in diff.splitlines():
+        if old_left > 0 or new_left > 0:
+            if line.startswith('+'):
+                if path: added[path].append((lineno, line[1:]))
+                lineno += 1
+                new_left -= 1
+            elif line.startswith('-'):
+                old_left -= 1
+            elif line.startswith(' ') or not line:
+                lineno += 1
+                old_left -= 1
+                new_left -= 1
+            continue # Also skips `\\ No newline at end of file`
+        if line.startswith('+++ '):
+            path = line[4:].split('\t')[0].strip()
+            if path == '/dev/null': path = None
+            elif path.startswith('b/'): path = path[2:]
+            if path: added.setdefault(path, [])
+            continue
+        hunk = HUNK_RE.match(line)
+        if hunk:
+            old_left = int(hunk.group(1) or 1)
+            lineno = int(hunk.group(2))
+            new_left = int(hunk.group(3) or 1)
+    return dict((path, lines) for (path, lines) in added.items() if lines)
+
+def profile_for(path, settings = None):
+    """
+    Return the profile for the file at path with the settings' log_template and log_guard applied
+
+    >>> profile_for('a.py', {'log_guard': 'if DEBUG: {statement}'}).is_log_statement('if DEBUG: print(a)')
+    True
+    """
+    return profiles.for_settings(profiles.profile_for_path(path), settings)
+
+def check_diff(diff, settings = None):
+    """
+    Return a dict mapping paths to the (lineno, line) of log statements added by a unified diff
+
+    >>> diff = '+++ b/a.py\\n@@ -0,0 +1,2 @@\\n+if DEBUG: print(a)\\n+print(b)\\n'
+    >>> check_diff(diff), check_diff(diff, {'log_guard': {'python': 'if DEBUG: {statement}'}})
+    ({'a.py': [(2, 'print(b)')]}, {'a.py': [(1, 'if DEBUG: print(a)'), (2, 'print(b)')]})
+    """
+    found = {}
+    for (path, lines) in parse_unified_diff(diff).items():
+        profile = profile_for(path, settings)
+        logs = [(lineno, line) for (lineno, line) in lines if utils.is_log_statement(line, profile)]
+        if logs: found[path] = logs
+    return found
+
+def count_newlines(buffer, start, end):
+    "Count the newlines in buffer[start:end] without copying more than COPY_CHUNK bytes at a time"
+    count = 0
+    while start < end:
+        stop = min(end, start + COPY_CHUNK)
+        count += buffer[start:stop].count(b'\n')
+        start = stop
+    return count
+
+def find_log_spans(buffer, profile):
+    """
+    Yield (lineno, start, end) of the log statement lines in a bytes-like buffer (e.g. an mmap)
+    without decoding it. end includes the newline.
+
+    >>> list(find_log_spans(b'a = 1\\n  console.log(a)\\nb\\n', profiles.get_profile('javascript')))
+    [(2, 6, 23)]
+    """
+    lineno = 1
+    position = 0
+    for match in profile.log_statement_bytes_re.finditer(buffer):
+        start = match.start()
+        lineno += count_newlines(buffer, position, start)
+        position = start
+        end = buffer.find(b'\n', match.end())
+        yield lineno, start, end == -1 and len(buffer) or end + 1
+
+def find_mapped_log_lines(buffer, profile):
+    """
+    Return (lineno, line) for all log statements in a bytes-like buffer. Only the matched lines are decoded.
+
+    >>> find_mapped_log_lines(b'a = 1\\r\\n  console.log(a)\\r\\n', profiles.get_profile('javascript'))
+    [(2, '  console.log(a)')]
+    """
+    return [
+        (lineno, buffer[start:end].decode('utf-8', 'replace').rstrip('\r\n'))
+        for (lineno, start, end) in find_log_spans(buffer, profile)
+    ]
+
+def copy_range(buffer, start, end, output):
+    "Write buffer[start:end] to output in chunks of at most COPY_CHUNK bytes"
+    while start < end:
+        stop = min(end, start + COPY_CHUNK)
+        output.write(buffer[start:stop])
+        start = stop
+
+def check_file(path, mmap_threshold = MMAP_THRESHOLD, settings = None):
+    """
+    Return the (lineno, line) of all log statements in the file at path
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'a.js')
+    >>> with open(path, 'w') as f: n = f.write('if (DEBUG) log.warn(a)\\nlog.info(b)\\nconsole.log(c)\\n')
+    >>> check_file(path)
+    [(3, 'console.log(c)')]
+    >>> settings = {'log_template': 'log.{level}({args})', 'log_guard': 'if (DEBUG) {statement}'}
+    >>> check_file(path, settings = settings) == check_file(path, 0, settings) == [(1, 'if (DEBUG) log.warn(a)'), (2, 'log.info(b)')]
+    True
+    """
+    profile = profile_for(path, settings)
+    if os.path.getsize(path) >= max(mmap_threshold, 1):
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapping:
+            return find_mapped_log_lines(mapping, profile)
+    with open(path, encoding = 'utf-8', errors = 'replace') as f:
+        return find_log_lines((line.rstrip('\r\n') for line in f), profile)
+
+def remove_mapped_lines(path, linenos, profile):
+    """
+    remove_lines for big files: the file is memory-mapped and everything but the removed lines
+    is streamed into a temporary file that then replaces it. Returns None without changing the
+    file if a timing probe is among the lines: unwrapping its try/finally needs the decoded text.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapping:
+        spans = [(start, end) for (lineno, start, end) in find_log_spans(mapping, profile) if lineno in linenos]
+        if not spans: return 0
+        if any(profile.is_probe(mapping[start:end].decode('utf-8', 'replace')) for (start, end) in spans): return None
+        fd, temp_path = tempfile.mkstemp(prefix = '.logmagic-', dir = os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                position = 0
+                for (start, end) in spans:
+                    copy_range(mapping, position, start, output)
+                    position = end
+                copy_range(mapping, position, len(mapping), output)
+            shutil.copymode(path, temp_path)
+        except:
+            os.remove(temp_path)
+            raise
+    os.replace(temp_path, path)
+    return len(spans)
+
+def remove_lines(path, linenos, mmap_threshold = MMAP_THRESHOLD, settings = None):
+    """
+    Remove the given 1-based line numbers from the file at path, but only if they still are
+    log statements. Returns the number of lines removed.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'a.js')
+    >>> with open(path, 'wb') as f: n = f.write(b'a = 1\\r\\nconsole.log(a)\\r\\nb = 2\\r\\nconsole.log(b)')
+    >>> remove_lines(path, [2, 3, 4], mmap_threshold = 0)
+    2
+    >>> open(path, 'rb').read()
+    b'a = 1\\r\\nb = 2\\r\\n'
+
+    Guarded log statements (see the log_guard setting) are only removed with the settings:
+
+    >>> with open(path, 'w') as f: n = f.write('DEBUG && console.log(a)\\nb = 2\\n')
+    >>> remove_lines(path, [1]), remove_lines(path, [1], mmap_threshold = 0)
+    (0, 0)
+    >>> remove_lines(path, [1], mmap_threshold = 0, settings = {'log_guard': 'DEBUG && {statement}'})
+    1
+
+    Removing both statements of a timing probe around a function body also unwraps its try/finally:
+
+    >>> with open(path, 'w') as f: n = f.write("function f() {\\n  console.time('logmagic:f')\\n  try {\\n    a()\\n  } finally {\\n    console.timeEnd('logmagic:f')\\n  }\\n}\\n")
+    >>> remove_lines(path, [2, 6]), open(path).read()
+    (2, 'function f() {\\n  a()\\n}\\n')
+    """
+    linenos = set(linenos)
+    profile = profile_for(path, settings)
+    if os.path.getsize(path) >= max(mmap_threshold, 1):
+        removed = remove_mapped_lines(path, linenos, profile)
+        if removed is not None: return removed
+    with open(path, encoding = 'utf-8', errors = 'surrogateescape', newline = '') as f:
+        lines = f.readlines()
+    erased = set(i for (i, line) in enumerate(lines) if i + 1 in linenos and utils.is_log_statement(line, profile))
+    removed = len(erased)
+    # Timing probes around function bodies take their try/finally with them
+    for (row, finally_row, dedents) in utils.find_probe_wrappers(lines, profile):
+        if row not in erased or finally_row + 1 not in erased: continue
+        erased.update((row + 1, finally_row, finally_row + 2))
+        for (body_row, width) in dedents:
+            lines[body_row] = lines[body_row][width : ]
+    kept = [line for (i, line) in enumerate(lines) if i not in erased]
+    if removed:
+        with open(path, 'w', encoding = 'utf-8', errors = 'surrogateescape', newline = '') as f:
+            f.writelines(kept)
+    return removed
+
+class Index(object):
+    """
+    Index of the source files below a set of paths with their stat, content hash and log statements.
+    update() only reads files whose mtime or size changed and only scans them if their content did.
+    Directories are only listed again when their mtime changed.
+
+    >>> import os, tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> path = os.path.join(root, 'a.js')
+    >>> with open(path, 'w') as f: n = f.write('a = 1\\nconsole.log(a)\\n')
+    >>> index = Index([root])
+    >>> index.update() == {path: [(2, 'console.log(a)')]}
+    True
+    >>> index.update()
+    {}
+    >>> with open(path, 'w') as f: n = f.write('a = 1\\n')
+    >>> index.update() == {path: []}
+    True
+    >>> index.totals()
+    (0, 0)
+    """
+
+    def __init__(self, paths, settings = None):
+        self.paths = list(paths)
+        self.settings = settings
+        self.extensions = tuple(set(ext for spec in profiles.PROFILE_SPECS for ext in profiles.get_profile(spec['name']).extensions))
+        self.files = {} # path => (mtime, size, content hash, log statements)
+        self.dirs = {} # path => (mtime, files, subdirectories)
+
+    def list_dir(self, path):
+        "Return the source files and subdirectories of a directory, listing it again only if it changed"
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.dirs.get(path)
+        if cached and cached[0] == mtime: return cached[1], cached[2]
+        files = []
+        subdirs = []
+        for name in sorted(os.listdir(path)):
+            child = os.path.join(path, name)
+            if os.path.isdir(child):
+                if name not in IGNORED_DIRS: subdirs.append(child)
+            elif name.endswith(self.extensions):
+                files.append(child)
+        self.dirs[path] = (mtime, files, subdirs)
+        return files, subdirs
+
+    def list_files(self):
+        "Yield all source files below the indexed paths"
+        pending = list(self.paths)
+        while pending:
+            path = pending.pop()
+            if not os.path.isdir(path):
+                yield path
+                continue
+            try:
+                files, subdirs = self.list_dir(path)
+            except OSError:
+                continue
+            for file in files: yield file
+            pending.extend(reversed(subdirs))
+
+    def scan(self, path, stat):
+        "Return the index entry for the file at path"
+        known = self.files.get(path)
+        profile = profile_for(path, self.settings)
+        if stat.st_size >= MMAP_THRESHOLD:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapping:
+                digest = hashlib.sha1(mapping).hexdigest()
+                if known and known[2] == digest: return (stat.st_mtime_ns, stat.st_size, digest, known[3])
+                return (stat.st_mtime_ns, stat.st_size, digest, find_mapped_log_lines(mapping, profile))
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        if known and known[2] == digest: return (stat.st_mtime_ns, stat.st_size, digest, known[3])
+        lines = (line.rstrip('\r') for line in content.decode('utf-8', 'replace').split('\n'))
+        return (stat.st_mtime_ns, stat.st_size, digest, find_log_lines(lines, profile))
+
+    def update(self):
+        "Bring the index up to date. Returns a dict mapping changed paths to their log statements"
+        changed = {}
+        seen = set()
+        for path in self.list_files():
+            seen.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            known = self.files.get(path)
+            if known and known[0] == stat.st_mtime_ns and known[1] == stat.st_size: continue
+            try:
+                entry = self.files[path] = self.scan(path, stat)
+            except OSError:
+                continue
+            if not known or known[3] != entry[3]: changed[path] = entry[3]
+        for path in set(self.files) - seen:
+            if self.files.pop(path)[3]: changed[path] = []
+        return changed
+
+    def totals(self):
+        "Return the number of log statements and the number of files containing them"
+        counts = [len(entry[3]) for entry in self.files.values() if entry[3]]
+        return sum(counts), len(counts)
+
+def watch(paths, interval = WATCH_INTERVAL, output = sys.stdout, settings = None):
+    "Poll paths every interval seconds and report log statements in changed files until interrupted"
+    import asyncio
+    index = Index(paths, settings)
+    loop = asyncio.new_event_loop()
+
+    def poll():
+        start = time.perf_counter()
+        changed = index.update()
+        if changed:
+            for path in sorted(changed):
+                for (lineno, line) in changed[path]:
+                    output.write('%s:%d: %s\n' % (path, lineno, line.strip()))
+            total, files = index.totals()
+            output.write('LogMagic: %d log statements in %d files (%d changed, %.1fms)\n' % (
+                total, files, len(changed), (time.perf_counter() - start) * 1000))
+            output.flush()
+        loop.call_later(interval, poll)
+
+    loop.call_soon(poll)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+    return 0
+
+def report(found, remove, output, settings = None):
+    "Print or remove found log statements. Returns the process exit code."
+    total = 0
+    for path in sorted(found):
+        if remove:
+            total += remove_lines(path, [lineno for (lineno, line) in found[path]], settings = settings)
+        else:
+            for (lineno, line) in found[path]:
+                output.write('%s:%d: %s\n' % (path, lineno, line.strip()))
+                total += 1
+    if remove:
+        output.write('LogMagic: Removed %d log statements\n' % total)
+        return 0
+    return total and 1 or 0
+
+def main(argv):
+    remove = False
+    diff = None
+    watching = False
+    interval = WATCH_INTERVAL
+    settings = None
+    paths = []
+    args = list(argv[1:])
+    while args:
+        arg = args.pop(0)
+        if arg == '--settings': settings = utils.read_settings(args.pop(0))
+        elif arg == '--remove': remove = True
+        elif arg == '--diff': diff = args.pop(0) if args else '-'
+        elif arg == '--watch': watching = True
+        elif arg == '--interval': interval = float(args.pop(0))
+        else: paths.append(arg)
+
+    if watching:
+        if remove or diff is not None:
+            sys.stderr.write('--watch can not be combined with --remove or --diff\n')
+            return 2
+        return watch(paths or ['.'], interval, settings = settings)
+
+    if diff is not None:
+        if diff == '-':
+            found = check_diff(sys.stdin.read(), settings)
+        else:
+            with open(diff, encoding = 'utf-8', errors = 'replace') as f:
+                found = check_diff(f.read(), settings)
+        found = dict((path, logs) for (path, logs) in found.items() if os.path.isfile(path) or not remove)
+    else:
+        found = {}
+        for path in paths:
+            logs = check_file(path, settings = settings)
+            if logs: found[path] = logs
+
+    return report(found, remove, sys.stdout, settings)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,6 +1,11 @@
-import os, os.path, re
+import collections, functools, json, os, os.path
+from . import patterns
+from . import profiles
 from . import utils
 
+# Lines that ran out of their max_parse_ms budget, most recent last
+over_budget = collections.deque(maxlen = 50)
+
 def get_param_type(input):
     """
     Return the parameter type for a single parameter.
@@ -29,65 +34,106 @@ def get_param_type(input):
     else:
         return 'statement'
 
-def parse_params(input, _flowtype_enabled = True):
+# A `?` right after one of these (or at the start) doesn't follow an operand so it isn't a ternary's
+NOT_TERNARY_AFTER = frozenset(['', '?', ':', ',', '(', '[', '{', '<', '|', '&', '=', '!'])
+
+def split_ternary(input):
+    """
+    Split a conditional expression `a ? b : c` into its three parts, or return None if input isn't one.
+    Optional chaining, nullish coalescing and flowtype's optional params and maybe types are not ternaries.
+
+    >>> split_ternary('a ? b ? c : d : e(x ? 1 : 2)')
+    ['a ', ' b ? c : d ', ' e(x ? 1 : 2)']
+
+    >>> split_ternary('a?.b'), split_ternary('a?: Number'), split_ternary('a ?? b'), split_ternary('a: ?T, b: U')
+    (None, None, None, None)
+    """
+    questions = [
+        p for p in utils.find_all_not_in_parens_or_strings(input, '?')
+        if input[p + 1 : p + 2] not in ('.', '?', ':', '=') and input[ : p].rstrip()[-1:] not in NOT_TERNARY_AFTER
+    ]
+    if not questions: return None
+    first = questions[0]
+    colons = [p for p in utils.find_all_not_in_parens_or_strings(input, ':') if p > first]
+    depth = 0
+    for (pos, step) in sorted([(p, 1) for p in questions] + [(p, -1) for p in colons]):
+        depth += step
+        if depth == 0: return [input[ : first], input[first + 1 : pos], input[pos + 1 : ]]
+    return None
+
+def parse_params(input, _flowtype_enabled = True, profile = None, _params = None, _seen = None):
     """
     Revursively parse a string of interesting attributes and split it apart.
+    Params are filtered as they are found and collected into one shared list.
+    profile is a profiles.Profile, by default picked based on _flowtype_enabled.
 
-    >>> parse_params('foo, bar') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'bar'}]
-    True
+    >>> parse_params('foo, bar')
+    [Param('foo', 'statement'), Param('bar', 'statement')]
 
-    >>> parse_params('(foo), bar') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'bar'}]
-    True
+    >>> parse_params('(foo), bar')
+    [Param('foo', 'statement'), Param('bar', 'statement')]
 
-    >>> parse_params('"somestring", bar') == [{'type': 'string', 'name': '"somestring"'}, {'type': 'statement', 'name': 'bar'}]
-    True
+    >>> parse_params('"somestring", bar')
+    [Param('"somestring"', 'string'), Param('bar', 'statement')]
 
-    >>> parse_params('foo || bar, bar && buzz || 1, hello') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'bar'}, {'type': 'statement', 'name': 'buzz'}, {'type': 'statement', 'name': 'hello'}]
-    True
+    >>> parse_params('foo || bar, bar && buzz || 1, hello')
+    [Param('foo', 'statement'), Param('bar', 'statement'), Param('buzz', 'statement'), Param('hello', 'statement')]
 
-    >>> parse_params('foo, function() { 1; }') == [{'type': 'statement', 'name': 'foo'}]
-    True
+    >>> parse_params('foo, function() { 1; }')
+    [Param('foo', 'statement')]
 
-    >>> parse_params('foo, (x) => { 1; }') == [{'type': 'statement', 'name': 'foo'}]
-    True
+    >>> parse_params('foo, (x) => { 1; }')
+    [Param('foo', 'statement')]
 
-    >>> parse_params('foo, (x) => 1') == [{'type': 'statement', 'name': 'foo'}]
-    True
+    >>> parse_params('foo, (x) => 1')
+    [Param('foo', 'statement')]
 
-    >>> parse_params('foo, someFunc(123)') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'someFunc(123)'}]
-    True
+    >>> parse_params('foo, someFunc(123)')
+    [Param('foo', 'statement'), Param('someFunc(123)', 'statement')]
 
     Default values
 
-    >>> parse_params('foo = 1, bar = 2') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'bar'}]
-    True
+    >>> parse_params('foo = 1, bar = 2')
+    [Param('foo', 'statement'), Param('bar', 'statement')]
 
-    >>> parse_params('(foo = 1), bar') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'bar'}]
-    True
+    >>> parse_params('(foo = 1), bar')
+    [Param('foo', 'statement'), Param('bar', 'statement')]
 
     Es6 destructuring
 
-    >>> parse_params('{foo, bar} = {}') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'bar'}]
-    True
+    >>> parse_params('{foo, bar} = {}')
+    [Param('foo', 'statement'), Param('bar', 'statement')]
 
-    >>> parse_params('[foo, bar]') == [{'type': 'statement', 'name': 'foo'}, {'type': 'statement', 'name': 'bar'}]
-    True
+    >>> parse_params('[foo, bar]')
+    [Param('foo', 'statement'), Param('bar', 'statement')]
 
-    >>> parse_params('[{foo: 1, bar: 2}, buzz]') == [{'type': 'statement', 'name': 'buzz'}]
-    True
+    >>> parse_params('[{foo: 1, bar: 2}, buzz]')
+    [Param('buzz', 'statement')]
     """
 
+    if profile is None: profile = profiles.default_profile(_flowtype_enabled)
+    if _params is None:
+        _params = []
+        _seen = set()
+
+    utils.tick()
     input = input.strip()
 
     while input and utils.is_wrapped(input, '('): input = input[1:-1] # Remove wrapping parens
 
-    if not input: return []
+    if not input: return _params
+
+    # `a ? b : c` => a, b, c
+    parts = profile.ternary and '?' in input and split_ternary(input)
+    if parts:
+        for part in parts: parse_params(part, _flowtype_enabled, profile, _params, _seen)
+        return _params
 
     # Handle destructuring
-    equals = utils.find_all_not_in_parens_or_strings(input, {'re':r'(?<!=)=(?!=)'})
+    equals = utils.find_all_not_in_parens_or_strings(input, patterns.DESTRUCTURING_EQUALS)
     destruct_ranges = []
     for equal in equals:
-        if input[equal+1] == '>': continue # Arrow function, not assignment
+        if input[equal + 1 : equal + 2] == '>': continue # Arrow function, not assignment
         str_remaining = input[equal + 1 :].lstrip()
         if not str_remaining.startswith('{'): continue
         # Found `= {`
@@ -108,29 +154,23 @@ def parse_params(input, _flowtype_enabled = True):
     if input and utils.is_wrapped(input, '{['):
         _flowtype_enabled = False
         input = input[1:-1]
-    elif re.match(r'^{.+}\s*:\s*[^\s\(\)\[\]\{\}+*/&\|=,:~-]+', input):
+    elif utils.is_flowtype_destructuring(input):
         _flowtype_enabled = False
         colon = input.rfind(':')
         input = input[:colon].strip()[1:-1]
 
     input_split = []
-    params = []
 
-    split_points = []
-    for delim in utils.PARAM_DELIMITERS:
-        points = utils.find_all_not_in_parens_or_strings(input, delim)
-        points = [
-            {'pos': p, 'len': delim.get('len') or len(delim['str'])}
-            for p in points
-        ]
-        split_points.extend(points)
+    split_points = [] # (pos, len)
+    for delim in profile.param_delimiters:
+        split_points.extend((p, delim['len']) for p in utils.find_all_not_in_parens_or_strings(input, delim))
 
-    split_points = sorted(split_points, key = lambda x: x['pos'])
+    split_points.sort(key = lambda x: x[0])
 
     is_single_param = not split_points
 
     if is_single_param: # End recursion
-        if '=>' in input or 'function' in input: return [] # Handle es6 arrow function edge case `(x) => {...}`
+        if '=>' in input or 'function' in input: return _params # Handle es6 arrow function edge case `(x) => {...}`
         colon_pos = utils.find_all_not_in_parens_or_strings(input, ':')
         if _flowtype_enabled:
             # Flowtype annotations: Remove object value `foo: Number` => `foo`
@@ -141,40 +181,41 @@ def parse_params(input, _flowtype_enabled = True):
             if colon_pos:
                 input = input[colon_pos[0] + 1 : ].rstrip()
                 # Recurse to re-parse any sub-destructuring
-                return parse_params(input, _flowtype_enabled)
+                return parse_params(input, _flowtype_enabled, profile, _params, _seen)
         # Remove `foo as bar`
-        matches = re.match(r'(?<![^\s\(\)\[\]\{\}+*/&\|=<>,:~-])as\s+(.+)$', input)
+        matches = patterns.AS_ALIAS_RE.match(input)
         if matches:
             input = matches.group(1)
-        param = clean_param(input)
-        return filter_params([{"name": param, "type": get_param_type(param)}])
+        add_param(_params, _seen, clean_param(input, profile), profile)
+        return _params
 
-    for i in range(len(split_points)):
-        start = i > 0 and split_points[i - 1]['pos'] + split_points[i - 1]['len'] or 0
-        end = split_points[i]['pos']
-        input_split.append(input[start:end])
-    if split_points: input_split.append(input[split_points[-1]['pos'] + split_points[-1]['len'] : ])
+    start = 0
+    for (pos, delim_len) in split_points:
+        input_split.append(input[start:pos])
+        start = pos + delim_len
+    input_split.append(input[start:])
 
-    to_strip = utils.PARAM_DELIMITERS_STRIP + ' \t'
     for param in input_split:
-        param = param.strip(to_strip)
+        param = param.strip(profile.param_delimiters_strip)
         if not param: continue
-        params.extend(parse_params(param, _flowtype_enabled))
+        parse_params(param, _flowtype_enabled, profile, _params, _seen)
 
-    return filter_params(params)
+    return _params
 
-def clean_line(input):
+def clean_line(input, profile = None):
     "Clean whole line of unnecessary stuff"
+    if profile is None: profile = profiles.default_profile()
     input = input.strip()
 
     # Remove trailing comments
+    for comment in profile.comments:
+        point = utils.find_not_in_string(input, comment)
+        if point != -1:
+            input = input[:point].rstrip()
 
-    point = utils.find_not_in_string(input, '//')
-    if point != -1:
-        input = input[:point].rstrip()
-    point = utils.find_not_in_string(input, '#')
-    if point != -1:
-        input = input[:point].rstrip()
+    # Remove block openers like python's trailing `:`
+    if profile.block_suffix and input.endswith(profile.block_suffix):
+        input = input[:-len(profile.block_suffix)].rstrip()
 
     # Remove wrapping parens
     while input and utils.is_wrapped(input): input = input[1:-1]
@@ -188,32 +229,28 @@ def clean_line(input):
     while input and utils.is_wrapped(input): input = input[1:-1]
 
     # In case of import line, remove the `from ...` part to make things easier
-    matches = re.match(r'^(\s*import\s+.+)\s+from', input)
+    matches = profile.import_from_re and profile.import_from_re.match(input)
     if matches:
         input = matches.group(1)
 
     # In case of coffeescript's `for ... in` remove `in...`
-    matches = re.match(r'^(\s*for\s+.+)\s+in\s*.+$', input)
+    matches = profile.for_in_re and profile.for_in_re.match(input)
     if matches:
       input = matches.group(1)
 
     return input
 
-def clean_param(input):
+def clean_param(input, profile = None):
     "Clean a single param"
+    if profile is None: profile = profiles.default_profile()
 
-    input = input.strip(' \t;')
+    input = input.strip(patterns.PARAM_STRIP)
 
-    # Remove coffee's trailing if, unless and for
-    if_pos = utils.find_not_in_string(input, {'re':'\sif\s'})
-    if if_pos != -1:
-        input = input[:if_pos].strip()
-    unless_pos = utils.find_not_in_string(input, {'re': '\sunless\s'})
-    if unless_pos != -1:
-        input = input[:unless_pos].strip()
-    for_pos = utils.find_not_in_string(input, {'re': '\sfor\s'})
-    if for_pos != -1:
-        input = input[:for_pos].strip()
+    # Remove trailing keywords like coffee's if, unless and for
+    for keyword in profile.trailing_keywords:
+        pos = utils.find_not_in_string(input, keyword)
+        if pos != -1:
+            input = input[:pos].strip()
 
     # Remove wrapping parens
     while input and utils.is_wrapped(input): input = input[1:-1]
@@ -228,12 +265,18 @@ def clean_param(input):
     # Remove wrapping parens
     while input and utils.is_wrapped(input): input = input[1:-1]
 
-    input = input.strip(' \t;?')
+    input = input.strip(patterns.PARAM_STRIP_OPTIONAL)
 
     # Remove splats
     if input.startswith('...'):
         input = input[3:]
 
+    # Remove declarations: `const foo` => `foo`
+    for prefix in profile.declaration_prefixes:
+        if input.startswith(prefix):
+            input = input[len(prefix):].lstrip()
+            break
+
     # Cover up unbalanced parenthesis produced by parse errors
     for chars in [('(',')'), ('[',']'), ('{','}')]:
         opening_parens = utils.find_all_not_in_strings(input, chars[0])
@@ -250,7 +293,7 @@ def clean_param(input):
 def clean_identifier(input):
     "Clean the log identifier"
 
-    input = input.strip(' \t;+<>-')
+    input = input.strip(patterns.IDENTIFIER_STRIP)
 
 
     # Remove splats
@@ -259,30 +302,30 @@ def clean_identifier(input):
 
     return input
 
-def filter_params(params):
-    "Filter out duplicate params and other pointless stuff"
-
-    # Filter duplicates, known constants, numbers and empty/invalid strings
-    unique_names = set()
-    filtered = []
-    for i in params:
-        if i['name'] not in unique_names \
-        and i['name'].strip('"`\'[](){}') \
-        and i['name'] not in['true', 'false', 'null', 'undefined'] \
-        and not i['name'].startswith('.') \
-        and not i['name'].endswith('.') \
-        and not i['name'].replace('.', '').isdigit():
-            unique_names.add(i['name'])
-            filtered.append(i)
-
-    return filtered
-
-def create_log_statement(input, filename, lineno, take_inner, flowtype_enabled):
+def is_loggable_name(name, profile = None):
+    "Return False for empty/invalid names, known constants and numbers"
+    if profile is None: profile = profiles.default_profile()
+    return bool(name.strip(utils.PARAM_EMPTY_CHARS)) \
+        and name not in profile.constants \
+        and not name.startswith('.') \
+        and not name.endswith('.') \
+        and not name.replace('.', '').isdigit()
+
+def add_param(params, seen, name, profile = None):
+    "Append a Param for name to params unless it's a duplicate or pointless"
+    if name in seen or not is_loggable_name(name, profile): return
+    seen.add(name)
+    params.append(utils.Param(name, get_param_type(name)))
+
+def create_log_statement(input, filename, lineno, take_inner, flowtype_enabled, settings = None, profile = None):
     """
     Return the final log statement to be inserted.
     take_inner indicates wether we'er biased to inspecting the inner statement (towards the right)
     or the outer statement (toward the left).
     eg `var a = fn(function(a, b) {` => (`var a` vs ` `function(a, b) {`)
+    settings is a dict as returned by utils.load_settings(); utils.SETTINGS_DEFAULTS if not given.
+    The parser never reads editor settings itself so it is safe to call from any thread.
+    profile is a profiles.Profile; by default javascript, or coffeescript if flowtype is disabled.
 
 
     Simple assignments:
@@ -393,6 +436,48 @@ def create_log_statement(input, filename, lineno, take_inner, flowtype_enabled):
     "console.log('if', 'fn(1, 2):', fn(1, 2), 'b:', b)"
 
 
+    Operator keywords and ternaries (javascript profile)
+
+    >>> create_log_statement('case FOO:', 'somefile.js', 123, True, True)
+    "console.log('case', 'FOO:', FOO)"
+
+    >>> create_log_statement('delete obj[key]', 'somefile.js', 123, True, True)
+    "console.log('delete', 'obj[key]:', obj[key])"
+
+    >>> create_log_statement('throw err', 'somefile.js', 123, True, True)
+    "console.log('throw', 'err:', err)"
+
+    >>> create_log_statement('throw new Error(msg)', 'somefile.js', 123, True, True)
+    "console.log('throw', 'new Error(msg):', new Error(msg))"
+
+    >>> create_log_statement('await a + b', 'somefile.js', 123, True, True)
+    "console.log('await', 'a:', a, 'b:', b)"
+
+    >>> create_log_statement('await fetchData(url, opts)', 'somefile.js', 123, True, True)
+    "console.log('await', 'fetchData(url, opts):', fetchData(url, opts))"
+
+    >>> create_log_statement('await Promise.all([a, b])', 'somefile.js', 123, True, True)
+    "console.log('await', 'Promise.all([a, b]):', Promise.all([a, b]))"
+
+    >>> create_log_statement('void fn(a)', 'somefile.js', 123, True, True)
+    "console.log('void', 'fn(a):', fn(a))"
+
+    >>> create_log_statement('a ? b : c', 'somefile.js', 123, True, True)
+    "console.log('somefile.js:123', 'a:', a, 'b:', b, 'c:', c)"
+
+    >>> create_log_statement('return a ? b : c', 'somefile.js', 123, True, True)
+    "console.log('return', 'a:', a, 'b:', b, 'c:', c)"
+
+    >>> create_log_statement('a ? b : c.then((x) => {', 'somefile.js', 123, True, True)
+    "console.log('c.then', 'x:', x)"
+
+    >>> create_log_statement('a ? () => b', 'somefile.js', 123, False, True)
+    "console.log('a')"
+
+    >>> create_log_statement('for (const [k, v] of Object.entries(obj)) {', 'somefile.js', 123, True, True)
+    "console.log('for', '[k, v]:', [k, v], 'Object.entries(obj):', Object.entries(obj))"
+
+
     Function calls
     (take params, split apart) (strategy params)
 
@@ -503,263 +588,681 @@ def create_log_statement(input, filename, lineno, take_inner, flowtype_enabled):
 
     >>> create_log_statement('$ctrl.onUpdate({ $event: { dates: event.dates } });', 'somefile.js', 123, True, True)
     "console.log('$ctrl.onUpdate', 'event.dates:', event.dates)"
+
+
+    Lines that take longer than max_parse_ms to parse fall back to `filename:lineno`
+
+    >>> settings = dict(utils.SETTINGS_DEFAULTS, max_parse_ms = 0.001)
+    >>> create_log_statement('fn(' + ', '.join('a%d + b' % i for i in range(50)) + ')', 'somefile.js', 123, True, True, settings)
+    "console.log('somefile.js:123')"
+    >>> over_budget[-1]['lineno']
+    123
     """
 
-    def _parse_assignee(input):
-        if not input: return None
-        equals = utils.find_all_not_in_parens_or_strings(input, {'re': '(?<![<>=])=(?!=)'})
-        colons = utils.find_all_not_in_parens_or_strings(input, ':')
-        if not equals and not colons: return None
-
-        # Split assignee and assignment
-        if equals:
-            input = input[:equals[0]].rstrip()
-
-        # Handle flowtype `var foo:{a: Number}` => `var foo`
-        # Also handles simple object keys `success: function() {`
-        if colons:
-            input = input[:colons[0]].rstrip()
-
-        if input.startswith('var '): input = input[3:].lstrip()
-        elif input.startswith('let '): input = input[3:].lstrip()
-        elif input.startswith('const '): input = input[5:].lstrip()
-
-        return input
-
-    def _parse_function_name(input):
-        "Return the function name at the end of the string"
-        if not input: return None
-        name = None
-        extra = '' # Append this to what we find with regex
-        while input[-1] in ')}]':
-            char_opening = {')': '(', ']': '[', '}': '{'}[input[-1]]
-            parens = utils.rfind_matching_parens(input, char_opening, input[-1])
-            if not parens or parens[1] != len(input) - 1: return None # Unbalanced parens in front of fn call
-            extra = input[parens[0] : parens[1] + 1] + extra
-            input = input[:parens[0]]
-
-        input = input.rstrip('-=>:()[]{} \t')
-        matches = re.findall(r'([^\s\(\)\[\]\{\}+*/&\|=<>,:~-]+)$', input)
-        if matches and len(matches):
-            name = matches[0].strip('.') + extra
-        else:
-            name = extra
-
-        return name not in ['function'] and name or None
-
-    def parse_strategy_simple_var(input, take_inner):
-        while input and utils.is_wrapped(input): input = input[1:-1]
-
-        is_assignment = utils.find_all_not_in_parens_or_strings(input, {'re': r'(?<![<>])=(?!\>)'})
-        is_return = re.match(r'^\s*return', input)
-        is_import = re.match(r'^\s*import', input)
-        is_for = re.match(r'^\s*for\(', input)
-        is_export = re.match(r'^\s*export(?!\s+function)', input)
-        is_function = re.match(r'^.*((function\s*([^\s\(\)\[\]\{\}+*/&\|=<>,:~-]+)?\s*\()|(\=\>)|(\-\>))', input)
-
-        # Well this is just horrible but coffeescript clashes with es6 here pretty badly so...
-        # Make sure `foo: ->` is parsed as an assignment rather than a function
-        is_function_without_parens_assignment = re.match(r'([^\s\(\)\[\]\{\}+*/&\|=<>,:~-]+)\s*:\s*[^\(\)]*$', input)
-
-        if not is_assignment \
-        and not is_function_without_parens_assignment \
-        and not is_return \
-        and not is_export \
-        and not is_import \
-        or (is_function and take_inner and not is_function_without_parens_assignment):
-            return None
+    if settings is None: settings = utils.SETTINGS_DEFAULTS
+    if profile is None: profile = profiles.default_profile(flowtype_enabled)
+    parsed = parse_line_in_budget(input, filename, lineno, take_inner, flowtype_enabled, settings, profile)[0]
+    return format_log_statement(parsed, filename, lineno, settings, profile)
 
-        strat = {}
-
-        if is_return:
-            strat['identifier_str'] = 'return'
-            input = input[input.find('return') + 6 :].lstrip()
-            if input.startswith('if '): input = input[3:].lstrip()
-            elif input.startswith('unless '): input = input[7:].lstrip()
-        elif is_import:
-            strat['identifier_str'] = 'import'
-            input = input[input.find('import') + 6 :].lstrip()
-        elif is_export:
-            strat['identifier_str'] = 'export'
-            input = input[input.find('export') + 6 :].lstrip()
-        elif is_for:
-            strat['identifier_str'] = 'for'
-            input = input[input.find('for') + 4 : input.find(';')].strip()
-
-        # Find first part of assignment `var foo:{a: Number} = {...}` => `var foo:{a: Number}`
-        input = _parse_assignee(input) or input
-
-        if 'identifier_str' not in strat: strat['identifier_str'] = input
-        if not is_function_without_parens_assignment:
-            strat['param_str'] = input
+class _OverBudgetStatement(Exception):
+    "Carries the fallback statement of a line that ran out of budget past the lru_cache, which doesn't keep exceptions"
 
-        return strat
+@functools.lru_cache(maxsize = 4096)
+def _create_log_statement_cached(input, filename, lineno, take_inner, profile_name, settings_json):
+    profile = profiles.get_profile(profile_name)
+    settings = json.loads(settings_json)
+    (parsed, within_budget) = parse_line_in_budget(input, filename, lineno, take_inner, profile.flowtype, settings, profile)
+    statement = format_log_statement(parsed, filename, lineno, settings, profile)
+    if not within_budget: raise _OverBudgetStatement(statement)
+    return statement
 
-    def parse_strategy_value(input, take_inner):
-        # Like simple_var but value more interesting than identifier
-        strat = parse_strategy_simple_var(input, take_inner)
-        if not strat: return None
-
-        # Find second part of assignment `var foo:{a: Number} = {...}` => `{...}`
-        equals = utils.find_all_not_in_parens_or_strings(input, {'re': r'(?<![<>])=(?!\>)'})
-        if not equals: return None
-        input = input[equals[0] + 1 : ].lstrip()
-
-
-        # Look for object/array value
-        if utils.is_wrapped(input):
-            return strat
-
-        ii_found_in_assignment = [
-            i for i in
-            [utils.find_not_in_string(input, i) for i in utils.INTERESTING_INDICATORS]
-            if i != -1
-        ]
-
-        ii_found_in_assignee = [
-            i for i in
-            [utils.find_not_in_string(strat['identifier_str'], i) for i in utils.INTERESTING_INDICATORS]
-            if i != -1
-        ]
-
-        if ii_found_in_assignment and not ii_found_in_assignee:
-            if not take_inner:
-                # Remove lambdas
-                fn = utils.find_all_not_in_parens_or_strings(input, 'function')
-                if fn:
-                    input = input[:fn[0]]
-                else:
-                    arrows = utils.find_all_not_in_parens_or_strings(input, '=>')
-                    arrows.extend(utils.find_all_not_in_parens_or_strings(input, '->'))
-                    parens = utils.rfind_matching_parens(input)
-                    if arrows and parens:
-                        input = input[:parens[0]]
-            strat['param_str'] = input
-            return strat
+def create_log_statement_cached(input, filename, lineno, take_inner, profile, settings):
+    """
+    Memoized create_log_statement for callers that re-run the same lines over and over.
+    Only lines parsed within their budget are cached, like in create_log_statements: running out
+    can be down to a busy moment (see utils.ParseBudget) and the next call tries again.
+
+    >>> line = 'fn(' + ', '.join('a%d + b' % i for i in range(50)) + ')'
+    >>> settings = dict(utils.SETTINGS_DEFAULTS, max_parse_ms = 0.001)
+    >>> cached = _create_log_statement_cached.cache_info().currsize
+    >>> create_log_statement_cached(line, 'a.js', 1, True, profiles.get_profile('javascript'), settings)
+    "console.log('a.js:1')"
+    >>> _create_log_statement_cached.cache_info().currsize - cached
+    0
+    >>> settings['max_parse_ms'] = 0
+    >>> create_log_statement_cached(line, 'a.js', 1, True, profiles.get_profile('javascript'), settings)[ : 20]
+    "console.log('fn', 'a"
+    >>> _create_log_statement_cached.cache_info().currsize - cached
+    1
+    """
+    # Settings may hold objects (log_template) so they are keyed by their JSON
+    settings_json = json.dumps(settings, sort_keys = True)
+    try:
+        return _create_log_statement_cached(input, filename, lineno, take_inner, profile.name, settings_json)
+    except _OverBudgetStatement as e:
+        return e.args[0]
+
+def _parse_assignee(input, profile):
+    if not input: return None
+    equals = utils.find_all_not_in_parens_or_strings(input, patterns.ASSIGNEE_EQUALS)
+    colons = utils.find_all_not_in_parens_or_strings(input, ':')
+    if not equals and not colons: return None
+
+    # Split assignee and assignment
+    if equals:
+        input = input[:equals[0]].rstrip()
+
+    # Handle flowtype `var foo:{a: Number}` => `var foo`
+    # Also handles simple object keys `success: function() {` (but not the colon of `a ? b : c`)
+    if colons and not (profile.ternary and '?' in input and split_ternary(input)):
+        input = input[:colons[0]].rstrip()
+    elif not equals: return None # Only a ternary's colon, nothing is assigned
+
+    for prefix in profile.declaration_prefixes:
+        if input.startswith(prefix):
+            input = input[len(prefix):].lstrip()
+            break
 
-        return None
+    return input
+
+def _parse_function_name(input):
+    "Return the function name at the end of the string"
+    if not input: return None
+    name = None
+    extra = '' # Append this to what we find with regex
+    while input and input[-1] in ')}]':
+        char_opening = {')': '(', ']': '[', '}': '{'}[input[-1]]
+        parens = utils.rfind_matching_parens(input, char_opening, input[-1])
+        if not parens or parens[1] != len(input) - 1: return None # Unbalanced parens in front of fn call
+        extra = input[parens[0] : parens[1] + 1] + extra
+        input = input[:parens[0]]
+
+    input = input.rstrip(patterns.FUNCTION_NAME_STRIP)
+    # A ternary's `?` isn't a name: `a ? () => b`
+    if input.endswith(' ?'): input = input[ : -1].rstrip(patterns.FUNCTION_NAME_STRIP)
+    # Like the regex `identifier+$`, which also matches before a final newline
+    end = input.endswith('\n') and len(input) - 1 or len(input)
+    start = utils.rfind_identifier(input, end)
+    if start < end:
+        name = input[start : end].strip('.') + extra
+    else:
+        name = extra
 
-    def parse_strategy_params_coffee(input, take_inner):
-        strat = {}
-        # Find stuff like `foo bar` and assume it's a function call
-        matches = re.findall(r'^(else if|[^\s\(\)\[\]\{\}+*/&\|=<>,:~-]+)\s+([^\s=<>\(\)\[\]\{\}]+.*)\s*$', input)
-        if not matches or not len(matches): return None
-        if matches[0][0] in ['export', 'default', 'return', 'new', 'import', 'export', 'function']: return None
+    return name not in ['function'] and name or None
 
-        strat['identifier_str'] = matches[0][0].strip()
-        strat['param_str'] = matches[0][1].strip()
+def parse_strategy_simple_var(input, take_inner, profile):
+    while input and utils.is_wrapped(input): input = input[1:-1]
 
-        if strat['identifier_str'] in ['var', 'let', 'const', 'function']: return None
+    is_assignment = utils.find_all_not_in_parens_or_strings(input, patterns.ASSIGNMENT)
+    is_return = patterns.RETURN_RE.match(input)
+    is_import = patterns.IMPORT_RE.match(input)
+    is_for = patterns.FOR_RE.match(input)
+    is_export = patterns.EXPORT_RE.match(input)
+    is_function = utils.is_function(input)
+
+    # Well this is just horrible but coffeescript clashes with es6 here pretty badly so...
+    # Make sure `foo: ->` is parsed as an assignment rather than a function
+    is_function_without_parens_assignment = patterns.KEY_WITHOUT_PARENS_RE.match(input)
+
+    if not is_assignment \
+    and not is_function_without_parens_assignment \
+    and not is_return \
+    and not is_export \
+    and not is_import \
+    or (is_function and take_inner and not is_function_without_parens_assignment):
+        return None
 
+    strat = {}
+
+    if is_return:
+        strat['identifier_str'] = 'return'
+        input = input[input.find('return') + 6 :].lstrip()
+        if input.startswith('if '): input = input[3:].lstrip()
+        elif input.startswith('unless '): input = input[7:].lstrip()
+    elif is_import:
+        strat['identifier_str'] = 'import'
+        input = input[input.find('import') + 6 :].lstrip()
+    elif is_export:
+        strat['identifier_str'] = 'export'
+        input = input[input.find('export') + 6 :].lstrip()
+    elif is_for:
+        strat['identifier_str'] = 'for'
+        input = input[input.find('for') + 4 : input.find(';')].strip()
+
+    # Find first part of assignment `var foo:{a: Number} = {...}` => `var foo:{a: Number}`
+    input = _parse_assignee(input, profile) or input
+
+    if 'identifier_str' not in strat: strat['identifier_str'] = input
+    if not is_function_without_parens_assignment:
+        strat['param_str'] = input
+
+    return strat
+
+def parse_strategy_value(input, take_inner, profile):
+    # Like simple_var but value more interesting than identifier
+    strat = parse_strategy_simple_var(input, take_inner, profile)
+    if not strat: return None
+
+    # Find second part of assignment `var foo:{a: Number} = {...}` => `{...}`
+    equals = utils.find_all_not_in_parens_or_strings(input, patterns.ASSIGNMENT)
+    if not equals: return None
+    input = input[equals[0] + 1 : ].lstrip()
+
+
+    # Look for object/array value
+    if utils.is_wrapped(input):
         return strat
 
+    ii_found_in_assignment = [
+        i for i in
+        [utils.find_not_in_string(input, i) for i in profile.interesting_indicators]
+        if i != -1
+    ]
+
+    ii_found_in_assignee = [
+        i for i in
+        [utils.find_not_in_string(strat['identifier_str'], i) for i in profile.interesting_indicators]
+        if i != -1
+    ]
+
+    if ii_found_in_assignment and not ii_found_in_assignee:
+        if not take_inner:
+            # Remove lambdas
+            fn = utils.find_all_not_in_parens_or_strings(input, 'function')
+            if fn:
+                input = input[:fn[0]]
+            else:
+                arrows = utils.find_all_not_in_parens_or_strings(input, '=>')
+                arrows.extend(utils.find_all_not_in_parens_or_strings(input, '->'))
+                parens = utils.rfind_matching_parens(input)
+                if arrows and parens:
+                    input = input[:parens[0]]
+        strat['param_str'] = input
+        return strat
 
-    def parse_strategy_params(input, take_inner):
-        strat = {'param_str': ''}
-        # Look for fat arrow without parens first
+    return None
+
+def parse_strategy_params_coffee(input, take_inner, profile):
+    if not profile.calls_without_parens and not profile.operator_keywords: return None
+    strat = {}
+    # Find stuff like `foo bar` and assume it's a function call
+    match = utils.match_call_without_parens(input)
+    if not match or match[0] in profile.non_call_keywords: return None
+    if not profile.calls_without_parens and match[0] not in profile.operator_keywords: return None
+
+    strat['identifier_str'] = match[0].strip()
+    strat['param_str'] = match[1].strip()
+
+    return strat
+
+def parse_strategy_params(input, take_inner, profile):
+    strat = {'param_str': ''}
+    # Look for fat arrow without parens first
+    if take_inner:
+        arrows = utils.find_all_not_in_parens_or_strings(input, '=>')
+        arrows.extend(utils.find_all_not_in_parens_or_strings(input, '->'))
+        if arrows:
+            # Get variable without parens before arrow (`x => ...`)
+            matches = utils.match_arrow_param(input, arrows[-1])
+            if matches:
+                strat['param_str'] = matches[1]
+                input = input[:matches[0]].rstrip()
+
+    # Look for last matching parens and use that
+    if not strat.get('param_str'):
         if take_inner:
-            arrows = utils.find_all_not_in_parens_or_strings(input, '=>')
-            arrows.extend(utils.find_all_not_in_parens_or_strings(input, '->'))
-            if arrows:
-                # Get variable without parens before arrow (`x => ...`)
-                matches = re.search(r'([^\s\(\)\[\]\{\}+*/&\|=<>,:~-]+)\s*\(?(\(\s*\))?\s*$', input[:arrows[-1]])
-                if matches:
-                    strat['param_str'] = matches.group(1)
-                    input = input[:matches.start(0)].rstrip()
-
-        # Look for last matching parens and use that
-        if not strat.get('param_str'):
-            if take_inner:
-                parens = utils.rfind_matching_parens(input, '(', ')')
-            else:
-                parens = utils.find_matching_parens(input, '(', ')')
-            if parens:
-                # If take_inner is False then taking last matching parens is wrong
-                # if not take_inner and parens[0] != utils.find_not_in_string(input, '('): return None
-                strat['param_str'] = input[parens[0] + 1 : parens[1]]
-                input = input[:parens[0]].rstrip()
-            else:
-                return None
+            parens = utils.rfind_matching_parens(input, '(', ')')
+        else:
+            parens = utils.find_matching_parens(input, '(', ')')
+        if parens:
+            # If take_inner is False then taking last matching parens is wrong
+            # if not take_inner and parens[0] != utils.find_not_in_string(input, '('): return None
+            strat['param_str'] = input[parens[0] + 1 : parens[1]]
+            input = input[:parens[0]].rstrip()
+        else:
+            return None
 
-        # Find identifier
-        strat['identifier_str'] = _parse_assignee(input) or _parse_function_name(input)
+    # Find identifier
+    strat['identifier_str'] = _parse_assignee(input, profile) or _parse_function_name(input)
 
-        return strat
+    return strat
+
+def parse_strategy_fallback(input, take_inner, profile):
+    return {
+        'param_str': input
+    }
 
-    def parse_strategy_fallback(input, take_inner):
-        return {
-            'param_str': input
-        }
+def parse_line(input, take_inner, flowtype_enabled, profile = None):
+    """
+    Parse a line and return what should be logged as an `(identifier_str, log_value, params)` tuple.
+    log_value means the identifier itself should be logged as a value (`'foo:', foo`).
+    The result does not depend on the filename, line number or settings so it can be cached.
 
+    >>> parse_line('var foo = a + b', True, True)
+    ('foo', True, [Param('a', 'statement'), Param('b', 'statement')])
+
+    >>> parse_line('1', True, True)
+    ('', False, [])
+    """
+    if profile is None: profile = profiles.default_profile(flowtype_enabled)
 
     strat_value = None
     strat_simple_var = None
     strat_params = None
     strat_coffee_return = None
     params = []
-    input = clean_line(input)
+    input = clean_line(input, profile)
 
-    strat_value = parse_strategy_value(input, take_inner)
-    strat_simple_var = parse_strategy_simple_var(input, take_inner)
+    strat_value = parse_strategy_value(input, take_inner, profile)
+    strat_simple_var = parse_strategy_simple_var(input, take_inner, profile)
     if not strat_value and not strat_simple_var:
-        strat_params = parse_strategy_params_coffee(input, take_inner) or parse_strategy_params(input, take_inner)
-        strat_coffee_return = parse_strategy_fallback(input, take_inner)
+        strat_params = parse_strategy_params_coffee(input, take_inner, profile) or parse_strategy_params(input, take_inner, profile)
+        strat_coffee_return = parse_strategy_fallback(input, take_inner, profile)
 
     strat = strat_value or strat_simple_var or strat_params or strat_coffee_return
 
     if strat:
-        params = parse_params(strat.get('param_str', ''), flowtype_enabled)
+        params = parse_params(strat.get('param_str', ''), flowtype_enabled, profile)
 
     # If assignment with only 1 param, no need to expand it, switch to simple_var
     if len(params) == 1 and strat_simple_var and strat is not strat_simple_var:
         strat = strat_simple_var
-        params = parse_params(strat.get('param_str', ''))
+        params = parse_params(strat.get('param_str', ''), True, profile)
 
     strat = strat or {
         'display_key': True
     }
 
-    for param in params: param['display_key'] = True
-    if len(params) == 1 and params[0]['name'] == strat.get('identifier_str'):
-        params[0]['display_key'] = False
+    if len(params) == 1 and params[0].name == strat.get('identifier_str'):
+        params[0].display_key = False
 
-    args = []
-    cleansed_identifier = utils.shorten(clean_identifier(strat.get('identifier_str') or '')).replace("'", "\\'")
-    if utils.get_setting('always_log_filename', False): args.append("'%s:%d'" % (utils.shorten(filename), lineno))
+    log_value = strat is strat_value and strat.get('identifier_str') != strat.get('param_str')
+    return (strat.get('identifier_str') or '', log_value, params)
+
+def parse_line_in_budget(input, filename, lineno, take_inner, flowtype_enabled, settings, profile = None):
+    """
+    Run parse_line within the settings' max_parse_ms budget.
+    Returns `(parsed, within_budget)`. Lines that run out of budget parse to nothing (which
+    logs `filename:lineno`) and are recorded in over_budget.
+    """
+    previous_budget = utils.start_budget(settings['max_parse_ms'])
+    try:
+        return (parse_line(input, take_inner, flowtype_enabled, profile), True)
+    except utils.ParseBudgetExceeded as e:
+        # Pathological line: give up and log `filename:lineno` only
+        over_budget.append({'filename': filename, 'lineno': lineno, 'input': input, 'ops': e.args[0]})
+        return (('', False, []), False)
+    finally:
+        utils.end_budget(previous_budget)
+
+def format_log_statement(parsed, filename, lineno, settings, profile = None):
+    """
+    Return the log statement for a parse_line result, shaped by the profile's log template
+    or the log_template setting.
 
-    if strat == strat_value and strat.get('identifier_str') != strat.get('param_str'):
-        args.append("'%s:', %s" % (cleansed_identifier, strat['identifier_str']))
+    >>> parsed = parse_line('var foo = a + b', True, True)
+    >>> format_log_statement(parsed, 'a.js', 1, dict(utils.SETTINGS_DEFAULTS, log_template = 'logger.{level}({label}, { {pairs} })'))
+    "logger.log('foo:', foo, { 'a:', a, 'b:', b })"
+    """
+    if profile is None: profile = profiles.default_profile()
+    identifier_str, log_value, params = parsed
+    max_length = settings['max_identifier_length']
+
+    location = "'%s:%d'" % (utils.shorten(filename, max_length), lineno)
+    cleansed_identifier = utils.shorten(clean_identifier(identifier_str), max_length).replace("'", "\\'")
+    if log_value:
+        label = "'%s:', %s" % (cleansed_identifier, identifier_str)
     elif cleansed_identifier:
-        args.append("'%s'" % cleansed_identifier)
-    elif not utils.get_setting('always_log_filename'):
-        args.append("'%s:%d'" % (filename, lineno))
-
-    args.extend([
-        (p['type'] == 'string' or not p['display_key']) \
-            and p['name']
-            or "'" + utils.shorten(p['name']).replace("'", "\\'") + ":', " + p['name'] # 'name': name
+        label = "'%s'" % cleansed_identifier
+    else:
+        label = ''
+    pairs = [
+        (p.type == 'string' or not p.display_key) \
+            and p.name
+            or "'" + utils.shorten(p.name, max_length).replace("'", "\\'") + ":', " + p.name # 'name': name
         for p in params
-    ])
+    ]
+
+    args = []
+    if settings['always_log_filename']: args.append(location)
+    if label: args.append(label)
+    elif not settings['always_log_filename']: args.append("'%s:%d'" % (filename, lineno))
+    args.extend(pairs)
+
+    return profiles.for_settings(profile, settings).template.format({
+        'level': settings['default_log_level'],
+        'label': label or "'%s:%d'" % (filename, lineno),
+        'pairs': ', '.join(pairs),
+        'location': location,
+        'args': ', '.join(args),
+        'semicolon': settings['print_trailing_semicolon'] and ';' or ''
+    })
+
+def _line_profile(line):
+    "Return the profile for a create_log_statements line tuple"
+    return len(line) > 5 and line[5] and profiles.get_profile(line[5]) or profiles.default_profile(line[4])
+
+def _parse_line_job(job):
+    "Unpack a (line, settings) job for create_log_statements' process pool"
+    line, settings = job
+    return parse_line_in_budget(line[0], line[1], line[2], line[3], line[4], settings, _line_profile(line))
+
+def create_log_statements(lines, processes = 0, settings = None, cache = None):
+    """
+    Batched version of create_log_statement.
+    lines is a list of `(input, filename, lineno, take_inner, flowtype_enabled[, profile_name])` tuples.
+    Identical lines are only parsed once.
+    If processes > 1 the unique lines are parsed in a process pool of that size.
+    cache is an optional cache.ParseCache holding parse results from earlier runs.
+    Returns the log statements in the same order as lines.
+
+    >>> create_log_statements([
+    ...     ('var foo = 1', 'somefile.js', 1, True, True),
+    ...     ('fn(a, b)', 'somefile.js', 2, True, True),
+    ...     ('var foo = 1', 'somefile.js', 1, True, True)
+    ... ])
+    ["console.log('foo', foo)", "console.log('fn', 'a:', a, 'b:', b)", "console.log('foo', foo)"]
+
+    >>> create_log_statements([('def fn(a, b):', 'somefile.py', 1, True, True, 'python')])
+    ["print('fn', 'a:', a, 'b:', b)"]
+
+    >>> create_log_statements([])
+    []
+    """
+    if settings is None: settings = utils.SETTINGS_DEFAULTS
+    lines = [tuple(line) for line in lines]
+
+    unique_lines = []
+    seen = set()
+    for line in lines:
+        if line not in seen:
+            seen.add(line)
+            unique_lines.append(line)
+
+    parsed = {}
+    if cache is not None:
+        for line in unique_lines:
+            hit = cache.get(line[0], line[3], line[4], _line_profile(line))
+            if hit is not None: parsed[line] = hit
+    to_parse = [line for line in unique_lines if line not in parsed]
+
+    if processes > 1 and len(to_parse) > 1:
+        import multiprocessing
+        jobs = [(line, settings) for line in to_parse]
+        chunksize = max(1, len(jobs) // (processes * 4))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_parse_line_job, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_parse_line_job((line, settings)) for line in to_parse]
 
-    return "console.%s(%s)%s" % (utils.get_setting('default_log_level', 'log'), ', '.join(args), utils.get_setting('print_trailing_semicolon') and ';' or '')
+    for (line, (result, within_budget)) in zip(to_parse, results):
+        parsed[line] = result
+        if cache is not None and within_budget: cache.set(line[0], line[3], line[4], result, _line_profile(line))
 
-def cycle_log_types(view, edit, line_region, line, direction):
+    statements = dict(
+        (line, format_log_statement(parsed[line], line[1], line[2], settings, _line_profile(line)))
+        for line in unique_lines
+    )
+    return [statements[line] for line in lines]
+
+def parse_assigned_names(input, profile = None):
     """
-    Parses the current `console.xxx` from the given line and replaces xxx with the
-    next log method.
+    Return what a line assigns to (or imports) as Params, [] if it doesn't assign anything.
+
+    >>> parse_assigned_names('const {a, b: c} = getObj();')
+    [Param('a', 'statement'), Param('c', 'statement')]
+
+    >>> parse_assigned_names('fn(a, b)')
+    []
+    """
+    if profile is None: profile = profiles.default_profile()
+    input = clean_line(input, profile)
+    # The assignee is the part of the simple_var strategy that isn't a keyword
+    strat = parse_strategy_simple_var(input, True, profile)
+    if not strat or not strat.get('param_str') or strat['identifier_str'] in ('return', 'for'): return []
+    if strat['identifier_str'] != 'import' and not utils.find_all_not_in_parens_or_strings(input, patterns.ASSIGNMENT):
+        return []
+    return parse_params(strat['param_str'], profile.flowtype, profile)
+
+def create_assignments_log_statement(lines, filename, lineno, settings = None, profile = None):
+    """
+    Return one log statement for everything assigned in lines, each name only once,
+    or None if nothing is assigned. Identical lines are only parsed once and every line
+    gets its own max_parse_ms budget.
+
+    >>> create_assignments_log_statement(['var a = 1', 'const {b, c: d} = obj', 'fn(a)', 'a = b + 2'], 'a.js', 5)
+    "console.log('a.js:5', 'a:', a, 'b:', b, 'd:', d)"
+
+    >>> create_assignments_log_statement(['fn(a)', ''], 'a.js', 3)
+    """
+    if settings is None: settings = utils.SETTINGS_DEFAULTS
+    if profile is None: profile = profiles.default_profile()
+    params = []
+    seen = set()
+    parsed = set()
+    for (i, line) in enumerate(lines):
+        if line in parsed: continue
+        parsed.add(line)
+        previous_budget = utils.start_budget(settings['max_parse_ms'])
+        try:
+            names = parse_assigned_names(line, profile)
+        except utils.ParseBudgetExceeded as e:
+            over_budget.append({'filename': filename, 'lineno': lineno - len(lines) + i, 'input': line, 'ops': e.args[0]})
+            names = []
+        finally:
+            utils.end_budget(previous_budget)
+        for param in names: add_param(params, seen, param.name, profile)
+    if not params: return None
+    return format_log_statement(('', False, params), filename, lineno, settings, profile)
+
+class Engine(object):
     """
-    current_type = None
+    Log statement engine bound to a settings snapshot. It has no mutable state and never touches
+    the editor, so one instance can be shared by any number of threads (e.g. `*_async` handlers or
+    the language server's pool).
+
+    >>> engine = Engine({'print_trailing_semicolon': True})
+    >>> engine.log_statement('var foo = a + b', 'a.js', 1)
+    "console.log('foo:', foo, 'a:', a, 'b:', b);"
+    >>> engine.log_statement('def fn(a):', 'a.py', 1, profile = profiles.get_profile('python'))
+    "print('fn', 'a:', a)"
+
+    Many threads sharing an engine get what a single thread gets, also next to a thread with its own
+    parse budget. The budget is wall clock time (see utils.ParseBudget), so under contention lines can
+    fall back to `filename:lineno` that don't on their own. The shared engine has none to keep this
+    deterministic:
+
+    >>> import threading
+    >>> lines = [line for (line, flowtype_enabled) in [
+    ...     ('var {a:c, b:d} = getObj(1, 2)', True), ('fn(a, b).then(a => { 1 })', True),
+    ...     ('fn = (a, b) ->', False), ('import {a, b as c} from "foo"', True)]]
+    >>> def run(engine):
+    ...     return [engine.log_statement(line, 'a.js', i, i % 2 == 0) for (i, line) in enumerate(lines * 3)]
+    >>> shared = Engine({'max_parse_ms': 0})
+    >>> expected = run(shared)
+    >>> results = []
+    >>> threads = [threading.Thread(target = lambda: results.append(run(shared))) for i in range(16)]
+    >>> threads.append(threading.Thread(target = lambda: run(Engine({'max_parse_ms': 0.001}))))
+    >>> for thread in threads: thread.start()
+    >>> for thread in threads: thread.join()
+    >>> len(results), all(result == expected for result in results)
+    (16, True)
+    """
+
+    def __init__(self, settings = None):
+        self.settings = dict(utils.SETTINGS_DEFAULTS)
+        self.settings.update(settings or {})
+
+    def parse(self, input, take_inner = True, profile = None):
+        "Return the parse_line result for input, within the max_parse_ms budget"
+        if profile is None: profile = profiles.default_profile()
+        return parse_line_in_budget(input, '', 0, take_inner, profile.flowtype, self.settings, profile)[0]
+
+    def log_statement(self, input, filename, lineno, take_inner = True, profile = None):
+        if profile is None: profile = profiles.default_profile()
+        return create_log_statement(input, filename, lineno, take_inner, profile.flowtype, self.settings, profile)
 
-    matches = re.match(r'^\s*console\.(\w+)', line)
-    if not matches: return
+    def log_statements(self, lines, processes = 0, cache = None):
+        "See create_log_statements"
+        return create_log_statements(lines, processes, self.settings, cache)
+
+def create_timing_probe(input, filename, lineno, kind = None, settings = None, profile = None):
+    """
+    Return the (start, end) statements of a timing probe around code starting with the line input,
+    labelled with what logging that line would use as identifier (or filename:lineno).
+    kind is one of profile.probe_kinds, by default the first one. Returns None if the profile has no
+    timing probes.
+
+    >>> create_timing_probe('const data = await fetchData(url)', 'a.js', 3)
+    ("console.time('logmagic:data')", "console.timeEnd('logmagic:data')")
+    >>> create_timing_probe('async render(props) {', 'a.js', 3, 'performance')
+    ("performance.mark('logmagic:render')", "performance.measure('logmagic:render', 'logmagic:render')")
+    >>> create_timing_probe('}', 'a.js', 3)
+    ("console.time('logmagic:a.js:3')", "console.timeEnd('logmagic:a.js:3')")
+    """
+    if settings is None: settings = utils.SETTINGS_DEFAULTS
+    if profile is None: profile = profiles.default_profile()
+    if not profile.probe_kinds: return None
+    start, end = profile.timing_probes[kind or profile.probe_kinds[0]]
+
+    identifier_str = parse_line_in_budget(input, filename, lineno, True, profile.flowtype, settings, profile)[0][0]
+    max_length = settings['max_identifier_length']
+    identifier = clean_identifier(identifier_str) or '%s:%d' % (filename, lineno)
+    label = "'%s%s'" % (profiles.PROBE_LABEL_PREFIX, utils.shorten(identifier, max_length).replace("'", "\\'"))
+    values = {'label': label, 'semicolon': settings['print_trailing_semicolon'] and ';' or ''}
+    return start.format(values), end.format(values)
+
+def wrap_in_timing_probe(body, start, end, indent, profile = None):
+    """
+    Return the lines of a function body timed by the start and end statements of a timing probe.
+    The body is wrapped in the profile's try/finally so the end runs however the function returns:
+    an end statement in front of every return would become the body of a braceless `if (a)` and
+    miss returns that don't start their line. indent is that of the line opening the function.
+    Lines continuing a multi-line string are not indented. Returns None if the profile has no try/finally.
+
+    >>> body = ['  if (a)', '    return b', '  if (c) return d;', '  const s = `x', 'y`']
+    >>> for line in wrap_in_timing_probe(body, "console.time('t')", "console.timeEnd('t')", ''): print(line)
+      console.time('t')
+      try {
+        if (a)
+          return b
+        if (c) return d;
+        const s = `x
+    y`
+      } finally {
+        console.timeEnd('t')
+      }
+    >>> wrap_in_timing_probe([], 'start()', 'end()', '\\t')
+    ['\\t\\tstart()', '\\t\\ttry {', '\\t\\t} finally {', '\\t\\t\\tend()', '\\t\\t}']
+    >>> wrap_in_timing_probe(body, 'start', 'end', '', profiles.get_profile('coffeescript'))
+
+    Removing all log statements unwraps the body again (see utils.find_log_removals):
+
+    >>> lines = ['function f() {'] + wrap_in_timing_probe(body, "console.time('logmagic:f')", "console.timeEnd('logmagic:f')", '') + ['}']
+    >>> text = '\\n'.join(lines)
+    >>> for (a, b) in reversed(utils.find_log_removals(text)[0]): text = text[ : a] + text[b : ]
+    >>> text == '\\n'.join(['function f() {'] + body + ['}'])
+    True
+    """
+    if profile is None: profile = profiles.default_profile()
+    if not profile.probe_try_finally: return None
+    opening, middle, closing = profile.probe_try_finally
+    code = [line for line in body if line.strip()]
+    body_indent = code and code[0][ : len(code[0]) - len(code[0].lstrip())]
+    if not body_indent or len(body_indent) <= len(indent):
+        body_indent = indent + (indent[:1] == '\t' and '\t' or '  ')
+    step = body_indent[len(indent) : ]
+
+    lines = [body_indent + start, body_indent + opening]
+    string = None
+    for line in body:
+        lines.append((string or not line.strip()) and line or step + line)
+        string = utils.scan_balance(line, string, profile.comments)[2]
+    lines.extend([body_indent + middle, body_indent + step + end, body_indent + closing])
+    return lines
+
+def cycle_log_type(line, direction, profile = None):
+    """
+    Return line with its `console.xxx` replaced by the next (or previous) log method.
+    Returns None if line is not a log statement or the profile has no log methods to cycle.
 
+    >>> cycle_log_type('  console.log(a)', 'down')
+    '  console.info(a)'
+
+    >>> cycle_log_type('console.log(a)', 'up')
+    'console.error(a)'
+
+    >>> cycle_log_type('console.table(a)', 'down')
+    'console.log(a)'
+
+    >>> cycle_log_type('foo(a)', 'down')
+
+    >>> cycle_log_type('print(a)', 'down', profiles.get_profile('python'))
+
+    >>> cycle_log_type("console.time('logmagic:a')", 'down')
+    """
+    if profile is None: profile = profiles.default_profile()
+    matches = profile.log_type_re and not profile.is_probe(line) and profile.log_type_re.match(line)
+    if not matches: return None
+
+    log_types = profile.log_types
     current_type = matches.group(1)
-    if current_type in utils.LOG_TYPES:
+    if current_type in log_types:
         inc = direction == 'down' and 1 or -1
-        next_type = utils.LOG_TYPES[(utils.LOG_TYPES.index(current_type) + inc) % len(utils.LOG_TYPES)]
+        next_type = log_types[(log_types.index(current_type) + inc) % len(log_types)]
     else:
-        next_type = 'log' # Some non-standard default log command, switch to normal cycle
-    new_line = line.replace('console.' + current_type, 'console.' + next_type)
+        next_type = log_types[0] # Some non-standard default log command, switch to normal cycle
+    return line[:matches.start(1)] + next_type + line[matches.end(1):]
+
+def cycle_log_variant(line, counter, settings = None, profile = None):
+    """
+    Return the log statement line turned into its next variant: plain, then each of the profile's
+    log_variants (sampled every sample_every calls, rate limited to rate_limit calls per second),
+    then plain again. counter names the variable the new variant keeps its state in. It has to be
+    unused (see utils.unused_counter_names): variants keep different kinds of state, so a line never
+    keeps its old counter. Returns None if line is not a log statement or there are no variants.
+
+    >>> line = cycle_log_variant('  console.log(a)', '__logmagic_1'); line
+    '  (globalThis.__logmagic_1 = (globalThis.__logmagic_1 || 0) + 1) % 100 === 0 && console.log(a)'
+    >>> line = cycle_log_variant(line, next(utils.unused_counter_names(line))); line[ : 60]
+    '  (c => (Date.now() - c.t >= 1000 && (c.t = Date.now(), c.n '
+    >>> '__logmagic_1' in line, 'globalThis.__logmagic_2 = ' in line, utils.is_log_statement(line)
+    (False, True, True)
+    >>> cycle_log_variant(line, '__logmagic_3')
+    '  console.log(a)'
+
+    >>> cycle_log_variant('print(a)', '__logmagic_1', profile = profiles.get_profile('python'))
+    """
+    if settings is None: settings = utils.SETTINGS_DEFAULTS
+    if profile is None: profile = profiles.default_profile()
+    if not profile.log_variants or not profile.is_log_statement(line) or profile.is_probe(line): return None
+
+    statement = line.lstrip()
+    indent = line[ : len(line) - len(statement)]
+    current = -1
+    for (i, variant) in enumerate(profile.log_variants):
+        match = variant['re'].match(line)
+        if match:
+            current = i
+            statement = line[match.end() : ]
+            break
+    if current + 1 == len(profile.log_variants): return indent + statement
+
+    variant = profile.log_variants[current + 1]
+    wrapper = variant['wrapper'].replace('{counter}', counter).replace('{n}', str(max(1, int(settings[variant['setting']]))))
+    return indent + wrapper + statement
+
+def cycle_log_types(view, edit, line_region, line, direction, profile = None):
+    """
+    Parses the current `console.xxx` from the given line and replaces xxx with the
+    next log method.
+    """
+    new_line = cycle_log_type(line, direction, profile)
+    if new_line is None: return
 
     view.replace(edit, line_region, new_line)
 
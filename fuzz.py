@@ -0,0 +1,313 @@
+"""
+Differential fuzzing of the parser against a frozen reference engine.
+
+    python -m LogMagic.fuzz [--reference REV|DIR] [--all] [--count N] [--seed N] [--show N] [corpus files...]
+
+The reference engine is the parser modules (see ENGINE_MODULES) as of a git revision or as found in a
+directory. By default that's BASELINE_REVISION, the original parser; `--reference HEAD` checks just your
+uncommitted changes. Lines are generated from a small JavaScript/CoffeeScript grammar and by mutating
+corpus lines (bench.CORPUS unless files are given). Every line is logged in both directions by both
+engines. Differing output is reported along with the speedup of the current engine, except for the
+intended differences in ACCEPTED_DIVERGENCES, which are only counted (`--all` reports them too).
+Exits with 1 if there were other divergences.
+"""
+
+import importlib, inspect, os, random, re, shutil, subprocess, sys, tempfile, time
+from . import bench
+from . import core
+from . import profiles
+from . import utils
+
+DEFAULT_COUNT = 1000
+DEFAULT_SHOW = 20
+ENGINE_MODULES = ['patterns', 'profiles', 'utils', 'core']
+REFERENCE_PACKAGE = 'logmagic_reference'
+# The parser before it got profiles, batching and parse budgets
+BASELINE_REVISION = '072d60a3317a3122f7f468446619d567a032cf52'
+
+DECLARATION_RE = re.compile(r'\s*(?:for\s*\(\s*)?(?:var|let|const)\s')
+LOGICAL_OPERATOR_RE = re.compile(r'\|\||&&|\?')
+WORD_OPERATOR_RE = re.compile(r'(?<=\s)(?:and|or|is|isnt|not)(?=\s)')
+
+def _raised(outputs):
+    return any(output.startswith('raised ') for output in outputs)
+
+def _is_js_call_without_parens(line):
+    match = utils.match_call_without_parens(line.strip())
+    return bool(match) and match[0] not in profiles.get_profile('javascript').operator_keywords
+
+# Differences from the baseline that were triaged and are intended, as (reason, predicate) pairs.
+# Predicates take (line, flowtype_enabled, reference outputs, current outputs); flowtype off is CoffeeScript.
+ACCEPTED_DIVERGENCES = [
+    ('the reference raised',
+        lambda line, flowtype_enabled, expected, actual: _raised(expected) and not _raised(actual)),
+    ('declaration keywords are not logged as values (`var f`, `for (let a of b)`)',
+        lambda line, flowtype_enabled, expected, actual: flowtype_enabled and DECLARATION_RE.match(line)),
+    ('`#` only starts comments in CoffeeScript and Python (`this.#count`)',
+        lambda line, flowtype_enabled, expected, actual: flowtype_enabled and '#' in line),
+    ('`and`, `or`, `is`, `isnt` and `not` are only operators in CoffeeScript and Python',
+        lambda line, flowtype_enabled, expected, actual: flowtype_enabled and WORD_OPERATOR_RE.search(line)),
+    ('callbacks after `||`, `&&` or `?` are logged like others, not just the first operand',
+        lambda line, flowtype_enabled, expected, actual: flowtype_enabled and LOGICAL_OPERATOR_RE.search(line)
+            and ('=>' in line or 'function' in line)),
+    ('JavaScript has no calls without parens (`ar foo`)',
+        lambda line, flowtype_enabled, expected, actual: flowtype_enabled and _is_js_call_without_parens(line)),
+    ("a ternary's `?` isn't a name (`a ? () => b`)",
+        lambda line, flowtype_enabled, expected, actual: any(output.startswith("console.log('?'") for output in expected)),
+    ('`//` is floor division in CoffeeScript',
+        lambda line, flowtype_enabled, expected, actual: not flowtype_enabled and '//' in line),
+]
+
+IDENTIFIERS = ['a', 'b', 'foo', 'barBaz', '$el', '_private', 'this.state', 'obj.items[0]', 'i']
+LITERALS = ['1', '0.5', '"str"', "'s'", '`t ${a}`', 'true', 'null', 'undefined', '[]', '{}']
+JS_OPERATORS = ['+', '-', '*', '/', '&&', '||', '===', '!==', '<', '>=', '?', 'in']
+COFFEE_OPERATORS = ['+', '-', '*', 'and', 'or', 'is', 'isnt', '<', '>=', '?', 'in']
+JS_TEMPLATES = [
+    'var %(name)s = %(expr)s',
+    'let %(name)s = %(expr)s;',
+    'const %(pattern)s = %(expr)s',
+    '%(name)s = %(expr)s',
+    'return %(expr)s',
+    'if (%(expr)s) {',
+    '} else if (%(expr)s) {',
+    'function %(name)s(%(params)s) {',
+    'export default function %(name)s(%(params)s) {',
+    '%(name)s(%(args)s)',
+    '%(expr)s.then((%(params)s) => {',
+    '%(name)s: function(%(params)s) {',
+    '%(name)s(%(params)s): %(type)s {',
+    'for (let %(name)s of %(expr)s) {',
+    'import {%(names)s} from "%(name)s"',
+]
+COFFEE_TEMPLATES = [
+    '%(name)s = %(expr)s',
+    '%(name)s = (%(params)s) ->',
+    '%(name)s: (%(params)s) =>',
+    '%(name)s %(args)s',
+    'if %(expr)s',
+    'return %(expr)s unless %(expr)s',
+    'for %(name)s in %(expr)s',
+]
+# Fragments inserted by mutations, biased towards what trips up the scanners
+MUTATION_TOKENS = ['(', ')', '{', '}', '[', ']', ',', '"', "'", '`', '\\', ' ', '=', '=>', '->', ':', '...', ' in ', ' and ', '//', '#']
+
+def generate_expression(rng, operators, depth = 0):
+    "Return a random expression"
+    kind = rng.randint(0, depth > 2 and 1 or 7)
+    expression = lambda: generate_expression(rng, operators, depth + 1)
+    if kind == 0: return rng.choice(IDENTIFIERS)
+    if kind == 1: return rng.choice(LITERALS)
+    if kind == 2: return '%s %s %s' % (expression(), rng.choice(operators), expression())
+    if kind == 3: return '%s(%s)' % (rng.choice(IDENTIFIERS), ', '.join(expression() for i in range(rng.randint(0, 3))))
+    if kind == 4: return '%s.%s' % (expression(), rng.choice(IDENTIFIERS[:6]))
+    if kind == 5: return '{%s}' % ', '.join('%s: %s' % (rng.choice(IDENTIFIERS[:6]), expression()) for i in range(rng.randint(0, 3)))
+    if kind == 6: return '(%s) => %s' % (generate_params(rng), expression())
+    return '[%s]' % ', '.join(expression() for i in range(rng.randint(0, 3)))
+
+def generate_pattern(rng):
+    "Return a random binding pattern (a name or a destructuring)"
+    names = rng.sample(IDENTIFIERS[:6], rng.randint(1, 3))
+    kind = rng.randint(0, 3)
+    if kind == 0: return names[0]
+    if kind == 1: return '{%s}' % ', '.join(names)
+    if kind == 2: return '{%s}' % ', '.join('%s: %s' % (name, name.upper()) for name in names)
+    return '[%s]' % ', '.join(names[:-1] + ['...' + names[-1]])
+
+def generate_params(rng):
+    "Return a random parameter list (without the parentheses)"
+    params = []
+    for i in range(rng.randint(0, 3)):
+        kind = rng.randint(0, 3)
+        param = kind == 3 and generate_pattern(rng) or rng.choice(IDENTIFIERS[:6])
+        if kind == 1: param += ' = %s' % rng.choice(LITERALS)
+        if kind == 2: param += ': %s' % rng.choice(['Number', 'String', '?Object', 'Array<T>'])
+        params.append(param)
+    return ', '.join(params)
+
+def generate_line(rng, coffee = False):
+    "Return a random JavaScript (or CoffeeScript) line"
+    operators = coffee and COFFEE_OPERATORS or JS_OPERATORS
+    values = {
+        'name': rng.choice(IDENTIFIERS[:6]),
+        'names': ', '.join(rng.sample(IDENTIFIERS[:6], rng.randint(1, 3))),
+        'expr': generate_expression(rng, operators),
+        'pattern': generate_pattern(rng),
+        'params': generate_params(rng),
+        'args': ', '.join(generate_expression(rng, operators, 1) for i in range(rng.randint(0, 3))),
+        'type': rng.choice(['any', 'void', 'Promise<T>', '{a: Number}']),
+    }
+    return rng.choice(coffee and COFFEE_TEMPLATES or JS_TEMPLATES) % values
+
+def mutate(line, rng):
+    "Return line with a random slice deleted, duplicated or replaced, or a random token inserted"
+    if not line: return rng.choice(MUTATION_TOKENS)
+    start = rng.randint(0, len(line) - 1)
+    end = min(len(line), start + rng.randint(1, 8))
+    kind = rng.randint(0, 4)
+    if kind == 0: return line[ : start] + line[end : ]
+    if kind == 1: return line[ : end] + line[start : end] + line[end : ]
+    if kind == 2: return line[ : start] + rng.choice(MUTATION_TOKENS) + line[start : ]
+    if kind == 3: return line[ : start] + rng.choice(MUTATION_TOKENS) + line[end : ]
+    return line[ : end]
+
+def generate_inputs(count, rng, corpus):
+    "Return count (line, flowtype_enabled) inputs: JavaScript, CoffeeScript and mutated corpus lines"
+    inputs = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            inputs.append((generate_line(rng), True))
+        elif kind == 1:
+            inputs.append((generate_line(rng, coffee = True), False))
+        else:
+            line, flowtype_enabled = rng.choice(corpus)
+            for j in range(rng.randint(1, 3)): line = mutate(line, rng)
+            inputs.append((line, flowtype_enabled))
+    return inputs
+
+def load_reference(reference = BASELINE_REVISION):
+    """
+    Import the engine from a git revision or a directory as a separate package and return its core module.
+    Modules that don't exist in the reference (e.g. profiles.py in old revisions) are skipped.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    temp_dir = tempfile.mkdtemp()
+    package_dir = os.path.join(temp_dir, REFERENCE_PACKAGE)
+    os.mkdir(package_dir)
+    try:
+        open(os.path.join(package_dir, '__init__.py'), 'w').close()
+        for module in ENGINE_MODULES:
+            target = os.path.join(package_dir, module + '.py')
+            if os.path.isdir(reference):
+                source = os.path.join(reference, module + '.py')
+                if os.path.isfile(source): shutil.copy(source, target)
+                continue
+            try:
+                content = subprocess.check_output(
+                    ['git', 'show', '%s:./%s.py' % (reference, module)], cwd = root, stderr = subprocess.DEVNULL)
+            except subprocess.CalledProcessError:
+                continue
+            with open(target, 'wb') as f:
+                f.write(content)
+        sys.path.insert(0, temp_dir)
+        try:
+            return importlib.import_module(REFERENCE_PACKAGE + '.core')
+        finally:
+            sys.path.remove(temp_dir)
+    finally:
+        shutil.rmtree(temp_dir)
+
+def log_statement_function(engine, settings):
+    "Return engine.create_log_statement with settings applied if the engine takes them"
+    create_log_statement = engine.create_log_statement
+    if 'settings' not in inspect.signature(create_log_statement).parameters: return create_log_statement
+    return lambda *args: create_log_statement(*args, settings = settings)
+
+def run(create_log_statement, line, flowtype_enabled):
+    "Log line in both directions. Returns the outputs (exceptions included) and the time taken"
+    outputs = []
+    start = time.perf_counter()
+    for take_inner in (True, False):
+        try:
+            outputs.append(create_log_statement(line, 'fuzz.js', 1, take_inner, flowtype_enabled))
+        except Exception as e:
+            outputs.append('raised %s: %s' % (type(e).__name__, e))
+    return outputs, time.perf_counter() - start
+
+def compare(reference, current, inputs, settings = None):
+    """
+    Run all (line, flowtype_enabled) inputs through both engines.
+    Returns the divergences as (line, flowtype_enabled, reference outputs, current outputs)
+    and the timings as (line, reference seconds, current seconds).
+
+    >>> divergences, timings = compare(core, core, [('var foo = a + b', True), ('fn a, b', False)])
+    >>> divergences, len(timings)
+    ([], 2)
+    """
+    if settings is None: settings = dict(utils.load_settings(), max_parse_ms = 0)
+    reference_function = log_statement_function(reference, settings)
+    current_function = log_statement_function(current, settings)
+    divergences = []
+    timings = []
+    for (line, flowtype_enabled) in inputs:
+        expected, reference_time = run(reference_function, line, flowtype_enabled)
+        actual, current_time = run(current_function, line, flowtype_enabled)
+        if expected != actual: divergences.append((line, flowtype_enabled, expected, actual))
+        timings.append((line, reference_time, current_time))
+    return divergences, timings
+
+def triage(divergences):
+    """
+    Split divergences into those ACCEPTED_DIVERGENCES doesn't explain and a {reason: count} of those it does
+
+    >>> unexpected, accepted = triage([('var f', True, ["console.log('var f:', var f)"] * 2, ["console.log('f:', f)"] * 2),
+    ...     ('fn(a)', True, ["console.log('fn', 'a:', a)"] * 2, ["console.log('a.js:1')"] * 2)])
+    >>> [divergence[0] for divergence in unexpected], list(accepted.values())
+    (['fn(a)'], [1])
+    """
+    unexpected = []
+    accepted = {}
+    for divergence in divergences:
+        for (reason, predicate) in ACCEPTED_DIVERGENCES:
+            if predicate(*divergence):
+                accepted[reason] = accepted.get(reason, 0) + 1
+                break
+        else:
+            unexpected.append(divergence)
+    return unexpected, accepted
+
+def report(divergences, timings, show, output, accepted = None):
+    """
+    Print divergences and speedups along with the counts of accepted divergences (see triage).
+    Returns the process exit code.
+    """
+    accepted = accepted or {}
+    for (line, flowtype_enabled, expected, actual) in divergences[ : show]:
+        output.write('%r (flowtype %s)\n' % (line, flowtype_enabled and 'on' or 'off'))
+        for (direction, before, after) in zip(('down', 'up'), expected, actual):
+            if before != after:
+                output.write('  %s reference: %s\n  %s current:   %s\n' % (direction, before, direction, after))
+    if len(divergences) > show:
+        output.write('... and %d more\n' % (len(divergences) - show))
+
+    reference_total = sum(t[1] for t in timings)
+    current_total = sum(t[2] for t in timings)
+    speedups = sorted((t[1] / max(t[2], 1e-9), t[0]) for t in timings)
+    output.write('%d inputs, %d divergences' % (len(timings), len(divergences)))
+    output.write(accepted and ' (and %d accepted)\n' % sum(accepted.values()) or '\n')
+    for (reason, count) in sorted(accepted.items(), key = lambda item: -item[1]):
+        output.write('  %d: %s\n' % (count, reason))
+    if speedups:
+        output.write('reference %.2fs, current %.2fs: %.2fx overall, %.2fx median per input, worst %.2fx on %r\n' % (
+            reference_total, current_total, reference_total / max(current_total, 1e-9),
+            speedups[len(speedups) // 2][0], speedups[0][0], speedups[0][1]))
+    return divergences and 1 or 0
+
+def main(argv):
+    reference = BASELINE_REVISION
+    strict = False
+    count = DEFAULT_COUNT
+    seed = None
+    show = DEFAULT_SHOW
+    paths = []
+    args = list(argv[1:])
+    while args:
+        arg = args.pop(0)
+        if arg == '--reference': reference = args.pop(0)
+        elif arg == '--all': strict = True
+        elif arg == '--count': count = int(args.pop(0))
+        elif arg == '--seed': seed = int(args.pop(0))
+        elif arg == '--show': show = int(args.pop(0))
+        else: paths.append(arg)
+
+    if seed is None: seed = random.randrange(1000000)
+    sys.stdout.write('LogMagic fuzz: seed %d, reference %s\n' % (seed, reference))
+    corpus = paths and bench.load_corpus(paths) or bench.CORPUS
+    inputs = generate_inputs(count, random.Random(seed), corpus)
+    divergences, timings = compare(load_reference(reference), core, inputs)
+    accepted = {}
+    if not strict: divergences, accepted = triage(divergences)
+    return report(divergences, timings, show, sys.stdout, accepted)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
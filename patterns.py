@@ -0,0 +1,47 @@
+"""
+Every regular expression the parser uses, compiled once at import.
+
+Sublime runs all plugins in one interpreter so the `re` module's cache of compiled patterns
+is shared with everybody else and gets evicted. Patterns used by the parser live here instead
+and are never recompiled. Nothing in this module is modified after import.
+"""
+
+import re
+
+# A character that can be part of an identifier (or a member expression like `a.b`)
+IDENTIFIER_CHAR = r'[^\s\(\)\[\]\{\}+*/&\|=<>,:~-]'
+
+# Besides whitespace, the characters that can't be part of an identifier (see IDENTIFIER_CHAR), start
+# a flowtype type or start coffee's call arguments without parens. Used by the linear time scanners in
+# utils (is_function, match_call_without_parens, is_flowtype_destructuring, rfind_identifier,
+# match_arrow_param) that replace patterns prone to catastrophic backtracking.
+IDENTIFIER_DELIMITERS = frozenset('()[]{}+*/&|=<>,:~-')
+TYPE_DELIMITERS = frozenset('()[]{}+*/&|=,:~-')
+CALL_ARGS_DELIMITERS = frozenset('=<>()[]{}')
+
+# Searched for with utils.find_not_in_string and friends, so wrapped in {'re': ...}
+ASSIGNMENT = {'re': re.compile(r'(?<![<>])=(?!\>)')}
+ASSIGNEE_EQUALS = {'re': re.compile(r'(?<![<>=])=(?!=)')}
+DESTRUCTURING_EQUALS = {'re': re.compile(r'(?<!=)=(?!=)')}
+
+# `foo as bar`
+AS_ALIAS_RE = re.compile(r'(?<!%s)as\s+(.+)$' % IDENTIFIER_CHAR)
+
+RETURN_RE = re.compile(r'^\s*return')
+IMPORT_RE = re.compile(r'^\s*import')
+FOR_RE = re.compile(r'^\s*for\(')
+EXPORT_RE = re.compile(r'^\s*export(?!\s+function)')
+# Statements whose body may be the next statement, without braces: `} else if (a)`, `while (a)`, `do`
+CONTROL_HEADER_RE = re.compile(r'^\s*(?:\}\s*)?(?:else\s+(?=if\b))?(if|for|while|with|else|do)\b\s*')
+# Class and object methods `async foo(a) {` (but not `if (a) {` and friends)
+METHOD_RE = re.compile(r'^\s*(?:(?:async|static|get|set)\s+)*\*?\s*(?!(?:if|for|while|switch|catch|with|function)\b)[\w$]+\s*\(')
+# coffee's `foo: ->` and object keys `foo: bar`
+KEY_WITHOUT_PARENS_RE = re.compile(r'(%s+)\s*:\s*[^\(\)]*$' % IDENTIFIER_CHAR)
+
+INDENT_RE = re.compile(r'^(\s*)[^\s]')
+
+# Characters stripped off params, identifiers and function names
+PARAM_STRIP = ' \t;'
+PARAM_STRIP_OPTIONAL = ' \t;?'
+IDENTIFIER_STRIP = ' \t;+<>-'
+FUNCTION_NAME_STRIP = '-=>:()[]{} \t'
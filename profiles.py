@@ -0,0 +1,451 @@
+"""
+Declarative language profiles.
+
+Everything the parser needs to know about a language lives in PROFILE_SPECS. A spec
+can extend another one and only list what's different. Specs are compiled once into
+Profile objects holding precomputed regexes and lookup tables (see get_profile).
+"""
+
+import functools, re
+
+def _word(word):
+    "Param delimiter for a word operator like `and` (only when surrounded by whitespace)"
+    return {'re': r'(?<=\s)%s(?=\s)' % word, 'len': len(word)}
+
+# Operators that separate params in all C-like languages. Order matters for delimiters
+# found at the same position.
+_SYMBOL_DELIMITERS = [
+    {'str': ','},
+    {'str': '+'},
+    {'str': '-'},
+    {'str': '*'},
+    {'str': '/'},
+    {'str': '&&'},
+    {'str': '||'},
+    {'str': '<'},
+    {'str': '<='},
+    {'str': '>='},
+    {'str': '?='},
+    {'re': r'===', 'len': 3},
+    {'re': r'!==', 'len': 3},
+    {'re': r'==', 'len': 2},
+    {'re': r'(?<!=)>', 'len': 1},
+]
+_SYMBOL_INDICATORS = [',', '+', '-', '/', '*', '&', '|', '%']
+
+# Resolution order: the first spec with a matching scope wins
+PROFILE_SPECS = [
+    {
+        'name': 'javascript',
+        'scopes': ['source.js', 'source.jsx'],
+        'extensions': ['.js', '.jsx', '.mjs', '.cjs'],
+        'flowtype': True,
+        'comments': ['//'],
+        'block_suffix': '',
+        'param_delimiters': _SYMBOL_DELIMITERS + [_word('in'), _word('of')],
+        'param_strip': ',+-*/&|><=',
+        'interesting_indicators': _SYMBOL_INDICATORS + [{'re': r'(?<=\s)in(?=\s)'}, {'re': r'(?<=\s)of(?=\s)'}],
+        'trailing_keywords': [],
+        'calls_without_parens': False,
+        'non_call_keywords': [],
+        # Parsed like a call without parens even though calls need them: `throw err` => 'throw', err
+        # (not `new`, `Foo(a)` can't be logged without it)
+        'operator_keywords': ['await', 'case', 'delete', 'in', 'instanceof', 'throw', 'typeof', 'void', 'yield'],
+        'ternary': True,
+        'for_in': False,
+        'import_from': True,
+        'declaration_keywords': ['var', 'let', 'const'],
+        'constants': ['true', 'false', 'null', 'undefined'],
+        'log_template': 'console.{level}({args}){semicolon}',
+        'log_types': ['log', 'info', 'warn', 'error'],
+        'log_variants': [
+            {'name': 'sampled', 'setting': 'sample_every', 'wrapper':
+                '(globalThis.{counter} = (globalThis.{counter} || 0) + 1) % {n} === 0 && '},
+            {'name': 'rate limited', 'setting': 'rate_limit', 'wrapper':
+                '(c => (Date.now() - c.t >= 1000 && (c.t = Date.now(), c.n = 0), c.n++ < {n}))'
+                '(globalThis.{counter} = globalThis.{counter} || {t: 0, n: 0}) && '},
+        ],
+        # kind, start and end of paired timing probes. Probe labels start with PROBE_LABEL_PREFIX.
+        'timing_probes': [
+            ['console', 'console.time({label}){semicolon}', 'console.timeEnd({label}){semicolon}'],
+            ['performance', 'performance.mark({label}){semicolon}', 'performance.measure({label}, {label}){semicolon}'],
+        ],
+        # Opening, middle and closing lines of the try/finally a function's body is wrapped in for a timing probe
+        'probe_try_finally': ['try {', '} finally {', '}'],
+        'indent_endings': ['{', '=', ':', '=>'],
+    },
+    {
+        'name': 'typescript',
+        'extends': 'javascript',
+        'scopes': ['source.ts', 'source.tsx'],
+        'extensions': ['.ts', '.tsx'],
+        'log_variants': [
+            {'name': 'sampled', 'setting': 'sample_every', 'wrapper':
+                '((globalThis as any).{counter} = ((globalThis as any).{counter} || 0) + 1) % {n} === 0 && '},
+            {'name': 'rate limited', 'setting': 'rate_limit', 'wrapper':
+                '((c: any) => (Date.now() - c.t >= 1000 && (c.t = Date.now(), c.n = 0), c.n++ < {n}))'
+                '((globalThis as any).{counter} = (globalThis as any).{counter} || {t: 0, n: 0}) && '},
+        ],
+    },
+    {
+        'name': 'coffeescript',
+        'extends': 'javascript',
+        'scopes': ['source.coffee'],
+        'extensions': ['.coffee'],
+        'flowtype': False,
+        'comments': ['#'],
+        'param_delimiters': _SYMBOL_DELIMITERS + [_word('and'), _word('or'), _word('is'), _word('isnt'), _word('in')],
+        'interesting_indicators': _SYMBOL_INDICATORS + [
+            {'re': r'(?<=\s)in(?=\s)'},
+            {'re': r'(?<=\s)and(?=\s)'},
+            {'re': r'(?<=\s)or(?=\s)'},
+            {'re': r'(?<=\s)is(?=\s)'},
+            {'re': r'(?<=\s)isnt(?=\s)'}
+        ],
+        'trailing_keywords': ['if', 'unless', 'for'],
+        'calls_without_parens': True,
+        'non_call_keywords': ['export', 'default', 'return', 'new', 'import', 'function', 'var', 'let', 'const'],
+        'ternary': False, # `a ? b` is the existential operator
+        'probe_try_finally': [], # Function bodies are indented, not in braces
+        'for_in': True,
+        'constants': ['true', 'false', 'null', 'undefined', 'yes', 'no', 'on', 'off'],
+        'log_variants': [
+            {'name': 'sampled', 'setting': 'sample_every', 'wrapper':
+                '(globalThis.{counter} = (globalThis.{counter} or 0) + 1) % {n} is 0 and '},
+        ],
+        'indent_endings': ['{', '=', ':', '->', '=>'],
+    },
+    {
+        'name': 'python',
+        'scopes': ['source.python'],
+        'extensions': ['.py'],
+        'flowtype': True, # Type hints `a: int` look just like flowtype
+        'comments': ['#'],
+        'block_suffix': ':',
+        'param_delimiters': _SYMBOL_DELIMITERS + [_word('and'), _word('or'), _word('is'), _word('not'), _word('in')],
+        'param_strip': ',+-*/&|><=',
+        'interesting_indicators': _SYMBOL_INDICATORS + [
+            {'re': r'(?<=\s)in(?=\s)'},
+            {'re': r'(?<=\s)and(?=\s)'},
+            {'re': r'(?<=\s)or(?=\s)'},
+            {'re': r'(?<=\s)is(?=\s)'},
+            {'re': r'(?<=\s)not(?=\s)'}
+        ],
+        'trailing_keywords': ['if', 'for'],
+        'calls_without_parens': True, # `if a and b:`, `while x:`
+        'non_call_keywords': ['def', 'class', 'lambda', 'return', 'import', 'from', 'async', 'not'],
+        'operator_keywords': [],
+        'ternary': False,
+        'for_in': True,
+        'import_from': False,
+        'declaration_keywords': [],
+        'constants': ['True', 'False', 'None'],
+        'log_template': 'print({args})',
+        'log_types': [],
+        'log_variants': [],
+        'timing_probes': [],
+        'probe_try_finally': [],
+        'indent_endings': [':'],
+    },
+]
+
+# Follows the comment token on log statements commented out by the toggle command
+LOG_COMMENT_MARKER = 'logmagic: '
+
+# Counters of sampled and rate limited log statements are named COUNTER_PREFIX + a number
+COUNTER_PREFIX = '__logmagic_'
+COUNTER_RE = re.compile(re.escape(COUNTER_PREFIX) + r'(\d+)')
+# Labels of timing probes start with this so probes can be told apart from the code's own timers
+PROBE_LABEL_PREFIX = 'logmagic:'
+
+PLACEHOLDERS = ('level', 'label', 'pairs', 'location', 'args', 'semicolon')
+_PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+_WRAPPER_PLACEHOLDER_RE = re.compile(r'\{(counter|n)\}')
+# Indentation before log statements, the same for the str and the bytes patterns (see check.py) so
+# files are scanned the same no matter how big they are
+INDENT_PATTERN = r'[ \t\f\v]*'
+
+def wrapper_pattern(wrapper):
+    """
+    Return a regex matching a log variant's wrapper with any counter name and number filled in.
+
+    >>> re.match(wrapper_pattern('{counter}++ % {n} && '), '__logmagic_3++ % 10 && console.log(a)').group()
+    '__logmagic_3++ % 10 && '
+    """
+    pieces = []
+    position = 0
+    for match in _WRAPPER_PLACEHOLDER_RE.finditer(wrapper):
+        pieces.append(re.escape(wrapper[position : match.start()]))
+        pieces.append(match.group(1) == 'counter' and re.escape(COUNTER_PREFIX) + r'\d+' or r'\d+')
+        position = match.end()
+    pieces.append(re.escape(wrapper[position : ]))
+    return ''.join(pieces)
+
+class LogTemplate(object):
+    """
+    A log statement template compiled into a formatter and the patterns recognizing its output.
+    Placeholders: {level} (default_log_level), {label} (what is logged, eg `'foo'`), {pairs}
+    (`'name:', value` pairs), {location} (`'file.js:12'`), {args} (all of these the way LogMagic
+    combines them by default) and {semicolon}. A `, ` next to a placeholder that comes out empty is
+    dropped. Templates have to start with text, which is how log statements are recognized.
+    guard optionally wraps the statement so its arguments are only evaluated when logging is
+    enabled, e.g. `DEBUG && {statement}`. Log statements are recognized with or without the guard,
+    and with or without any of the wrappers of the sampled and rate limited variants. probes are
+    the prefixes of timing probes (up to their label), which are recognized as log statements too.
+
+    >>> template = LogTemplate("logger.{level}({label}, {pairs}){semicolon}")
+    >>> template.format({'level': 'info', 'label': "'foo'", 'pairs': '', 'semicolon': ';'})
+    "logger.info('foo');"
+    >>> template.is_log_statement('  logger.warn(a)'), template.level_re.match('logger.warn(a)').group(1)
+    (True, 'warn')
+    >>> LogTemplate("debug({location}, {pairs})").level_re
+
+    >>> guarded = LogTemplate("console.{level}({args})", "DEBUG && {statement}")
+    >>> guarded.format({'level': 'log', 'args': 'a'})
+    'DEBUG && console.log(a)'
+    >>> guarded.is_log_statement('DEBUG && console.log(a)'), guarded.is_log_statement('console.log(a)')
+    (True, True)
+    >>> guarded.level_re.match('  DEBUG && console.warn(a)').group(1)
+    'warn'
+
+    >>> LogTemplate("console.{level}({args})", '', ('{counter}++ % {n} && ',)).is_log_statement('__logmagic_1++ % 5 && console.log(a)')
+    True
+
+    >>> text = 'a\\n\\f\\tlogger.info(a)\\n'
+    >>> [m.start() for m in template.statement_re.finditer(text)], [m.start() for m in template.statement_bytes_re.finditer(text.encode())]
+    ([2], [2])
+
+    >>> probed = LogTemplate("log({args})", '', (), ("timer('logmagic:",))
+    >>> probed.is_log_statement("  timer('logmagic:foo')"), probed.is_probe("  timer('logmagic:foo')"), probed.is_probe('log(a)')
+    (True, True, False)
+    """
+
+    def __init__(self, template, guard = '', wrappers = (), probes = ()):
+        self.template = template
+        self.segments = [] # (text, placeholder following it or None)
+        position = 0
+        for match in _PLACEHOLDER_RE.finditer(template):
+            if match.group(1) not in PLACEHOLDERS:
+                raise ValueError('Unknown placeholder {%s} in log template %r' % (match.group(1), template))
+            self.segments.append((template[position : match.start()], match.group(1)))
+            position = match.end()
+        self.segments.append((template[position : ], None))
+        self.prefix = self.segments[0][0].lstrip()
+        if not self.prefix: raise ValueError('Log template %r has to start with text' % template)
+
+        self.guard = guard
+        if guard and guard.count('{statement}') != 1:
+            raise ValueError('Log guard %r has to contain {statement} once' % guard)
+        self.guard_prefix, self.guard_suffix = guard and guard.split('{statement}') or ('', '')
+        self.guard_prefix = self.guard_prefix.lstrip()
+
+        self.wrappers = wrappers
+        self.wrapper_re = wrappers and re.compile('|'.join(wrapper_pattern(w) for w in wrappers)) or None
+
+        # The prefix, optionally preceded by a variant's wrapper and the guard
+        self.prefix_pattern = re.escape(self.prefix)
+        if self.guard_prefix: self.prefix_pattern = '(?:' + re.escape(self.guard_prefix) + ')?' + self.prefix_pattern
+        if self.wrapper_re: self.prefix_pattern = '(?:' + self.wrapper_re.pattern + ')?' + self.prefix_pattern
+        # Log statements or timing probes
+        self.probes = probes
+        self.probe_re = probes and re.compile('|'.join(re.escape(probe) for probe in probes)) or None
+        self.statement_prefix_pattern = self.prefix_pattern
+        if self.probe_re: self.statement_prefix_pattern = '(?:' + self.prefix_pattern + '|' + self.probe_re.pattern + ')'
+
+        # Cycling replaces whatever follows the prefix if that's the level
+        self.level_re = self.segments[0][1] == 'level' and re.compile(r'^\s*' + self.prefix_pattern + r'(\w+)') or None
+        self.statement_pattern = r'^\s*' + self.statement_prefix_pattern # For view.find()
+        self.statement_re = re.compile('^' + INDENT_PATTERN + self.statement_prefix_pattern, re.M)
+        self.statement_bytes_re = re.compile(('^' + INDENT_PATTERN + self.statement_prefix_pattern).encode('utf-8'), re.M)
+
+    def format(self, values):
+        "Fill in the placeholders from the values dict"
+        pieces = []
+        for (text, placeholder) in self.segments:
+            pieces.append(text)
+            if placeholder: pieces.append(values.get(placeholder, ''))
+        for i in range(1, len(pieces), 2):
+            if pieces[i]: continue
+            if pieces[i - 1].endswith(', '): pieces[i - 1] = pieces[i - 1][ : -2]
+            elif pieces[i + 1].startswith(', '): pieces[i + 1] = pieces[i + 1][2 : ]
+        return self.guard_prefix + ''.join(pieces) + self.guard_suffix
+
+    def is_log_statement(self, line):
+        line = line.lstrip()
+        if self.probe_re and self.probe_re.match(line): return True
+        wrapper = self.wrapper_re and self.wrapper_re.match(line)
+        if wrapper: line = line[wrapper.end() : ]
+        if self.guard_prefix and line.startswith(self.guard_prefix): line = line[len(self.guard_prefix) : ]
+        return line.startswith(self.prefix)
+
+    def is_probe(self, line):
+        return bool(self.probe_re and self.probe_re.match(line.lstrip()))
+
+@functools.lru_cache(maxsize = 64)
+def compile_template(template, guard = '', wrappers = (), probes = ()):
+    "Return the LogTemplate for a template string, guard, wrappers and probes. Each one is only compiled once."
+    return LogTemplate(template, guard, wrappers, probes)
+
+class Profile(object):
+    "A compiled language profile"
+
+    def __init__(self, spec, template = None, guard = ''):
+        self.spec = spec
+        self.name = spec['name']
+        self.lineage = tuple(spec['lineage'])
+        self.scopes = tuple(spec['scopes'])
+        self.extensions = tuple(spec['extensions'])
+        self.flowtype = spec['flowtype']
+        self.comments = tuple(spec['comments'])
+        self.block_suffix = spec['block_suffix']
+        self.param_delimiters = [
+            d.get('re') and {'re': re.compile(d['re']), 'len': d['len']} or {'str': d['str'], 'len': len(d['str'])}
+            for d in spec['param_delimiters']
+        ]
+        self.param_delimiters_strip = spec['param_strip'] + ' \t'
+        self.interesting_indicators = [
+            isinstance(i, dict) and {'re': re.compile(i['re'])} or i
+            for i in spec['interesting_indicators']
+        ]
+        self.trailing_keywords = [{'re': re.compile(r'\s%s\s' % k)} for k in spec['trailing_keywords']]
+        self.calls_without_parens = spec['calls_without_parens']
+        self.non_call_keywords = frozenset(spec['non_call_keywords'])
+        self.operator_keywords = frozenset(spec['operator_keywords'])
+        self.ternary = spec['ternary']
+        self.for_in_re = spec['for_in'] and re.compile(r'^(\s*for\s+.+)\s+in\s*.+$') or None
+        self.import_from_re = spec['import_from'] and re.compile(r'^(\s*import\s+.+)\s+from') or None
+        self.declaration_prefixes = tuple(k + ' ' for k in spec['declaration_keywords'])
+        self.constants = frozenset(spec['constants'])
+        self.indent_endings = tuple(spec['indent_endings'])
+
+        # Sampled and rate limited variants of log statements: wrappers with a counter name and a number
+        self.log_variants = [
+            dict(variant, re = re.compile(r'^([ \t]*)(' + wrapper_pattern(variant['wrapper']) + ')'))
+            for variant in spec['log_variants']
+        ]
+        # kind => (start, end) templates of timing probes, in the spec's order
+        self.probe_kinds = [kind for (kind, start, end) in spec['timing_probes']]
+        self.probe_try_finally = tuple(spec['probe_try_finally'])
+        self.timing_probes = dict(
+            (kind, (compile_template(start), compile_template(end))) for (kind, start, end) in spec['timing_probes'])
+        probes = tuple(
+            probe.prefix + "'" + PROBE_LABEL_PREFIX
+            for kind in self.probe_kinds for probe in self.timing_probes[kind])
+
+        # Everything else about what log statements look like comes from the template
+        self.template = compile_template(
+            template or spec['log_template'], guard, tuple(variant['wrapper'] for variant in spec['log_variants']), probes)
+        self.log_prefix = self.template.prefix
+        self.log_types = self.template.level_re and list(spec['log_types']) or []
+        self.log_type_re = self.log_types and self.template.level_re or None
+        self.log_statement_pattern = self.template.statement_pattern
+        self.log_statement_re = self.template.statement_re
+        self.log_statement_bytes_re = self.template.statement_bytes_re
+        # Commented out log statements: `// logmagic: console.log(a)`. Group 1 is the marker.
+        self.log_comment = self.comments[0] + ' ' + LOG_COMMENT_MARKER
+        self.commented_log_re = re.compile('^' + INDENT_PATTERN + '(' + re.escape(self.log_comment) + r')' + self.template.statement_prefix_pattern, re.M)
+
+    def with_template(self, template, guard = ''):
+        "Return this profile with another log template and guard"
+        if template == self.template.template and guard == self.template.guard: return self
+        return _with_template(self.name, template, guard)
+
+    def is_log_statement(self, line):
+        return self.template.is_log_statement(line)
+
+    def is_probe(self, line):
+        return self.template.is_probe(line)
+
+    def __repr__(self):
+        return 'Profile(%r)' % self.name
+
+def _resolve_spec(name):
+    "Return the full spec for name with all `extends` applied"
+    spec = [s for s in PROFILE_SPECS if s['name'] == name]
+    if not spec: raise KeyError('Unknown LogMagic profile %s' % name)
+    spec = spec[0]
+    if 'extends' not in spec: return dict(spec, lineage = [name])
+    resolved = _resolve_spec(spec['extends'])
+    resolved.update(spec)
+    resolved['lineage'] = [name] + resolved['lineage']
+    return resolved
+
+# Every profile is compiled once at import. The compiled profiles are never modified so they
+# can be shared between threads.
+_compiled = dict((spec['name'], Profile(_resolve_spec(spec['name']))) for spec in PROFILE_SPECS)
+
+@functools.lru_cache(maxsize = 64)
+def _with_template(name, template, guard):
+    "Profiles with custom templates are derived once and cached like the templates themselves"
+    return Profile(get_profile(name).spec, template, guard)
+
+def get_profile(name):
+    """
+    Return the compiled profile called name.
+
+    >>> get_profile('typescript').flowtype
+    True
+    >>> get_profile('coffeescript') is get_profile('coffeescript')
+    True
+    """
+    profile = _compiled.get(name)
+    if profile is None: raise KeyError('Unknown LogMagic profile %s' % name)
+    return profile
+
+def resolve_profile(scope_name):
+    """
+    Return the profile for a Sublime scope name, or None if there is none.
+
+    >>> resolve_profile('source.coffee meta.function')
+    Profile('coffeescript')
+    >>> resolve_profile('text.plain')
+    >>> resolve_profile('source.json')
+    """
+    names = scope_name.split()
+    for spec in PROFILE_SPECS:
+        for scope in spec['scopes']:
+            if [True for name in names if name == scope or name.startswith(scope + '.')]:
+                return get_profile(spec['name'])
+    return None
+
+def profile_for_path(path):
+    """
+    Return the profile for a file name based on its extension, defaulting to javascript.
+
+    >>> profile_for_path('src/app.py')
+    Profile('python')
+    >>> profile_for_path('README')
+    Profile('javascript')
+    """
+    for spec in PROFILE_SPECS:
+        profile = get_profile(spec['name'])
+        if path.endswith(profile.extensions): return profile
+    return get_profile('javascript')
+
+def default_profile(flowtype_enabled = True):
+    "Profile used when none is given: javascript, or coffeescript if flowtype is disabled"
+    return get_profile(flowtype_enabled and 'javascript' or 'coffeescript')
+
+def _setting_for(profile, value):
+    "Return the value of a per language setting (one value or an object keyed by profile names) for profile"
+    if isinstance(value, dict):
+        value = ([value[name] for name in profile.lineage if value.get(name)] or [None])[0]
+    return value or None
+
+def for_settings(profile, settings):
+    """
+    Return profile with the log_template and log_guard settings applied. Either setting is one
+    value for all languages or an object mapping profile names to values (typescript falls back
+    to javascript and so on). Empty means the profile's own template and no guard.
+
+    >>> for_settings(get_profile('typescript'), {'log_template': {'javascript': 'log.{level}({args})'}}).log_prefix
+    'log.'
+    >>> for_settings(get_profile('python'), {'log_template': {'javascript': 'log.{level}({args})'}}).log_prefix
+    'print('
+    >>> for_settings(get_profile('python'), {'log_guard': {'python': '__debug__ and {statement}'}}).template.format({'args': 'a'})
+    '__debug__ and print(a)'
+    """
+    template = settings and _setting_for(profile, settings.get('log_template'))
+    guard = settings and _setting_for(profile, settings.get('log_guard'))
+    if not template and not guard: return profile
+    return profile.with_template(template or profile.spec['log_template'], guard or '')
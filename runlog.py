@@ -0,0 +1,306 @@
+"""
+Map runtime output (e.g. a dev server's console log) back to the log statements that printed it.
+
+    python -m LogMagic.runlog [--settings FILE] [--follow] [--interval SECONDS] LOGFILE [SOURCE...]
+
+Prints `path:lineno: output` for every output line that maps to a log statement below the SOURCE
+files and directories (default `.`). Log statements are recognized like check.py does, with --settings
+honoring the log_template and log_guard of a LogMagic.sublime-settings file. With --follow the log file is polled and new output printed
+until interrupted. Only what was appended since the last poll is read, so this stays cheap no matter
+how big the log file gets.
+"""
+
+import array, mmap, os, re, sys, time
+from . import check
+from . import profiles
+from . import utils
+
+FOLLOW_INTERVAL = 0.5
+# Stripped off output words before they are looked at, e.g. `[ 'foo:', 1 ]` as printed by node
+WORD_STRIP = '\'"`()[]{},;'
+SOURCE_EXTENSIONS = tuple(sorted(set(ext for spec in profiles.PROFILE_SPECS for ext in spec['extensions'])))
+# Where a key can end in raw output (a superset of what output_keys accepts), so lines without one
+# are skipped without decoding them
+KEY_END_BYTES_RE = re.compile((r'\S:(?:[\s%s]|$)|(?:%s):\d' % (
+    re.escape(WORD_STRIP), '|'.join(re.escape(ext) for ext in SOURCE_EXTENSIONS))).encode('ascii'), re.M)
+
+def parse_location(word):
+    """
+    Return (filename, lineno) if word is a `file:lineno` location as logged by LogMagic, else None.
+
+    >>> parse_location('src/a.js:12'), parse_location('12:00:01'), parse_location('localhost:3000')
+    (('src/a.js', 12), None, None)
+    """
+    filename, colon, lineno = word.rpartition(':')
+    if not colon or not lineno.isdigit() or not filename.endswith(SOURCE_EXTENSIONS): return None
+    return filename, int(lineno)
+
+def output_keys(line):
+    """
+    Return the keys an output line can be looked up by, in order: `file:lineno` locations and
+    labels (words ending with a colon, without the colon). Timing probes print `logmagic:label:`.
+
+    >>> output_keys("[web] 10:02:03 a.js:12 foo: 3 a: { x: 1 } logmagic:render: 1.2ms")
+    ['a.js:12', 'foo', 'a', 'x', 'logmagic:render']
+    """
+    keys = []
+    for word in line.split():
+        word = word.strip(WORD_STRIP)
+        if parse_location(word): key = word
+        elif len(word) > 1 and word.endswith(':'): key = word[:-1]
+        else: continue
+        if key not in keys: keys.append(key)
+    return keys
+
+def statement_keys(statement, profile = None):
+    """
+    Return the keys the output of a log statement can be found by (see output_keys):
+    its `file:lineno` location (if it logs one) and its label. With a profile, strings in a
+    guard or wrapper in front of the log statement are skipped.
+
+    >>> statement_keys("console.log('a.js:12', 'foo:', foo, 'a:', a)")
+    ['a.js:12', 'foo']
+    >>> statement_keys("console.log 'fn', 'a:', a")
+    ['fn']
+    >>> statement_keys("console.timeEnd('logmagic:render');")
+    ['logmagic:render']
+    >>> statement_keys("if (env === 'dev') console.log('foo:', foo)", profiles.get_profile('javascript'))
+    ['foo']
+    """
+    keys = []
+    if profile:
+        statement = statement[max(statement.find(profile.log_prefix), 0) : ]
+    for (start, end) in utils.find_strings(statement):
+        literal = statement[start + 1 : end].replace("\\'", "'")
+        if not keys and parse_location(literal):
+            keys.append(literal)
+            continue
+        keys.append(literal.endswith(':') and literal[:-1] or literal)
+        break
+    return keys
+
+class LogFile(object):
+    """
+    Incremental index of a growing log file. update() only reads what was appended since the last
+    update, memory-mapping appends of mmap_threshold bytes and more, and only decodes lines that can
+    contain keys (see output_keys). A trailing line without a newline is left for the next update.
+
+    Lines with keys are kept as entries: their offset and line number, so they can be read again
+    without rereading the file, and the entries are indexed by key. A log file that shrank or was
+    replaced (log rotation) is indexed again from the start.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'dev.log')
+    >>> with open(path, 'wb') as f: n = f.write(b'ready\\nfoo: 1\\nbar: 2\\r\\nfoo: ')
+    >>> log = LogFile(path)
+    >>> log.update(), log.lines('foo'), log.count
+    (2, [(2, 'foo: 1')], 3)
+    >>> with open(path, 'ab') as f: n = f.write(b'3\\n')
+    >>> log.update(), log.lines('foo')
+    (1, [(2, 'foo: 1'), (4, 'foo: 3')])
+    >>> log.update()
+    0
+    >>> with open(path, 'wb') as f: n = f.write(b'bar: 4\\n')
+    >>> log.mmap_threshold = 0
+    >>> log.update(), log.lines('bar'), log.lines('foo')
+    (1, [(1, 'bar: 4')], [])
+    """
+
+    def __init__(self, path, mmap_threshold = check.MMAP_THRESHOLD):
+        self.path = path
+        self.mmap_threshold = mmap_threshold
+        self.reset()
+
+    def reset(self):
+        self.identity = None # (device, inode) of the indexed file
+        self.offset = 0 # Where the next update starts reading
+        self.count = 0 # Complete lines read so far
+        self.starts = array.array('Q') # entry => offset of the line
+        self.linenos = array.array('Q') # entry => 1-based line number
+        self.keys = {} # key => array of entries
+
+    def update(self, on_line = None):
+        """
+        Index the lines appended since the last update. on_line(lineno, line) is called for every new line
+        with keys. Returns the number of new entries.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return 0
+        identity = (stat.st_dev, stat.st_ino)
+        if identity != self.identity or stat.st_size < self.offset:
+            self.reset()
+            self.identity = identity
+        if stat.st_size == self.offset: return 0
+        with open(self.path, 'rb') as f:
+            if stat.st_size - self.offset >= max(self.mmap_threshold, 1):
+                with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapping:
+                    return self.index_lines(mapping, self.offset, stat.st_size, 0, on_line)
+            f.seek(self.offset)
+            data = f.read(stat.st_size - self.offset)
+        return self.index_lines(data, 0, len(data), self.offset, on_line)
+
+    def index_lines(self, buffer, start, end, base, on_line = None):
+        "Index the complete lines in buffer[start:end], buffer starting at file offset base"
+        stop = buffer.rfind(b'\n', start, end) + 1
+        if stop <= start: return 0
+        entries = len(self.starts)
+        position = start
+        lineno = self.count + 1
+        while True:
+            found = KEY_END_BYTES_RE.search(buffer, position, stop)
+            if not found: break
+            colon = found.start()
+            line_start = buffer.rfind(b'\n', position, colon) + 1 or position
+            lineno += check.count_newlines(buffer, position, line_start)
+            line_end = buffer.find(b'\n', colon, stop)
+            line = buffer[line_start : line_end].decode('utf-8', 'replace').rstrip('\r')
+            keys = output_keys(line)
+            if keys:
+                entry = len(self.starts)
+                self.starts.append(base + line_start)
+                self.linenos.append(lineno)
+                for key in keys:
+                    self.keys.setdefault(key, array.array('Q')).append(entry)
+                if on_line: on_line(lineno, line)
+            lineno += 1
+            position = line_end + 1
+        self.count = lineno - 1 + check.count_newlines(buffer, position, stop)
+        self.offset = base + stop
+        return len(self.starts) - entries
+
+    def read_entries(self, entries):
+        "Return (lineno, line) for the given entries, read back from the file"
+        lines = []
+        with open(self.path, 'rb') as f:
+            for entry in entries:
+                f.seek(self.starts[entry])
+                lines.append((self.linenos[entry], f.readline().decode('utf-8', 'replace').rstrip('\r\n')))
+        return lines
+
+    def lines(self, key):
+        "Return (lineno, line) for all lines with key"
+        return self.read_entries(self.keys.get(key, ()))
+
+    def recent(self, count):
+        "Return (lineno, line) for the last count lines with keys, newest first"
+        return self.read_entries(range(len(self.starts) - 1, max(len(self.starts) - count, 0) - 1, -1))
+
+class SourceIndex(object):
+    """
+    Index of the log statements below a set of paths by the keys their output can be found by
+    (see statement_keys). update() only reads changed files (see check.Index).
+
+    >>> import os, tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> path = os.path.join(root, 'a.js')
+    >>> with open(path, 'w') as f: n = f.write("foo()\\nconsole.log('foo:', foo)\\nconsole.log('a.js:9', 'x')\\n")
+    >>> sources = SourceIndex([root])
+    >>> sources.update()
+    True
+    >>> sources.locate('[web] foo: 1') == [(path, 2)]
+    True
+    >>> sources.locate('a.js:9 x') == sources.locate('x') == [(path, 3)]
+    True
+    >>> sources.locate('a.js:1 bar: 2') == [(path, 1)]
+    True
+    >>> sources.locate('bar: 2')
+    []
+
+    settings (see check.profile_for) make guarded and custom template log statements count too:
+
+    >>> with open(path, 'w') as f: n = f.write("if (env === 'dev') log.info('bar:', bar)\\n")
+    >>> sources.update(), sources.locate('bar: 2')
+    (True, [])
+    >>> sources = SourceIndex([root], {'log_template': 'log.{level}({args})', 'log_guard': "if (env === 'dev') {statement}"})
+    >>> sources.update(), sources.locate('bar: 2') == [(path, 1)]
+    (True, True)
+    """
+
+    def __init__(self, paths, settings = None):
+        self.files = check.Index(paths, settings)
+        self.settings = settings
+        self.keys = {} # key => [(path, lineno)]
+        self.names = {} # file name => [path]
+
+    def update(self):
+        "Bring the index up to date. Returns whether any log statements changed"
+        changed = self.files.update()
+        if changed or len(self.files.files) != sum(len(paths) for paths in self.names.values()):
+            self.names = {}
+            for path in sorted(self.files.files):
+                self.names.setdefault(os.path.basename(path), []).append(path)
+        if not changed: return False
+        self.keys = {}
+        for path in sorted(self.files.files):
+            profile = check.profile_for(path, self.settings)
+            for (lineno, statement) in self.files.files[path][3]:
+                for key in statement_keys(statement, profile):
+                    self.keys.setdefault(key, []).append((path, lineno))
+        return True
+
+    def locate(self, line):
+        """
+        Return the (path, lineno) of the log statements that may have printed an output line, best guess first.
+        Keys are tried first, then bare words (labels logged without a value) and finally `file:lineno`
+        locations by file name, e.g. for log statements that changed since.
+        """
+        keys = output_keys(line)
+        for key in keys + [word.strip(WORD_STRIP) for word in line.split()]:
+            if key in self.keys: return self.keys[key]
+        for key in keys:
+            location = parse_location(key)
+            if location:
+                paths = self.names.get(os.path.basename(location[0]))
+                if paths: return [(path, location[1]) for path in paths]
+        return []
+
+def located_printer(sources, output):
+    "Return an on_line callback (see LogFile.update) printing the lines that map to a log statement"
+    def on_line(lineno, line):
+        for (path, statement_lineno) in sources.locate(line)[:1]:
+            output.write('%s:%d: %s\n' % (path, statement_lineno, line.strip()))
+    return on_line
+
+def follow(log, sources, interval = FOLLOW_INTERVAL, output = sys.stdout):
+    "Print the output lines appended to log every interval seconds until interrupted"
+    on_line = located_printer(sources, output)
+    try:
+        while True:
+            sources.update()
+            if log.update(on_line): output.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def main(argv):
+    following = False
+    interval = FOLLOW_INTERVAL
+    settings = None
+    paths = []
+    args = list(argv[1:])
+    while args:
+        arg = args.pop(0)
+        if arg == '--settings': settings = utils.read_settings(args.pop(0))
+        elif arg == '--follow': following = True
+        elif arg == '--interval': interval = float(args.pop(0))
+        else: paths.append(arg)
+    if not paths:
+        sys.stderr.write('usage: python -m LogMagic.runlog [--settings FILE] [--follow] [--interval SECONDS] LOGFILE [SOURCE...]\n')
+        return 2
+
+    log = LogFile(paths[0])
+    sources = SourceIndex(paths[1:] or ['.'], settings)
+    if following: return follow(log, sources, interval)
+
+    start = time.perf_counter()
+    sources.update()
+    entries = log.update(located_printer(sources, sys.stdout))
+    sys.stdout.write('LogMagic: %d of %d lines with labels (%.1fms)\n' % (
+        entries, log.count, (time.perf_counter() - start) * 1000))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,369 @@
+"""
+Long-lived stdio language server exposing LogMagic as code actions.
+
+Run it from the Packages directory with `python -m LogMagic.server` and point your
+editor's LSP client at it. `python -m LogMagic.server --measure somefile.js` starts a
+server, fires code action requests at it and prints the request latencies.
+"""
+
+import json, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from . import core
+from . import profiles
+from . import utils
+
+DEFAULT_WORKERS = 4
+# LSP language ids => LogMagic profiles. Anything else is treated as javascript.
+LANGUAGE_PROFILES = {
+    'javascript': 'javascript',
+    'javascriptreact': 'javascript',
+    'flow': 'javascript',
+    'typescript': 'typescript',
+    'typescriptreact': 'typescript',
+    'coffeescript': 'coffeescript',
+    'python': 'python'
+}
+
+ERROR_METHOD_NOT_FOUND = -32601
+ERROR_INTERNAL = -32603
+
+def utf16_len(line):
+    "Return the length of line in UTF-16 code units, which is what LSP positions count"
+    return len(line.encode('utf-16-le')) // 2
+
+def uri_to_filename(uri):
+    "Return the basename of a file:// uri"
+    return os.path.basename(uri.rstrip('/')) or 'untitled'
+
+def indent_statement(statement, line, direction, profile = None):
+    """
+    Indent statement like line. When logging downwards after a line that opens a block,
+    indent one level deeper.
+
+    >>> indent_statement('console.log(a)', '  if (a) {', 'down')
+    '    console.log(a)'
+
+    >>> indent_statement('console.log(a)', '\\tif (a) {', 'up')
+    '\\tconsole.log(a)'
+    """
+    if profile is None: profile = profiles.default_profile()
+    indent_str = line[:len(line) - len(line.lstrip())]
+    if direction == 'down' and line.strip().endswith(profile.indent_endings):
+        indent_str += len(indent_str) and indent_str[0] == '\t' and '\t' or '  '
+    return indent_str + statement
+
+class Document(object):
+    "An open text document split into lines"
+
+    def __init__(self, uri, language_id, text, version = None, settings = None):
+        self.uri = uri
+        self.language_id = language_id
+        self.filename = uri_to_filename(uri)
+        profile = profiles.get_profile(LANGUAGE_PROFILES.get(language_id, 'javascript'))
+        self.profile = profiles.for_settings(profile, settings)
+        self.version = version
+        self.text = text
+        self.lines = text.split('\n')
+
+class LogMagicServer(object):
+    """
+    JSON-RPC 2.0 server speaking the LSP base protocol over a pair of binary streams.
+    Notifications are applied in order on the reader thread, requests are answered
+    concurrently from a thread pool against the document snapshot they were sent for.
+    """
+
+    def __init__(self, input, output, workers = DEFAULT_WORKERS):
+        self.input = input
+        self.output = output
+        self.documents = {}
+        self.settings = utils.load_settings()
+        self.running = True
+        self.write_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.handlers = {
+            'initialize': self.on_initialize,
+            'shutdown': self.on_shutdown,
+            'exit': self.on_exit,
+            'textDocument/didOpen': self.on_did_open,
+            'textDocument/didChange': self.on_did_change,
+            'textDocument/didClose': self.on_did_close,
+            'textDocument/codeAction': self.on_code_action,
+        }
+
+    # Transport
+
+    def read_message(self):
+        "Read one Content-Length framed message. Returns None on EOF."
+        length = None
+        while True:
+            header = self.input.readline()
+            if not header: return None
+            header = header.decode('ascii').strip()
+            if not header: break
+            name, _, value = header.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        if length is None: return None
+        return json.loads(self.input.read(length).decode('utf-8'))
+
+    def write_message(self, message):
+        body = json.dumps(message).encode('utf-8')
+        with self.write_lock:
+            self.output.write(('Content-Length: %d\r\n\r\n' % len(body)).encode('ascii'))
+            self.output.write(body)
+            self.output.flush()
+
+    def respond(self, id, result = None, error = None):
+        message = {'jsonrpc': '2.0', 'id': id}
+        if error: message['error'] = error
+        else: message['result'] = result
+        self.write_message(message)
+
+    def serve(self):
+        "Process messages until exit or EOF"
+        try:
+            while self.running:
+                message = self.read_message()
+                if message is None: break
+                self.dispatch(message)
+        finally:
+            self.executor.shutdown(wait = True)
+
+    def dispatch(self, message):
+        method = message.get('method')
+        handler = self.handlers.get(method)
+        if 'id' not in message: # Notification: apply in order
+            if handler: handler(message.get('params') or {})
+            return
+        if not handler:
+            return self.respond(message['id'], error = {'code': ERROR_METHOD_NOT_FOUND, 'message': 'Unknown method %s' % method})
+        # Bind the document snapshot now so later notifications can't race the request
+        params = message.get('params') or {}
+        document = self.documents.get(params.get('textDocument', {}).get('uri'))
+        self.executor.submit(self.run_request, handler, message['id'], params, document)
+
+    def run_request(self, handler, id, params, document):
+        try:
+            self.respond(id, handler(params, document))
+        except Exception as e:
+            self.respond(id, error = {'code': ERROR_INTERNAL, 'message': str(e)})
+
+    # Lifecycle
+
+    def on_initialize(self, params, document):
+        self.settings.update(params.get('initializationOptions') or {})
+        return {
+            'capabilities': {
+                'textDocumentSync': 1, # Full
+                'codeActionProvider': True
+            },
+            'serverInfo': {'name': 'LogMagic'}
+        }
+
+    def on_shutdown(self, params, document):
+        return None
+
+    def on_exit(self, params):
+        self.running = False
+
+    # Document sync
+
+    def on_did_open(self, params):
+        doc = params['textDocument']
+        self.documents[doc['uri']] = Document(doc['uri'], doc.get('languageId'), doc['text'], doc.get('version'), self.settings)
+
+    def on_did_change(self, params):
+        doc = params['textDocument']
+        current = self.documents.get(doc['uri'])
+        if not current or not params.get('contentChanges'): return
+        text = params['contentChanges'][-1]['text']
+        self.documents[doc['uri']] = Document(doc['uri'], current.language_id, text, doc.get('version'), self.settings)
+
+    def on_did_close(self, params):
+        self.documents.pop(params['textDocument']['uri'], None)
+
+    # Code actions
+
+    def log_statement(self, document, line, lineno, take_inner):
+        return core.create_log_statement_cached(line, document.filename, lineno, take_inner, document.profile, self.settings)
+
+    def insert_action(self, document, row, direction):
+        line = document.lines[row]
+        lineno = row + (direction == 'down' and 2 or 1)
+        statement = indent_statement(self.log_statement(document, line, lineno, direction == 'down'), line, direction, document.profile)
+        if direction == 'up':
+            edit = self.text_edit(row, 0, row, 0, statement + '\n')
+        elif row + 1 < len(document.lines):
+            edit = self.text_edit(row + 1, 0, row + 1, 0, statement + '\n')
+        else:
+            end = utf16_len(line)
+            edit = self.text_edit(row, end, row, end, '\n' + statement)
+        title = direction == 'down' and 'LogMagic: Log statement (down)' or 'LogMagic: Log statement (up)'
+        return self.code_action(document, title, [edit])
+
+    def cycle_action(self, document, row, direction):
+        line = document.lines[row]
+        new_line = core.cycle_log_type(line, direction, document.profile)
+        if new_line is None: return None
+        edit = self.text_edit(row, 0, row, utf16_len(line), new_line)
+        return self.code_action(document, 'LogMagic: Cycle log type', [edit])
+
+    def cycle_variant_action(self, document, row):
+        line = document.lines[row]
+        counter = next(utils.unused_counter_names(document.text))
+        new_line = core.cycle_log_variant(line, counter, self.settings, document.profile)
+        if new_line is None: return None
+        edit = self.text_edit(row, 0, row, utf16_len(line), new_line)
+        return self.code_action(document, 'LogMagic: Cycle sampled / rate limited', [edit])
+
+    def remove_all_action(self, document):
+        "Remove all log statements and the try/finally of timing probes (see utils.find_log_removals)"
+        text = document.text
+        regions, count = utils.find_log_removals(text, document.profile)
+        offsets = [offset for region in regions for offset in region]
+        positions = iter(zip(offsets, utils.line_positions(text, offsets)))
+        edits = []
+        for ((start, (start_row, start_line)), (end, (end_row, end_line))) in zip(positions, positions):
+            edits.append(self.text_edit(
+                start_row, utf16_len(text[start_line:start]), end_row, utf16_len(text[end_line:end]), ''))
+        if not edits: return None
+        return self.code_action(document, 'LogMagic: Remove all log statements (%d)' % count, edits)
+
+    def toggle_all_action(self, document):
+        "Comment out all log statements, or restore the commented out ones if there are none"
+        text = document.text
+        points = utils.find_log_comment_points(text, document.profile)
+        if points:
+            edits = []
+            for (point, (row, line_start)) in zip(points, utils.line_positions(text, points)):
+                character = utf16_len(text[line_start : point])
+                edits.append(self.text_edit(row, character, row, character, document.profile.log_comment))
+            return self.code_action(document, 'LogMagic: Comment out all log statements (%d)' % len(edits), edits)
+        edits = []
+        comments = utils.find_log_comments(text, document.profile)
+        rows = utils.line_positions(text, [start for (start, end) in comments])
+        for ((start, end), (row, line_start)) in zip(comments, rows):
+            character = utf16_len(text[line_start : start])
+            edits.append(self.text_edit(row, character, row, character + end - start, ''))
+        if not edits: return None
+        return self.code_action(document, 'LogMagic: Restore all log statements (%d)' % len(edits), edits)
+
+    def text_edit(self, start_line, start_char, end_line, end_char, new_text):
+        return {
+            'range': {
+                'start': {'line': start_line, 'character': start_char},
+                'end': {'line': end_line, 'character': end_char}
+            },
+            'newText': new_text
+        }
+
+    def code_action(self, document, title, edits):
+        return {
+            'title': title,
+            'kind': 'refactor',
+            'edit': {'changes': {document.uri: edits}}
+        }
+
+    def on_code_action(self, params, document):
+        """
+        Offer the actions for the line at the start of the range. Timing probes can't be cycled:
+
+        >>> import io
+        >>> server = LogMagicServer(io.BytesIO(), io.BytesIO(), 1)
+        >>> document = Document('file:///a.js', 'javascript', "console.time('logmagic:a')\\nconsole.log(a)\\n", 1, server.settings)
+        >>> [action['title'] for action in server.on_code_action({'range': {'start': {'line': 0}}}, document)]
+        ['LogMagic: Remove all log statements (2)', 'LogMagic: Comment out all log statements (2)']
+        """
+        if not document: return []
+        row = params['range']['start']['line']
+        if row >= len(document.lines): return []
+        actions = []
+        if utils.is_log_statement(document.lines[row], document.profile):
+            cycle = document.profile.log_types and self.cycle_action(document, row, 'down')
+            if cycle: actions.append(cycle)
+            cycle_variant = self.cycle_variant_action(document, row)
+            if cycle_variant: actions.append(cycle_variant)
+        else:
+            actions.append(self.insert_action(document, row, 'down'))
+            actions.append(self.insert_action(document, row, 'up'))
+        remove_all = self.remove_all_action(document)
+        if remove_all: actions.append(remove_all)
+        toggle_all = self.toggle_all_action(document)
+        if toggle_all: actions.append(toggle_all)
+        return actions
+
+class Client(object):
+    "Minimal LSP client that talks to a LogMagic server subprocess. Used for measuring latency."
+
+    def __init__(self, command = None):
+        import subprocess
+        command = command or [sys.executable, '-m', __package__ + '.server']
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(command, stdin = subprocess.PIPE, stdout = subprocess.PIPE, cwd = cwd)
+        self.next_id = 0
+
+    def send(self, method, params, notification = False):
+        message = {'jsonrpc': '2.0', 'method': method, 'params': params}
+        if not notification:
+            self.next_id += 1
+            message['id'] = self.next_id
+        body = json.dumps(message).encode('utf-8')
+        self.process.stdin.write(('Content-Length: %d\r\n\r\n' % len(body)).encode('ascii') + body)
+        self.process.stdin.flush()
+        return message.get('id')
+
+    def receive(self):
+        length = None
+        while True:
+            header = self.process.stdout.readline().decode('ascii').strip()
+            if not header: break
+            name, _, value = header.partition(':')
+            if name.strip().lower() == 'content-length': length = int(value)
+        return json.loads(self.process.stdout.read(length).decode('utf-8'))
+
+    def request(self, method, params):
+        self.send(method, params)
+        return self.receive()
+
+    def close(self):
+        self.request('shutdown', None)
+        self.send('exit', None, notification = True)
+        self.process.stdin.close()
+        self.process.wait()
+
+def measure(path, rounds = 3):
+    "Open path in a fresh server, request code actions for every line and print latency stats"
+    with open(path, encoding = 'utf-8') as f:
+        text = f.read()
+    uri = 'file://' + os.path.abspath(path)
+    language_id = profiles.profile_for_path(path).name
+    client = Client()
+    client.request('initialize', {'processId': os.getpid(), 'rootUri': None, 'capabilities': {}})
+    client.send('initialized', {}, notification = True)
+    client.send('textDocument/didOpen', {'textDocument': {'uri': uri, 'languageId': language_id, 'version': 1, 'text': text}}, notification = True)
+
+    num_lines = text.count('\n') + 1
+    for round in range(rounds):
+        latencies = []
+        for row in range(num_lines):
+            start = time.perf_counter()
+            client.request('textDocument/codeAction', {
+                'textDocument': {'uri': uri},
+                'range': {'start': {'line': row, 'character': 0}, 'end': {'line': row, 'character': 0}},
+                'context': {'diagnostics': []}
+            })
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print('round %d: %d requests, median %.2fms, p95 %.2fms, max %.2fms' % (
+            round + 1, len(latencies), latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.95)], latencies[-1]))
+    client.close()
+
+def main(argv):
+    if len(argv) > 2 and argv[1] == '--measure':
+        return measure(argv[2])
+    workers = len(argv) > 2 and argv[1] == '--workers' and int(argv[2]) or DEFAULT_WORKERS
+    LogMagicServer(sys.stdin.buffer, sys.stdout.buffer, workers).serve()
+
+if __name__ == "__main__":
+    main(sys.argv)
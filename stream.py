@@ -0,0 +1,177 @@
+"""
+Streaming JSON-lines interface to the parser.
+
+    python -m LogMagic.stream [--workers N | --cache [PATH]] [--chunk-size N] < requests.jsonl > statements.jsonl
+
+Every input line is either a JSON array `[line, filename, lineno, take_inner, flowtype_enabled[, profile]]`
+or an object with those keys (`line`, `filename`, `lineno`, `take_inner`, `flowtype`, `profile`).
+profile is the name of a language profile (see profiles.py).
+Every output line is `{"statement": ...}` or `{"error": ...}`, in input order.
+With --cache parse results are kept in a persistent cache (see cache.py) between runs.
+"""
+
+import collections, json, os, sys, time
+from . import core
+from . import profiles
+from . import utils
+
+DEFAULT_CHUNK_SIZE = 1000
+
+def parse_request(request):
+    """
+    Turn one JSON-lines request into a create_log_statement argument tuple.
+
+    >>> parse_request('["var foo = 1", "a.js", 3, true, true]')
+    ('var foo = 1', 'a.js', 3, True, True)
+
+    >>> parse_request('{"line": "fn(a)", "lineno": 4, "profile": "python"}')
+    ('fn(a)', '', 4, True, True, 'python')
+    """
+    request = json.loads(request)
+    if isinstance(request, dict):
+        request = [
+            request['line'],
+            request.get('filename', ''),
+            request.get('lineno', 0),
+            request.get('take_inner', True),
+            request.get('flowtype', True),
+            request.get('profile')
+        ]
+    line, filename, lineno, take_inner, flowtype_enabled = request[:5]
+    profile = len(request) > 5 and request[5] or None
+    if profile: profiles.get_profile(profile) # Fail early on unknown profiles
+    parsed = (line, filename, int(lineno), bool(take_inner), bool(flowtype_enabled))
+    return profile and parsed + (profile,) or parsed
+
+def create_statements(parsed, settings, cache = None):
+    """
+    Return a (log statement, exception or None) pair for every create_log_statement argument tuple.
+    The lines are parsed in one batch and only parsed one by one if the batch raised. A line the
+    parser fails on is logged as `filename:lineno`, like lines that run out of their parse budget.
+
+    >>> create_statements([('var foo = 1', 'a.js', 1, True, True), ('fn(a)', 'a.js', 2, True, True, 'nope')], utils.SETTINGS_DEFAULTS)
+    [("console.log('foo', foo)", None), ("console.log('a.js:2')", KeyError('Unknown LogMagic profile nope'))]
+    """
+    try:
+        return [(statement, None) for statement in core.create_log_statements(parsed, settings = settings, cache = cache)]
+    except Exception:
+        pass
+    results = []
+    for line in parsed:
+        try:
+            results.append((core.create_log_statements([line], settings = settings, cache = cache)[0], None))
+        except Exception as e:
+            # Nothing to parse logs `filename:lineno`
+            fallback = core.create_log_statements([('', ) + line[1 : 5]], settings = settings)[0]
+            results.append((fallback, e))
+    return results
+
+def process_chunk(requests, settings, cache = None):
+    """
+    Return the JSON-lines responses for a list of raw requests.
+    A line the parser fails on is answered with its `filename:lineno` statement and the error,
+    the rest of the chunk as usual.
+    """
+    parsed = []
+    errors = {}
+    for (i, request) in enumerate(requests):
+        try:
+            parsed.append(parse_request(request))
+        except Exception as e:
+            errors[i] = 'Invalid request: %s' % e
+    statements = iter(create_statements(parsed, settings, cache))
+    responses = []
+    for i in range(len(requests)):
+        if i in errors:
+            responses.append(json.dumps({'error': errors[i]}))
+            continue
+        (statement, error) = next(statements)
+        response = {'statement': statement}
+        if error is not None: response['error'] = 'Failed: %s: %s' % (type(error).__name__, error)
+        responses.append(json.dumps(response))
+    return responses
+
+def read_chunks(input, chunk_size):
+    "Yield lists of at most chunk_size non-empty lines from input"
+    chunk = []
+    for line in input:
+        if not line.strip(): continue
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+def stream(input, output, workers = 0, chunk_size = DEFAULT_CHUNK_SIZE, settings = None, cache = None):
+    """
+    Answer every request in input on output, in order. Memory is bounded by the chunk size
+    (times twice the number of workers when using a process pool). Returns the number of lines.
+    cache (a cache.ParseCache) is only used without workers.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> stream(io.StringIO('["var foo = 1", "a.js", 1, true, true]\\n\\nnope\\n["{a: []}.then(() => {", "a.js", 2, true, true]\\n'), out)
+    3
+    >>> print(out.getvalue().strip())
+    {"statement": "console.log('foo', foo)"}
+    {"error": "Invalid request: Expecting value: line 1 column 1 (char 0)"}
+    {"statement": "console.log('{a: []}')"}
+    """
+    if settings is None: settings = utils.load_settings()
+    count = 0
+
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        pending = collections.deque()
+        try:
+            for chunk in read_chunks(input, chunk_size):
+                pending.append(pool.apply_async(process_chunk, (chunk, settings)))
+                count += len(chunk)
+                while len(pending) >= workers * 2: # Keep order and bound the amount of buffered work
+                    output.write('\n'.join(pending.popleft().get()) + '\n')
+            while pending:
+                output.write('\n'.join(pending.popleft().get()) + '\n')
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for chunk in read_chunks(input, chunk_size):
+            output.write('\n'.join(process_chunk(chunk, settings, cache)) + '\n')
+            count += len(chunk)
+
+    output.flush()
+    return count
+
+def main(argv):
+    workers = 0
+    chunk_size = DEFAULT_CHUNK_SIZE
+    cache_path = None
+    args = list(argv[1:])
+    while args:
+        arg = args.pop(0)
+        if arg == '--workers': workers = int(args.pop(0))
+        elif arg == '--chunk-size': chunk_size = int(args.pop(0))
+        elif arg == '--cache': cache_path = args and not args[0].startswith('--') and args.pop(0) or ''
+        else:
+            sys.stderr.write('Unknown argument %s\n' % arg)
+            return 2
+    if workers > 1 and cache_path is not None:
+        sys.stderr.write('--cache can not be combined with --workers\n')
+        return 2
+
+    start = time.perf_counter()
+    if cache_path is not None:
+        from . import cache
+        cache_path = cache_path or cache.default_path()
+        if not os.path.isdir(os.path.dirname(cache_path)): os.makedirs(os.path.dirname(cache_path))
+        with cache.ParseCache(cache_path) as parse_cache:
+            count = stream(sys.stdin, sys.stdout, workers, chunk_size, cache = parse_cache)
+    else:
+        count = stream(sys.stdin, sys.stdout, workers, chunk_size)
+    elapsed = time.perf_counter() - start
+    sys.stderr.write('LogMagic: %d lines in %.2fs (%d lines/s)\n' % (count, elapsed, elapsed and count / elapsed or 0))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
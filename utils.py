@@ -1,52 +1,91 @@
-import re
+import itertools, re, threading, time
+from . import patterns
+from . import profiles
 
-LOG_TYPES = ['log', 'info', 'warn', 'error']
 STRING_DELIMITERS =['"', "'", '`']
-PARAM_DELIMITERS = [
-    {'str': ','},
-    {'str': '+'},
-    {'str': '-'},
-    {'str': '*'},
-    {'str': '/'},
-    {'str': '-'},
-    {'str': '&&'},
-    {'str': '||'},
-    {'str': '<'},
-    {'str': '<='},
-    {'str': '>='},
-    {'str': '?='},
-    {'re': r'===', 'len': 3},
-    {'re': r'!==', 'len': 3},
-    {'re': r'==', 'len': 2},
-    {'re': r'(?<!=)>', 'len': 1},
-    {'re': r'(?<=\s)and(?=\s)', 'len': 3},
-    {'re': r'(?<=\s)or(?=\s)', 'len': 2},
-    {'re': r'(?<=\s)is(?=\s)', 'len': 2},
-    {'re': r'(?<=\s)isnt(?=\s)', 'len': 4},
-    {'re': r'(?<=\s)in(?=\s)', 'len': 2}
-]
-INTERESTING_INDICATORS = [
-    ',',
-    '+',
-    '-',
-    '/',
-    '*',
-    '&',
-    '|',
-    '%',
-    {'re': r'(?<=\s)in(?=\s)'},
-    {'re': r'(?<=\s)and(?=\s)'},
-    {'re': r'(?<=\s)or(?=\s)'},
-    {'re': r'(?<=\s)is(?=\s)'},
-    {'re': r'(?<=\s)isnt(?=\s)'}
-]
-PARAM_DELIMITERS_STRIP = ''.join([',','+','-','*','/','-','&&','||','>','<','=='])
-INDENT_ENDINGS = ['{', '=', ':', '->', '=>']
+# Bounds of the window of lines joined into one logical statement (see find_statement)
+MAX_STATEMENT_LINES = 20
+MAX_STATEMENT_CHARS = 2000
+# How far find_function looks up and down from the cursor
+MAX_FUNCTION_LINES = 5000
+# A param consisting only of these characters is empty
+PARAM_EMPTY_CHARS = '"`\'[](){}'
+SETTINGS_DEFAULTS = {
+    'always_log_filename': False,
+    'default_log_level': 'log',
+    'max_identifier_length': 21,
+    'print_trailing_semicolon': False,
+    'max_parse_ms': 100,
+    'live_sync': False,
+    'log_template': '',
+    'log_guard': '',
+    'sample_every': 100,
+    'rate_limit': 10
+}
+
+class ParseBudgetExceeded(Exception):
+    "Raised by tick() when the current parse ran out of its time budget"
+    pass
+
+class ParseBudget(object):
+    """
+    Operation counter with a wall clock deadline that is only checked every CHECK_EVERY operations.
+    Being wall clock time, whether a line makes its deadline depends on what else runs: threads
+    contending for the GIL can make a line run out that parses in time on its own.
+    """
+    CHECK_EVERY = 32
+
+    def __init__(self, max_ms):
+        self.deadline = time.perf_counter() + max_ms / 1000.0
+        self.ops = 0
+
+    def tick(self):
+        self.ops += 1
+        if self.ops % self.CHECK_EVERY == 0 and time.perf_counter() > self.deadline:
+            raise ParseBudgetExceeded(self.ops)
+
+_budget = threading.local()
+
+def start_budget(max_ms):
+    """
+    Start a time budget of max_ms milliseconds for the current thread (no budget if falsy).
+    Returns the previous budget which should be handed to end_budget() when done.
+    """
+    previous = getattr(_budget, 'current', None)
+    _budget.current = max_ms and ParseBudget(max_ms) or None
+    return previous
+
+def end_budget(previous = None):
+    _budget.current = previous
+
+def tick():
+    "Count one unit of parsing work against the current budget, if any"
+    budget = getattr(_budget, 'current', None)
+    if budget: budget.tick()
+
+class Param(object):
+    "A single parsed parameter"
+    __slots__ = ('name', 'type', 'display_key')
+
+    def __init__(self, name, type, display_key = True):
+        self.name = name
+        self.type = type
+        self.display_key = display_key
+
+    def __eq__(self, other):
+        return isinstance(other, Param) and self.name == other.name and self.type == other.type
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Param(%r, %r)' % (self.name, self.type)
 
 def infinite(max_iterations = 200):
     "A generator for use in place of `while True`. Comes with friendly infinite loop protection."
     i = 0
     while i < max_iterations:
+        tick()
         yield True
         i += 1
     raise Exception("Infinite loop protection kicked in (i=%d). Fix your crappy loop!" % i)
@@ -58,6 +97,348 @@ def get_current_lines(view):
         line = view.substr(line_region)
         yield (line_region, line)
 
+def get_selected_lines(view, region):
+    "Return the regions of the lines region covers. A selection of whole lines doesn't cover the line it ends on."
+    import sublime
+    if not region.empty() and view.line(region.end()).a == region.end():
+        region = sublime.Region(region.begin(), region.end() - 1)
+    return view.lines(region)
+
+def scan_balance(line, string = None, comments = ('//',)):
+    """
+    Scan a line for brackets outside of strings and comments. string is the delimiter of a string
+    left open by the previous line. Returns (number of unmatched closing brackets, unmatched opening
+    brackets, delimiter of a string still open at the end of the line, where the code ends).
+    Only template strings (`) can continue on the next line.
+
+    >>> scan_balance('  b: 2}, fn(c, [d // e)')
+    (1, '([', None, 18)
+    >>> scan_balance('  ${a})` + fn(', '`')
+    (0, '(', None, 14)
+    """
+    closers = 0
+    stack = []
+    i = 0
+    length = len(line)
+    while i < length:
+        char = line[i]
+        if string:
+            if char == '\\':
+                i += 2
+                continue
+            if char == string: string = None
+        elif char in STRING_DELIMITERS: string = char
+        elif char in '([{': stack.append(char)
+        elif char in ')]}':
+            if stack: stack.pop()
+            else: closers += 1
+        elif line.startswith(comments, i): break
+        i += 1
+    if string != '`': string = None
+    return closers, ''.join(stack), string, i
+
+def merge_balance(first, second):
+    "Combine the (closers, openers) balance of two consecutive pieces of code"
+    closers = first[0] + max(0, second[0] - len(first[1]))
+    openers = first[1][ : max(0, len(first[1]) - second[0])] + second[1]
+    return closers, openers
+
+def join_statement(parts):
+    """
+    Join the lines of a statement into one line
+
+    >>> join_statement(['function fn(', '  a,', '  b,', ') {'])
+    'function fn(a, b) {'
+    """
+    joined = parts[0].rstrip()
+    for part in parts[1:]:
+        part = part.strip()
+        if not part: continue
+        if part.startswith((')', ']', '}')) and joined.endswith(','): joined = joined[ : -1] # Trailing comma
+        tight = joined.endswith(('(', '[', '{')) or part.startswith((')', ']', '}', ',', '.'))
+        joined += (not tight and ' ' or '') + part.rstrip()
+    return joined
+
+def find_statement(get_line, row, last_row, profile = None):
+    """
+    Find the logical statement around a line that leaves brackets (or template strings) open.
+    get_line(row) returns the line at row, last_row is the last row in the buffer.
+    Returns (first row, last row, the statement joined into one line). The window grows upward while
+    it closes brackets opened above it and downward while it leaves brackets open, a `{` ending the last
+    line being a block. When the statement can't be balanced within MAX_STATEMENT_LINES and
+    MAX_STATEMENT_CHARS the line at row is returned on its own.
+
+    >>> lines = ['const {', '  a,', '  b: [c,', '    d]', '} = fn(e, // comment', '  f) || {}', 'g()']
+    >>> find_statement(lines.__getitem__, 4, 6)
+    (0, 5, 'const {a, b: [c, d]} = fn(e, f) || {}')
+    >>> find_statement(lines.__getitem__, 1, 6)
+    (1, 1, '  a,')
+    >>> find_statement(lines.__getitem__, 2, 3)
+    (2, 3, '  b: [c, d]')
+    >>> find_statement(['fn(a) {', '}'].__getitem__, 0, 1)
+    (0, 0, 'fn(a) {')
+    >>> find_statement((['fn(a,'] * 50 + [')']).__getitem__, 0, 50)
+    (0, 0, 'fn(a,')
+    """
+    comments = profile and profile.comments or ('//',)
+    line = get_line(row)
+    if len(line) > MAX_STATEMENT_CHARS: return row, row, line
+    closers, openers, string, end = scan_balance(line, None, comments)
+    if not closers and not openers and not string: return row, row, line
+    parts = [line[ : end]]
+    size = len(line)
+    first = last = row
+
+    while closers and first > 0 and last - first + 1 < MAX_STATEMENT_LINES:
+        line = get_line(first - 1)
+        size += len(line)
+        if size > MAX_STATEMENT_CHARS: break
+        first -= 1
+        line_closers, line_openers, line_string, end = scan_balance(line, None, comments)
+        closers, openers = merge_balance((line_closers, line_openers), (closers, openers))
+        parts.insert(0, line[ : end])
+    if closers: return row, row, get_line(row)
+
+    def is_open():
+        if string: return True
+        if openers == '{' and parts[-1].rstrip().endswith('{'): return False # Opens a block
+        return bool(openers)
+
+    while is_open() and last < last_row and last - first + 1 < MAX_STATEMENT_LINES:
+        line = get_line(last + 1)
+        size += len(line)
+        if size > MAX_STATEMENT_CHARS: break
+        last += 1
+        line_closers, line_openers, string, end = scan_balance(line, string, comments)
+        closers, openers = merge_balance((closers, openers), (line_closers, line_openers))
+        parts.append(line[ : end])
+    if is_open() or closers: return row, row, get_line(row)
+
+    return first, last, join_statement(parts)
+
+def is_function(input):
+    """
+    Return True if input has a `function (`, `function name(`, `=>` or `->` on its first line.
+    Linear time, the regex `^.*(function\\s*identifier?\\s*\\(|=>|->)` this replaces took quadratic time.
+
+    >>> is_function('var a = function  foo (b) {'), is_function('a.then(b => c)'), is_function('fn(a)')
+    (True, True, False)
+
+    >>> import time
+    >>> start = time.perf_counter()
+    >>> is_function('function' * 20000), is_function('a' + ' =' * 20000 + '\\n=>')
+    (False, False)
+    >>> time.perf_counter() - start < 0.5
+    True
+    """
+    line_end = input.find('\n')
+    if line_end == -1: line_end = len(input)
+    if input.find('=>', 0, line_end) != -1 or input.find('->', 0, line_end) != -1: return True
+    length = len(input)
+    start = input.find('function', 0, line_end)
+    while start != -1:
+        i = start + 8
+        while i < length and input[i].isspace(): i += 1
+        while i < length and input[i] not in patterns.IDENTIFIER_DELIMITERS and not input[i].isspace(): i += 1
+        identifier_end = i
+        while i < length and input[i].isspace(): i += 1
+        if i < length and input[i] == '(': return True
+        # A `function` inside the identifier fails the same way, unless it ends the identifier
+        start = input.find('function', max(start + 1, identifier_end - 8), line_end)
+    return False
+
+def match_call_without_parens(input):
+    """
+    Split coffee's call without parens `foo bar, buzz` into ('foo', 'bar, buzz'). Returns None if input isn't one.
+    Linear time, the regex `^(else if|identifier)\\s+([^\\s=<>()[\\]{}]+.*)\\s*$` this replaces took quadratic time.
+
+    >>> match_call_without_parens('fn a, b'), match_call_without_parens('else if a')
+    (('fn', 'a, b'), ('else if', 'a'))
+    >>> match_call_without_parens('a = b'), match_call_without_parens('fn(a)')
+    (None, None)
+
+    >>> import time
+    >>> start = time.perf_counter()
+    >>> match_call_without_parens('a b' + ' ' * 50000 + '\\nx'), match_call_without_parens('a' * 50000)
+    (None, None)
+    >>> time.perf_counter() - start < 0.5
+    True
+    """
+    length = len(input)
+
+    def arguments(i):
+        "The arguments if input has whitespace and then the start of arguments at i"
+        start = i
+        while i < length and input[i].isspace(): i += 1
+        if i == start or i == length or input[i] in patterns.CALL_ARGS_DELIMITERS: return None
+        line_end = input.find('\n', i)
+        if line_end == -1: return input[i : ]
+        # Only whitespace may follow the first line
+        return not input[line_end : ].strip() and input[i : line_end] or None
+
+    if input.startswith('else if'):
+        args = arguments(7)
+        if args is not None: return ('else if', args)
+    i = 0
+    while i < length and input[i] not in patterns.IDENTIFIER_DELIMITERS and not input[i].isspace(): i += 1
+    args = i and arguments(i) or None
+    return args is not None and (input[ : i], args) or None
+
+def is_flowtype_destructuring(input):
+    """
+    Return True if input is a destructuring with a flowtype like `{a, b}: SomeType`.
+    Linear time replacement of the regex `^{.+}\\s*:\\s*[^\\s()[\\]{}+*/&|=,:~-]+`.
+
+    >>> is_flowtype_destructuring('{a, b}: Props'), is_flowtype_destructuring('{a}: {b: C}'), is_flowtype_destructuring('{}: T')
+    (True, False, False)
+
+    >>> import time
+    >>> start = time.perf_counter()
+    >>> is_flowtype_destructuring('{' + '} :' * 30000), is_flowtype_destructuring('{a}' + ' ' * 30000 + ':')
+    (False, False)
+    >>> time.perf_counter() - start < 0.5
+    True
+    """
+    if not input.startswith('{'): return False
+    length = len(input)
+    line_end = input.find('\n')
+    if line_end == -1: line_end = length
+    brace = input.find('}', 2, line_end)
+    while brace != -1:
+        i = brace + 1
+        while i < length and input[i].isspace(): i += 1
+        if i < length and input[i] == ':':
+            i += 1
+            while i < length and input[i].isspace(): i += 1
+            if i < length and input[i] not in patterns.TYPE_DELIMITERS and not input[i].isspace(): return True
+        # Whatever stopped the scan at i is the next candidate `}` at the earliest
+        brace = input.find('}', max(i, brace + 1), line_end)
+    return False
+
+def rfind_identifier(input, end):
+    """
+    Return where the identifier (see patterns.IDENTIFIER_CHAR) ending at end starts, end if there is none.
+    Linear time, searching for the regex `identifier+$` took quadratic time on long identifiers.
+
+    >>> rfind_identifier('fn(a.b', 6), rfind_identifier('fn(a.b ', 7)
+    (3, 7)
+
+    >>> import time
+    >>> start = time.perf_counter()
+    >>> rfind_identifier('a' * 100000, 100000)
+    0
+    >>> time.perf_counter() - start < 0.5
+    True
+    """
+    start = end
+    while start > 0 and input[start - 1] not in patterns.IDENTIFIER_DELIMITERS and not input[start - 1].isspace():
+        start -= 1
+    return start
+
+def match_arrow_param(input, end):
+    """
+    Match the parameter without parens of an arrow function ending at end, like `x` in `x => ...`.
+    Returns (start of the match, parameter) or None.
+    Linear time, the regex `(identifier+)\\s*\\(?(\\(\\s*\\))?\\s*$` this replaces took quadratic time.
+
+    >>> match_arrow_param('a.then(x => x)', 9), match_arrow_param('f = x => 1', 6), match_arrow_param('(a) => 1', 4)
+    ((7, 'x'), (4, 'x'), None)
+
+    >>> import time
+    >>> start = time.perf_counter()
+    >>> match_arrow_param('a' * 50000 + '+ =>', 50002), match_arrow_param('a' * 50000 + ' =>', 50001)[0]
+    (None, 0)
+    >>> time.perf_counter() - start < 0.5
+    True
+    """
+    i = end
+    while i > 0 and input[i - 1].isspace(): i -= 1
+    if i > 0 and input[i - 1] == ')':
+        i -= 1
+        while i > 0 and input[i - 1].isspace(): i -= 1
+        if not (i > 0 and input[i - 1] == '('): return None
+        i -= 1
+    if i > 0 and input[i - 1] == '(': i -= 1
+    while i > 0 and input[i - 1].isspace(): i -= 1
+    start = rfind_identifier(input, i)
+    if start == i: return None
+    return start, input[start : i]
+
+def opens_function(line):
+    """
+    Return True if the `{` that line ends with opens the body of a function or method
+
+    >>> opens_function('  fetch(url).then((res) => {'), opens_function('async load(a, b) {'), opens_function('if (a) {')
+    (True, True, False)
+    """
+    line = line.rstrip()
+    if not line.endswith('{'): return False
+    return is_function(line) or bool(patterns.METHOD_RE.match(line))
+
+def is_braceless_header(line, profile = None):
+    """
+    Return True if line is an `if (...)`, `else` or loop header without braces, i.e. if whatever
+    is inserted after it becomes its body.
+
+    >>> [is_braceless_header(line) for line in ['  if (a)', '} else if (fn(a)) // b', 'else', 'while (a &&', 'if (a) b()', 'if (a) {', 'iffy(a)']]
+    [True, True, True, True, False, False, False]
+    """
+    comments = profile and profile.comments or ('//',)
+    match = patterns.CONTROL_HEADER_RE.match(line)
+    if not match: return False
+    rest = line[match.end() : ]
+    if match.group(1) not in ('else', 'do'):
+        if not rest.startswith('('): return False
+        parens = find_matching_parens(line, '(', ')', match.end())
+        if not parens: return True # Condition continues on the next line
+        rest = line[parens[1] + 1 : ]
+    rest = rest.strip()
+    return not rest or rest.startswith(comments)
+
+def find_function(get_line, row, last_row, profile = None):
+    """
+    Find the innermost function (or method) whose body in braces contains row, or opens or closes on it.
+    get_line and last_row are like find_statement's. Returns (row opening the body, row closing it)
+    or None. Brackets are matched with scan_balance within
+    MAX_FUNCTION_LINES rows of row.
+
+    >>> lines = ['function outer(a) {', '  if (a) {', '    return fn(x => {', '      return x', '    })', '  }', '  b()', '}']
+    >>> find_function(lines.__getitem__, 6, 7)
+    (0, 7)
+    >>> find_function(lines.__getitem__, 3, 7)
+    (2, 4)
+    >>> find_function(lines.__getitem__, 0, 7), find_function(lines.__getitem__, 7, 7)
+    ((0, 7), (0, 7))
+    >>> find_function(['if (a) {', '  b()', '}'].__getitem__, 1, 2)
+    """
+    comments = profile and profile.comments or ('//',)
+    stack = [] # (bracket, row it was opened on, whether it opens a function body)
+    string = None
+    target = None # (index in stack, row) of the function containing row
+    for current in range(max(0, row - MAX_FUNCTION_LINES), min(last_row, row + MAX_FUNCTION_LINES) + 1):
+        line = get_line(current)
+        closers, openers, string, end = scan_balance(line, string, comments)
+        if current == row:
+            functions = [i for (i, entry) in enumerate(stack) if entry[2]]
+            if functions: target = (functions[-1], stack[functions[-1]][1])
+        del stack[max(0, len(stack) - closers) : ]
+        if target is not None and len(stack) <= target[0]:
+            return target[1], current
+        for (i, bracket) in enumerate(openers):
+            # Only the last `{` of a line like `fn(a => {` is a function body
+            stack.append((bracket, current, i == len(openers) - 1 and bracket == '{' and opens_function(line[ : end])))
+        if current == row and stack and stack[-1][2] and stack[-1][1] == row: target = (len(stack) - 1, row)
+    return None
+
+def expand_statement(view, line_region, profile = None):
+    "Return the region and joined contents of the (possibly multi-line) statement at line_region"
+    import sublime
+    get_line = lambda row: view.substr(view.line(view.text_point(row, 0)))
+    row = view.rowcol(line_region.a)[0]
+    first, last, statement = find_statement(get_line, row, view.rowcol(view.size())[0], profile)
+    if first == last == row: return line_region, statement
+    return sublime.Region(view.text_point(first, 0), view.line(view.text_point(last, 0)).b), statement
+
 def get_setting(name, default = None):
     try:
         import sublime
@@ -66,6 +447,35 @@ def get_setting(name, default = None):
         return default
     return settings.get(name, default)
 
+def load_settings():
+    """
+    Return a snapshot dict of all LogMagic settings, falling back to SETTINGS_DEFAULTS.
+    Read it once and pass it around instead of calling get_setting in hot loops.
+
+    >>> load_settings() == SETTINGS_DEFAULTS
+    True
+    """
+    return dict((name, get_setting(name, default)) for name, default in SETTINGS_DEFAULTS.items())
+
+def read_settings(path):
+    """
+    Return the settings in a LogMagic.sublime-settings file, for the headless tools. Settings it
+    doesn't have fall back to SETTINGS_DEFAULTS. Whole line `//` comments are allowed like in Sublime.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'LogMagic.sublime-settings')
+    >>> with open(path, 'w') as f: n = f.write('{\\n  // Only when debugging\\n  "log_guard": "DEBUG && {statement}"\\n}')
+    >>> settings = read_settings(path)
+    >>> settings['log_guard'], settings['log_template']
+    ('DEBUG && {statement}', '')
+    """
+    import json
+    with open(path, encoding = 'utf-8') as f:
+        text = ''.join(line for line in f if not line.lstrip().startswith('//'))
+    settings = dict(SETTINGS_DEFAULTS)
+    settings.update(json.loads(text))
+    return settings
+
 def find_strings(input):
     """
     Find string literals in string
@@ -150,8 +560,8 @@ def find_not_in_string(input, char, start = 0):
         elif char.get('str'): # {str:...} obj
             index = input.find(char['str'], index)
         else: # {re:...} obj
-            matches = re.search(char['re'], input[index:])
-            index = matches and index + matches.start(0) or -1
+            matches = char['re'].search(input, index)
+            index = matches and matches.start(0) or -1
         if index == -1: return -1
         is_within_string = [True for s in string_ranges if s[0] <= index and s[1] >= index]
         if is_within_string:
@@ -349,12 +759,164 @@ def is_wrapped(input, paren_types = '([{'):
         if parens and parens[0] == 0 and parens[1] == len(input) - 1: return True
     return False
 
-def is_log_statement(line):
-    return line.strip().startswith('console.')
+def is_log_statement(line, profile = None):
+    if profile is None: profile = profiles.default_profile()
+    return profile.is_log_statement(line)
 
-def shorten(input):
-    "Shortens long strings by putting '...' in the middle"
-    max_length = get_setting('max_identifier_length', 21)
+def find_log_statements(text, profile = None, commented = False):
+    """
+    Return a list of (start, end) offsets of the full lines (including newline) in text
+    that are log statements. Plain text version of the remove all command's search.
+    With commented, log statements commented out by find_log_comment_points are included too.
+
+    >>> find_log_statements('a = 1\\n  console.log(a)\\nb = 2\\nconsole.log(b)')
+    [(6, 23), (29, 43)]
+    >>> find_log_statements('console.log(a)\\n// logmagic: console.log(b)\\n', commented = True)
+    [(0, 15), (15, 43)]
+    """
+    if profile is None: profile = profiles.default_profile()
+    matches = list(profile.log_statement_re.finditer(text))
+    if commented:
+        matches = sorted(matches + list(profile.commented_log_re.finditer(text)), key = lambda match: match.start())
+    regions = []
+    for match in matches:
+        end = text.find('\n', match.end())
+        regions.append((match.start(), end == -1 and len(text) or end + 1))
+    return regions
+
+def _is_probe_line(line, profile):
+    "Whether line is the start or end statement of a timing probe, commented out or not"
+    line = line.lstrip(' \t')
+    if line.startswith(profile.log_comment): line = line[len(profile.log_comment) : ]
+    return profile.is_probe(line)
+
+def find_probe_wrappers(lines, profile = None):
+    """
+    Return (start row, row of `} finally {`, dedents) for every try/finally core.wrap_in_timing_probe
+    put around a function body, also with the probe commented out. The wrapper is the start probe,
+    `try {`, the body, `} finally {`, the end probe and `}`. dedents are the (row, width) of the
+    indentation the wrapper added to the body lines. Lines may end with their newline.
+
+    >>> find_probe_wrappers(["  console.time('logmagic:f')", '  try {', '    a()', '', '  } finally {', "    console.timeEnd('logmagic:f')", '  }'])
+    [(0, 4, [(2, 2)])]
+    >>> find_probe_wrappers(["console.time('logmagic:f')", 'try {', 'a()'])
+    []
+    """
+    if profile is None: profile = profiles.default_profile()
+    if not profile.probe_try_finally: return []
+    opening, middle, closing = profile.probe_try_finally
+    lines = [line.rstrip('\r\n') for line in lines]
+    wrappers = []
+    for (row, line) in enumerate(lines[ : -4]):
+        indent = line[ : len(line) - len(line.lstrip(' \t'))]
+        if lines[row + 1] != indent + opening or not _is_probe_line(line, profile): continue
+        (dedents, string, finally_row) = ([], None, None)
+        for body_row in range(row + 2, len(lines) - 2):
+            body_line = lines[body_row]
+            if not string and body_line.strip():
+                if body_line == indent + middle:
+                    finally_row = body_row
+                    break
+                if len(body_line) - len(body_line.lstrip(' \t')) <= len(indent): break # Not part of the body
+                dedents.append(body_row)
+            string = scan_balance(body_line, string, profile.comments)[2]
+        if finally_row is None: continue
+        end_line = lines[finally_row + 1]
+        step = end_line[len(indent) : len(end_line) - len(end_line.lstrip(' \t'))]
+        if not step or lines[finally_row + 2] != indent + closing or not _is_probe_line(end_line, profile): continue
+        wrappers.append((row, finally_row, [(body_row, len(step)) for body_row in dedents if lines[body_row].startswith(indent + step)]))
+    return wrappers
+
+def find_log_removals(text, profile = None):
+    """
+    Return the ascending (start, end) regions of text to erase to remove all log statements (commented
+    out ones included) and the number of log statements among them. The try/finally of timing probes
+    (see find_probe_wrappers) is removed with them and the body it wrapped is dedented again.
+
+    >>> text = "a = 1\\n  console.log(a)\\nfunction f() {\\n  console.time('logmagic:f')\\n  try {\\n    b()\\n  } finally {\\n    console.timeEnd('logmagic:f')\\n  }\\n}"
+    >>> find_log_removals(text)
+    ([(6, 23), (38, 67), (67, 75), (75, 77), (83, 97), (97, 131), (131, 135)], 3)
+    """
+    if profile is None: profile = profiles.default_profile()
+    regions = find_log_statements(text, profile, commented = True)
+    count = len(regions)
+    lines = text.splitlines(True)
+    starts = list(itertools.accumulate([0] + [len(line) for line in lines]))
+    rows = dict((start, row) for (row, start) in enumerate(starts))
+    erased = set(rows[start] for (start, end) in regions)
+    dedents = {}
+    for (row, finally_row, indents) in find_probe_wrappers(lines, profile):
+        if row not in erased or finally_row + 1 not in erased: continue
+        for wrapper_row in (row + 1, finally_row, finally_row + 2):
+            regions.append((starts[wrapper_row], starts[wrapper_row + 1]))
+            erased.add(wrapper_row)
+        for (body_row, width) in indents:
+            dedents[body_row] = dedents.get(body_row, 0) + width # Probes can be nested
+    regions.extend((starts[row], starts[row] + width) for (row, width) in dedents.items() if row not in erased)
+    return sorted(regions), count
+
+def line_positions(text, offsets):
+    """
+    Yield the (row, offset the row starts at) of each of the ascending offsets in text.
+    Newlines are counted from one offset to the next, so it takes one pass over text in all.
+
+    >>> list(line_positions('a\\nbc\\n\\nd', [0, 3, 5, 6]))
+    [(0, 0), (1, 2), (2, 5), (3, 6)]
+    """
+    (row, line_start, previous) = (0, 0, 0)
+    for offset in offsets:
+        newlines = text.count('\n', previous, offset)
+        if newlines:
+            row += newlines
+            line_start = text.rfind('\n', previous, offset) + 1
+        previous = offset
+        yield row, line_start
+
+def find_log_comment_points(text, profile = None):
+    """
+    Return the offsets in text at which inserting profile.log_comment comments out a log statement,
+    i.e. the start of every log statement after its indentation. All lines are found in one search.
+
+    >>> find_log_comment_points('a = 1\\n  console.log(a)\\nconsole.log(b)')
+    [8, 23]
+    """
+    if profile is None: profile = profiles.default_profile()
+    points = []
+    for match in profile.log_statement_re.finditer(text):
+        statement = match.group()
+        points.append(match.start() + len(statement) - len(statement.lstrip(' \t')))
+    return points
+
+def find_log_comments(text, profile = None):
+    """
+    Return the (start, end) offsets of the markers of log statements commented out
+    by find_log_comment_points. Erasing them restores the log statements.
+
+    >>> find_log_comments('a = 1\\n  // logmagic: console.log(a)\\n// console.log(b)')
+    [(8, 21)]
+    """
+    if profile is None: profile = profiles.default_profile()
+    return [match.span(1) for match in profile.commented_log_re.finditer(text)]
+
+def unused_counter_names(text):
+    """
+    Yield names for the counters of sampled and rate limited log statements that aren't used in text
+
+    >>> names = unused_counter_names('if (__logmagic_2) __logmagic_7++')
+    >>> next(names), next(names)
+    ('__logmagic_8', '__logmagic_9')
+    """
+    used = [int(number) for number in profiles.COUNTER_RE.findall(text)]
+    for i in itertools.count(max(used or [0]) + 1):
+        yield profiles.COUNTER_PREFIX + str(i)
+
+def shorten(input, max_length):
+    """
+    Shortens long strings by putting '...' in the middle
+
+    >>> shorten('someVeryLongIdentifier', 12)
+    'someVe...ier'
+    """
     if len(input) <= max_length: return input
     return input[ : max_length - 6] + '...' + input[-3:]
 